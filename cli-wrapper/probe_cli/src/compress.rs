@@ -0,0 +1,271 @@
+use color_eyre::eyre::{bail, eyre, Result, WrapErr};
+use std::{
+    fs::File,
+    io::Write,
+    process::{Child, ChildStdin, Command, Stdio},
+    str::FromStr,
+};
+
+/// Size of the blocks which gzip compresses in parallel.
+///
+/// Each block becomes its own gzip member; any gzip reader concatenates the members, but each
+/// starts with an empty dictionary, so smaller blocks cost some ratio.
+const GZIP_BLOCK_SIZE: usize = 1 << 20;
+
+/// How a PROBE log is compressed, as in `--compression none`, `gzip[:LEVEL]`, or `zstd[:LEVEL]`.
+#[derive(Clone, Copy, Debug, PartialEq, Eq)]
+pub(crate) enum Codec {
+    None,
+    /// Level 0 (store) to 9 (best)
+    Gzip(u32),
+    /// Level 1 to 22; levels above 19 use much more memory
+    Zstd(i32),
+}
+
+impl FromStr for Codec {
+    type Err = String;
+
+    fn from_str(string: &str) -> std::result::Result<Self, Self::Err> {
+        let (name, level) = match string.split_once(':') {
+            Some((name, level)) => (name, Some(level)),
+            None => (string, None),
+        };
+        let parse_level = |default: i64,
+                           range: std::ops::RangeInclusive<i64>|
+         -> std::result::Result<i64, String> {
+            let level = level.map_or(Ok(default), |level| {
+                level
+                    .parse::<i64>()
+                    .map_err(|err| format!("invalid {name} level {level:?}: {err}"))
+            })?;
+            if range.contains(&level) {
+                Ok(level)
+            } else {
+                Err(format!(
+                    "{name} level must be in {}--{}, not {level}",
+                    range.start(),
+                    range.end()
+                ))
+            }
+        };
+        match name {
+            "none" if level.is_none() => Ok(Codec::None),
+            "gzip" => Ok(Codec::Gzip(parse_level(6, 0..=9)? as u32)),
+            "zstd" => Ok(Codec::Zstd(parse_level(3, 1..=22)? as i32)),
+            _ => Err(format!(
+                "unknown compression {string:?}; expected none, gzip[:LEVEL], or zstd[:LEVEL]"
+            )),
+        }
+    }
+}
+
+impl Codec {
+    /// Wrap `file` in an encoder which compresses on up to `jobs` threads.
+    pub(crate) fn encoder(self, file: File, jobs: usize) -> Result<Encoder> {
+        Ok(match self {
+            Codec::None => Encoder::None(file),
+            Codec::Gzip(level) => Encoder::Gzip(GzipEncoder::new(file, level, jobs)),
+            Codec::Zstd(level) => Encoder::Zstd(ZstdEncoder::new(file, level, jobs)?),
+        })
+    }
+}
+
+/// A compressed PROBE log being written.
+///
+/// Unlike dropping it, [`Encoder::finish`] reports errors writing the end of the stream.
+pub(crate) enum Encoder {
+    None(File),
+    Gzip(GzipEncoder),
+    Zstd(ZstdEncoder),
+}
+
+impl Encoder {
+    pub(crate) fn finish(self) -> Result<()> {
+        match self {
+            Encoder::None(mut file) => file.flush()?,
+            Encoder::Gzip(encoder) => encoder.finish()?,
+            Encoder::Zstd(encoder) => encoder.finish()?,
+        }
+        Ok(())
+    }
+}
+
+impl Write for Encoder {
+    fn write(&mut self, buf: &[u8]) -> std::io::Result<usize> {
+        match self {
+            Encoder::None(file) => file.write(buf),
+            Encoder::Gzip(encoder) => encoder.write(buf),
+            Encoder::Zstd(encoder) => encoder.write(buf),
+        }
+    }
+
+    fn flush(&mut self) -> std::io::Result<()> {
+        match self {
+            Encoder::None(file) => file.flush(),
+            Encoder::Gzip(encoder) => encoder.flush(),
+            Encoder::Zstd(encoder) => encoder.flush(),
+        }
+    }
+}
+
+/// Compresses blocks of [`GZIP_BLOCK_SIZE`] bytes as independent gzip members, `jobs` blocks at a
+/// time.
+pub(crate) struct GzipEncoder {
+    file: File,
+    level: flate2::Compression,
+    jobs: usize,
+    /// Full blocks, and the one being filled
+    blocks: Vec<Vec<u8>>,
+}
+
+impl GzipEncoder {
+    fn new(file: File, level: u32, jobs: usize) -> Self {
+        Self {
+            file,
+            level: flate2::Compression::new(level),
+            jobs: jobs.max(1),
+            blocks: vec![Vec::with_capacity(GZIP_BLOCK_SIZE)],
+        }
+    }
+
+    /// Compress and write every block, including a partial last one.
+    fn compress_blocks(&mut self) -> std::io::Result<()> {
+        let level = self.level;
+        let members = std::thread::scope(|scope| {
+            self.blocks
+                .iter()
+                .filter(|block| !block.is_empty())
+                .map(|block| {
+                    scope.spawn(move || {
+                        let mut encoder =
+                            flate2::write::GzEncoder::new(Vec::with_capacity(block.len()), level);
+                        encoder.write_all(block)?;
+                        encoder.finish()
+                    })
+                })
+                .collect::<Vec<_>>()
+                .into_iter()
+                .map(|worker| worker.join().expect("a gzip worker panicked"))
+                .collect::<std::io::Result<Vec<_>>>()
+        })?;
+        for member in members {
+            self.file.write_all(&member)?;
+        }
+        self.blocks.truncate(1);
+        self.blocks[0].clear();
+        Ok(())
+    }
+
+    fn finish(mut self) -> std::io::Result<()> {
+        self.compress_blocks()?;
+        self.file.flush()
+    }
+}
+
+impl Write for GzipEncoder {
+    fn write(&mut self, buf: &[u8]) -> std::io::Result<usize> {
+        let block = self
+            .blocks
+            .last_mut()
+            .expect("there is always a block being filled");
+        let len = buf.len().min(GZIP_BLOCK_SIZE - block.len());
+        block.extend_from_slice(&buf[..len]);
+        if block.len() == GZIP_BLOCK_SIZE {
+            if self.blocks.len() == self.jobs {
+                self.compress_blocks()?;
+            } else {
+                self.blocks.push(Vec::with_capacity(GZIP_BLOCK_SIZE));
+            }
+        }
+        Ok(len)
+    }
+
+    /// Blocks are only compressed once full (or at [`GzipEncoder::finish`]), so as not to waste
+    /// ratio on tiny gzip members.
+    fn flush(&mut self) -> std::io::Result<()> {
+        Ok(())
+    }
+}
+
+/// Pipes through the `zstd` executable (`$PROBE_ZSTD`, or `zstd` on the `PATH`), which
+/// compresses on `jobs` threads.
+pub(crate) struct ZstdEncoder {
+    child: Child,
+    stdin: ChildStdin,
+}
+
+impl ZstdEncoder {
+    fn new(file: File, level: i32, jobs: usize) -> Result<Self> {
+        let zstd = std::env::var_os("PROBE_ZSTD").unwrap_or_else(|| "zstd".into());
+        let mut command = Command::new(&zstd);
+        command
+            .arg("--quiet")
+            .arg("--stdout")
+            .arg(format!("-T{}", jobs.max(1)));
+        if level > 19 {
+            command.arg("--ultra");
+        }
+        command
+            .arg(format!("-{level}"))
+            .stdin(Stdio::piped())
+            .stdout(file);
+        let mut child = command.spawn().wrap_err(eyre!(
+            "Failed to start {zstd:?} (set PROBE_ZSTD or use --compression gzip)"
+        ))?;
+        let stdin = child.stdin.take().expect("stdin is piped");
+        Ok(Self { child, stdin })
+    }
+
+    fn finish(self) -> Result<()> {
+        let Self { mut child, stdin } = self;
+        drop(stdin);
+        let status = child.wait()?;
+        if !status.success() {
+            bail!("zstd failed: {status}");
+        }
+        Ok(())
+    }
+}
+
+impl Write for ZstdEncoder {
+    fn write(&mut self, buf: &[u8]) -> std::io::Result<usize> {
+        self.stdin.write(buf)
+    }
+
+    fn flush(&mut self) -> std::io::Result<()> {
+        self.stdin.flush()
+    }
+}
+
+#[cfg(test)]
+#[test]
+fn parse_codec() {
+    assert_eq!("none".parse::<Codec>(), Ok(Codec::None));
+    assert_eq!("gzip".parse::<Codec>(), Ok(Codec::Gzip(6)));
+    assert_eq!("gzip:1".parse::<Codec>(), Ok(Codec::Gzip(1)));
+    assert_eq!("zstd".parse::<Codec>(), Ok(Codec::Zstd(3)));
+    assert_eq!("zstd:19".parse::<Codec>(), Ok(Codec::Zstd(19)));
+    assert!("gzip:10".parse::<Codec>().is_err());
+    assert!("zstd:fast".parse::<Codec>().is_err());
+    assert!("none:1".parse::<Codec>().is_err());
+    assert!("bzip2".parse::<Codec>().is_err());
+}
+
+#[cfg(test)]
+#[test]
+fn gzip_members_concatenate() {
+    use std::io::{Read, Seek};
+    let bytes = (0..3 * GZIP_BLOCK_SIZE + 17)
+        .map(|idx| (idx % 251) as u8)
+        .collect::<Vec<_>>();
+    let mut file = tempfile::tempfile().unwrap();
+    let mut encoder = GzipEncoder::new(file.try_clone().unwrap(), 1, 2);
+    encoder.write_all(&bytes).unwrap();
+    encoder.finish().unwrap();
+    file.rewind().unwrap();
+    let mut decoded = Vec::new();
+    flate2::read::MultiGzDecoder::new(file)
+        .read_to_end(&mut decoded)
+        .unwrap();
+    assert_eq!(decoded, bytes);
+}
@@ -1,6 +1,5 @@
 use clap::{arg, command, value_parser, Command};
 use color_eyre::eyre::{eyre, Context, Result};
-use flate2::Compression;
 use std::{
     ffi::OsString,
     fs::File,
@@ -9,6 +8,8 @@ use std::{
     process::{ExitCode, ExitStatus},
 };
 
+mod compress;
+
 mod record;
 
 mod transcribe;
@@ -43,6 +44,41 @@ fn inner_main() -> Result<ExitStatus> {
                         .required(false)
                         .value_parser(value_parser!(probe_headers::CopyFiles))
                         .default_value("none"),
+                    arg!(--"copy-files-async-min-size" <BYTES> "Copy files which are only read and at least this big on a background thread, rather than while the program waits in open; 0 never does. [default: 0]")
+                        .required(false)
+                        .value_parser(value_parser!(usize)),
+                    arg!(--"arena-initial-size" <BYTES> "Size of the first op/data arena of each thread; later arenas double in size.")
+                        .required(false)
+                        .value_parser(value_parser!(usize)),
+                    arg!(--"arena-max-size" <BYTES> "Largest size an op/data arena will grow to.")
+                        .required(false)
+                        .value_parser(value_parser!(usize)),
+                    arg!(--flush <FLUSH_MODE> "Whether to msync arenas synchronously at every exec and thread exit, or only at process exit.")
+                        .required(false)
+                        .value_parser(value_parser!(probe_headers::FlushMode))
+                        .default_value("async"),
+                    arg!(--ops <OPS> "Comma-separated categories of ops to record; process ops are always recorded. [default: all]")
+                        .required(false)
+                        .value_parser(value_parser!(probe_headers::OpCategory))
+                        .value_delimiter(','),
+                    arg!(--summary "Record per-(process, inode) access summaries instead of individual file ops; for long-running services.")
+                        .required(false)
+                        .value_parser(value_parser!(bool)),
+                    arg!(--"summary-interval" <SECONDS> "With --summary, also flush the summaries this often; 0 flushes only at exec and exit.")
+                        .required(false)
+                        .requires("summary")
+                        .value_parser(value_parser!(u32))
+                        .default_value("60"),
+                    arg!(--"max-size" <BYTES> "Bound the recording to roughly this many bytes by discarding the oldest file ops of each thread; process structure is always kept.")
+                        .required(false)
+                        .value_parser(value_parser!(usize)),
+                    arg!(-j --jobs <N> "Number of threads to transcribe with. [default: number of cores]")
+                        .required(false)
+                        .value_parser(value_parser!(usize)),
+                    arg!(--compression <CODEC> "How to compress the PROBE log: none, gzip[:LEVEL], or zstd[:LEVEL]; gzip and zstd compress on --jobs threads.")
+                        .required(false)
+                        .value_parser(value_parser!(compress::Codec))
+                        .default_value("gzip"),
                     arg!(<CMD> ... "Command to execute under provenance.")
                         .required(true)
                         .trailing_var_arg(true)
@@ -62,6 +98,13 @@ fn inner_main() -> Result<ExitStatus> {
                         .required(false)
                         .default_value("probe_record")
                         .value_parser(value_parser!(PathBuf)),
+                    arg!(-j --jobs <N> "Number of threads to transcribe with. [default: number of cores]")
+                        .required(false)
+                        .value_parser(value_parser!(usize)),
+                    arg!(--compression <CODEC> "How to compress the PROBE log: none, gzip[:LEVEL], or zstd[:LEVEL]; gzip and zstd compress on --jobs threads.")
+                        .required(false)
+                        .value_parser(value_parser!(compress::Codec))
+                        .default_value("gzip"),
                 ])
                 .about("Convert PROBE records to PROBE logs."),
             Command::new("py").arg(
@@ -85,16 +128,58 @@ fn inner_main() -> Result<ExitStatus> {
                 .get_one::<probe_headers::CopyFiles>("copy-files")
                 .cloned()
                 .unwrap_or(probe_headers::CopyFiles::Lazily);
+            let copy_files_async_min_size = sub
+                .get_one::<usize>("copy-files-async-min-size")
+                .cloned()
+                .unwrap_or(0);
+            let arena_initial_size = sub
+                .get_one::<usize>("arena-initial-size")
+                .cloned()
+                .unwrap_or(probe_headers::DEFAULT_ARENA_INITIAL_SIZE);
+            let arena_max_size = sub
+                .get_one::<usize>("arena-max-size")
+                .cloned()
+                .unwrap_or(probe_headers::DEFAULT_ARENA_MAX_SIZE);
+            let flush_mode = sub
+                .get_one::<probe_headers::FlushMode>("flush")
+                .cloned()
+                .unwrap_or(probe_headers::FlushMode::Async);
+            let recorded_op_categories = match sub.get_many::<probe_headers::OpCategory>("ops") {
+                Some(categories) => probe_headers::OpCategory::mask(categories),
+                None => probe_headers::OpCategory::all_mask(),
+            };
+            let summary_interval = if sub.get_flag("summary") {
+                sub.get_one::<u32>("summary-interval").cloned()
+            } else {
+                None
+            };
+            let arena_budget = sub.get_one::<usize>("max-size").cloned().unwrap_or(0);
+            let jobs = sub
+                .get_one::<usize>("jobs")
+                .cloned()
+                .unwrap_or_else(transcribe::default_jobs);
+            let compression = *sub.get_one::<compress::Codec>("compression").unwrap();
             let cmd = sub
                 .get_many::<OsString>("CMD")
                 .unwrap()
                 .cloned()
                 .collect::<Vec<_>>();
 
+            let recorder = record::Recorder::new(cmd)
+                .gdb(gdb)
+                .debug(debug)
+                .copy_files(copy_files)
+                .copy_files_async_min_size(copy_files_async_min_size)
+                .arena_sizes(arena_initial_size, arena_max_size)
+                .flush_mode(flush_mode)
+                .recorded_op_categories(recorded_op_categories)
+                .summary(summary_interval)
+                .arena_budget(arena_budget);
+
             if no_transcribe {
-                record::record_no_transcribe(output, overwrite, gdb, debug, copy_files, cmd)
+                record::record_no_transcribe(recorder, output, overwrite)
             } else {
-                record::record_transcribe(output, overwrite, gdb, debug, copy_files, cmd)
+                record::record_transcribe(recorder, output, overwrite, jobs, compression)
             }
             .wrap_err("Record command failed")
         }
@@ -102,6 +187,11 @@ fn inner_main() -> Result<ExitStatus> {
             let overwrite = sub.get_flag("overwrite");
             let output = sub.get_one::<PathBuf>("output").unwrap().clone();
             let input = sub.get_one::<PathBuf>("input").unwrap().clone();
+            let jobs = sub
+                .get_one::<usize>("jobs")
+                .cloned()
+                .unwrap_or_else(transcribe::default_jobs);
+            let compression = *sub.get_one::<compress::Codec>("compression").unwrap();
 
             if overwrite {
                 File::create(&output)
@@ -109,10 +199,10 @@ fn inner_main() -> Result<ExitStatus> {
                 File::create_new(&output)
             }
             .wrap_err("Failed to create output file")
-            .map(|file| {
-                tar::Builder::new(flate2::write::GzEncoder::new(file, Compression::default()))
-            })
-            .and_then(|mut tar| transcribe::transcribe_to_tar(input, &mut tar))
+            .and_then(|file| compression.encoder(file, jobs))
+            .map(tar::Builder::new)
+            .and_then(|tar| transcribe::transcribe_to_tar(input, tar, jobs))
+            .and_then(|encoder| encoder.finish())
             .wrap_err("Transcribe command failed")?;
 
             Ok(ExitStatus::from_raw(0))
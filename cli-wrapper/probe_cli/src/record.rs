@@ -1,5 +1,4 @@
 use color_eyre::eyre::{bail, eyre, Result, WrapErr};
-use flate2::Compression;
 use memory_parsing::ToMemory;
 use std::{
     ffi::OsString,
@@ -7,22 +6,20 @@ use std::{
     os::unix::process::ExitStatusExt,
     path::{Path, PathBuf},
     process::ExitStatus,
+    sync::mpsc,
     thread,
     time::Duration,
 };
 
-use crate::transcribe;
+use crate::{compress, transcribe};
 
 // TODO: modularize and improve ergonomics (maybe expand builder pattern?)
 
-/// create a probe record directory from command arguments
+/// run `recorder`, moving its record directory to `output`
 pub fn record_no_transcribe(
+    recorder: Recorder,
     output: Option<PathBuf>,
     overwrite: bool,
-    gdb: bool,
-    debug: bool,
-    copy_files: probe_headers::CopyFiles,
-    cmd: Vec<OsString>,
 ) -> Result<ExitStatus> {
     let output = match output {
         Some(x) => x,
@@ -39,12 +36,7 @@ pub fn record_no_transcribe(
         }
     }
 
-    let (status, dir) = Recorder::new(cmd)
-        .gdb(gdb)
-        .debug(debug)
-        .copy_files(copy_files)
-        .record()
-        .wrap_err("Recorder::record")?;
+    let (status, dir) = recorder.record().wrap_err("Recorder::record")?;
 
     fs_extra::dir::move_dir(&dir, &output, &fs_extra::dir::CopyOptions::new()).wrap_err(eyre!(
         "moving {:?} to {:?}",
@@ -55,14 +47,13 @@ pub fn record_no_transcribe(
     Ok(status)
 }
 
-/// create a probe log file from command arguments
+/// run `recorder`, transcribing its record directory into a probe log file at `output`
 pub fn record_transcribe(
+    recorder: Recorder,
     output: Option<PathBuf>,
     overwrite: bool,
-    gdb: bool,
-    debug: bool,
-    copy_files: probe_headers::CopyFiles,
-    cmd: Vec<OsString>,
+    jobs: usize,
+    compression: compress::Codec,
 ) -> Result<ExitStatus> {
     let output = match output {
         Some(x) => x,
@@ -81,15 +72,27 @@ pub fn record_transcribe(
 
     let file = File::create_new(&output).wrap_err("Failed to create output file")?;
 
-    let mut tar = tar::Builder::new(flate2::write::GzEncoder::new(file, Compression::default()));
+    let tar = tar::Builder::new(compression.encoder(file, jobs)?);
 
-    let (status, record_dir) = Recorder::new(cmd)
-        .gdb(gdb)
-        .debug(debug)
-        .copy_files(copy_files)
-        .record()?;
+    // Threads that finish while the command runs are transcribed in the background, so only the
+    // stragglers are left for after it exits.
+    let (status, record_dir, (transcriber, background_result)) =
+        recorder.record_with(|record_dir, exited| {
+            let mut transcriber = transcribe::Transcriber::new(tar, jobs);
+            let result = transcriber.transcribe_until_disconnected(record_dir, exited);
+            (transcriber, result)
+        })?;
 
-    match transcribe::transcribe_to_tar(&record_dir, &mut tar) {
+    if let Err(e) = background_result {
+        // Only writing the archive stops background transcription; threads it could not transcribe
+        // are left for finish, which retries them and reports any error properly.
+        log::warn!("Background transcription stopped: {e:?}");
+    }
+
+    match transcriber
+        .finish(&record_dir)
+        .and_then(|encoder| encoder.finish())
+    {
         Ok(_) => Ok(status),
         Err(e) => {
             log::error!(
@@ -109,6 +112,13 @@ pub struct Recorder {
     gdb: bool,
     debug: bool,
     copy_files: probe_headers::CopyFiles,
+    copy_files_async_min_size: usize,
+    arena_initial_size: usize,
+    arena_max_size: usize,
+    flush_mode: probe_headers::FlushMode,
+    recorded_op_categories: u8,
+    summary_interval: Option<u32>,
+    arena_budget: usize,
     cmd: Vec<OsString>,
 }
 
@@ -116,6 +126,33 @@ impl Recorder {
     /// runs the built recorder, on success returns the PID of launched process and the TempDir it
     /// was recorded into
     pub fn record(self) -> Result<(ExitStatus, tempfile::TempDir)> {
+        let (child, record_dir) = self.spawn()?;
+        Ok((wait(child)?, record_dir))
+    }
+
+    /// Like [`Recorder::record`], but concurrently runs `background` on the record directory.
+    ///
+    /// `background` also gets a receiver which is disconnected once the recorded process exits;
+    /// its return value is returned after it does.
+    pub fn record_with<R: Send>(
+        self,
+        background: impl FnOnce(&Path, mpsc::Receiver<()>) -> R + Send,
+    ) -> Result<(ExitStatus, tempfile::TempDir, R)> {
+        let (child, record_dir) = self.spawn()?;
+        let (exited_sender, exited) = mpsc::channel::<()>();
+        let (exit, ret) = thread::scope(|scope| {
+            let path = record_dir.path();
+            let handle = scope.spawn(move || background(path, exited));
+            let exit = wait(child);
+            drop(exited_sender);
+            (exit, handle.join())
+        });
+        let ret = ret.map_err(|_| eyre!("Background thread panicked"))?;
+        Ok((exit?, record_dir, ret))
+    }
+
+    /// Set up the record directory and launch the command.
+    fn spawn(self) -> Result<(std::process::Child, tempfile::TempDir)> {
         // reading and canonicalizing path to libprobe
         let libprobe_path = fs::canonicalize(match std::env::var_os("PROBE_LIB") {
             Some(x) => {
@@ -157,9 +194,17 @@ impl Recorder {
             libprobe_path: probe_headers::FixedPath::from_path_ref(libprobe_path)
                 .map_err(|e| eyre!("{e:?}"))?,
             copy_files: self.copy_files,
+            copy_files_async_min_size: self.copy_files_async_min_size,
             parent_of_root: std::process::id(),
             working_directory: probe_headers::FixedPath::from_path_ref(std::env::current_dir()?)
                 .map_err(|e| eyre!("{e:?}"))?,
+            arena_initial_size: self.arena_initial_size,
+            arena_max_size: self.arena_max_size,
+            flush_mode: self.flush_mode,
+            recorded_op_categories: self.recorded_op_categories,
+            summary: self.summary_interval.is_some(),
+            summary_interval: self.summary_interval.unwrap_or(0),
+            arena_budget: self.arena_budget,
         };
         let mut ptc_mem = memory_parsing::Segments::single(
             0,
@@ -173,7 +218,7 @@ impl Recorder {
             .join(probe_headers::PROCESS_TREE_CONTEXT_FILE);
         std::fs::write(ptc_file, ptc_bytes)?;
 
-        let mut child = if self.gdb {
+        let child = if self.gdb {
             std::process::Command::new("gdb")
                 .arg(concat_osstrings([
                     OsString::from("--init-eval-command=set environment "),
@@ -229,26 +274,7 @@ impl Recorder {
             }
         }
 
-        // OPTIMIZE: consider background serialization of ops as threads/processes exit instead of
-        // waiting until the end; large increase to complexity but potentially huge gains.
-        let exit = child.wait().wrap_err("Failed to await child process")?;
-        if !exit.success() {
-            match exit.code() {
-                Some(code) => log::warn!("Recorded process exited with code {code}"),
-                None => match exit.signal() {
-                    Some(sig) => {
-                        if sig < libc::SIGRTMAX() {
-                            log::warn!("Recorded process exited with realtime signal {sig:?}");
-                        } else {
-                            log::warn!("Recorded process exited with signal {sig:?}");
-                        }
-                    }
-                    None => log::warn!("Recorded process exited with unknown error"),
-                },
-            }
-        }
-
-        Ok((exit, record_dir))
+        Ok((child, record_dir))
     }
 
     /// Create new [`Recorder`] from a command and the directory where it should write the probe
@@ -261,6 +287,13 @@ impl Recorder {
             debug: false,
             cmd,
             copy_files: probe_headers::CopyFiles::Lazily,
+            copy_files_async_min_size: 0,
+            arena_initial_size: probe_headers::DEFAULT_ARENA_INITIAL_SIZE,
+            arena_max_size: probe_headers::DEFAULT_ARENA_MAX_SIZE,
+            flush_mode: probe_headers::FlushMode::Async,
+            recorded_op_categories: probe_headers::OpCategory::all_mask(),
+            summary_interval: None,
+            arena_budget: 0,
         }
     }
 
@@ -280,6 +313,65 @@ impl Recorder {
         self.copy_files = copy_files;
         self
     }
+
+    /// Set the size in bytes from which files that are only read get copied in the background; 0
+    /// copies every file before the open that triggered the copy returns.
+    pub fn copy_files_async_min_size(mut self, copy_files_async_min_size: usize) -> Self {
+        self.copy_files_async_min_size = copy_files_async_min_size;
+        self
+    }
+
+    /// Set the size in bytes of each thread's first arena and the cap on its geometric growth.
+    pub fn arena_sizes(mut self, initial: usize, max: usize) -> Self {
+        self.arena_initial_size = initial;
+        self.arena_max_size = max.max(initial);
+        self
+    }
+
+    /// Set how arenas are synced at exec and thread exit.
+    pub fn flush_mode(mut self, flush_mode: probe_headers::FlushMode) -> Self {
+        self.flush_mode = flush_mode;
+        self
+    }
+
+    /// Set which categories of ops libprobe records (see [`probe_headers::OpCategory::mask`]).
+    pub fn recorded_op_categories(mut self, recorded_op_categories: u8) -> Self {
+        self.recorded_op_categories = recorded_op_categories;
+        self
+    }
+
+    /// Set whether to record per-(process, inode) access summaries instead of individual file ops,
+    /// and if so, how often (in seconds) to flush them; `Some(0)` flushes only at exec and exit.
+    pub fn summary(mut self, summary_interval: Option<u32>) -> Self {
+        self.summary_interval = summary_interval;
+        self
+    }
+
+    /// Set the approximate bound in bytes on the arenas of the whole recording; 0 means unbounded.
+    pub fn arena_budget(mut self, arena_budget: usize) -> Self {
+        self.arena_budget = arena_budget;
+        self
+    }
+}
+
+fn wait(mut child: std::process::Child) -> Result<ExitStatus> {
+    let exit = child.wait().wrap_err("Failed to await child process")?;
+    if !exit.success() {
+        match exit.code() {
+            Some(code) => log::warn!("Recorded process exited with code {code}"),
+            None => match exit.signal() {
+                Some(sig) => {
+                    if sig < libc::SIGRTMAX() {
+                        log::warn!("Recorded process exited with realtime signal {sig:?}");
+                    } else {
+                        log::warn!("Recorded process exited with signal {sig:?}");
+                    }
+                }
+                None => log::warn!("Recorded process exited with unknown error"),
+            },
+        }
+    }
+    Ok(exit)
 }
 
 fn concat_osstrings<const SIZE: usize>(strings: [OsString; SIZE]) -> OsString {
@@ -1,108 +1,282 @@
 use color_eyre::eyre::{eyre, Result, WrapErr};
-use std::path::Path;
+use std::collections::HashSet;
+use std::path::{Path, PathBuf};
+use std::sync::mpsc;
+use std::time::Duration;
 
+/// How often the background transcriber looks for threads that have finished.
+const POLL_INTERVAL: Duration = Duration::from_millis(200);
+
+/// Returns the writer the archive was written to, so that its compression can be finished.
 pub(crate) fn transcribe_to_tar<P: AsRef<Path>, T: std::io::Write>(
     record_dir: P,
-    tar: &mut tar::Builder<T>,
-) -> Result<()> {
-    let log_dir = tempfile::TempDir::new()?;
-    transcribe_to_dir(record_dir, &log_dir)?;
-    tar.append_dir_all(".", &log_dir)?;
-    tar.finish()?;
-    Ok(())
+    tar: tar::Builder<T>,
+    jobs: usize,
+) -> Result<T> {
+    Transcriber::new(tar, jobs).finish(record_dir)
 }
 
-fn transcribe_to_dir<P1: AsRef<Path>, P2: AsRef<Path>>(in_dir: P1, out_dir: P2) -> Result<()> {
-    transcribe_process_tree_context(&in_dir, &out_dir)?;
-    copy_inodes(&in_dir, &out_dir)?;
-    transcribe_ops(&in_dir, &out_dir)?;
-    Ok(())
+/// One transcription job per available core.
+pub(crate) fn default_jobs() -> usize {
+    std::thread::available_parallelism()
+        .map(|jobs| jobs.get())
+        .unwrap_or(1)
 }
 
-fn transcribe_process_tree_context<P1: AsRef<Path>, P2: AsRef<Path>>(
-    in_dir: P1,
-    out_dir: P2,
-) -> Result<()> {
-    let ptc_file = in_dir
-        .as_ref()
-        .join(probe_headers::PROCESS_TREE_CONTEXT_FILE);
-    let ptc_mem = memory_parsing::Segments::single(0, std::fs::read(ptc_file)?);
-    let ptc = <probe_headers::ProcessTreeContext as memory_parsing::FromMemory>::from_memory(
-        &ptc_mem, 0,
-    )?
-    .0;
-    let mut file = std::fs::OpenOptions::new()
-        .create_new(true)
-        .write(true)
-        .open(out_dir.as_ref().join("process_tree_context.msgpack"))?;
-    let mut serializer = rmp_serde::encode::Serializer::new(&mut file).with_struct_map();
-    use serde::Serialize;
-    ptc.serialize(&mut serializer)?;
-    Ok(())
+/// Appends a PROBE log to a tar archive, one thread at a time.
+///
+/// The threads which have finished can be transcribed while the recorded command is still running
+/// (see [`Transcriber::transcribe_until_disconnected`]), so that only the stragglers are left for
+/// [`Transcriber::finish`].
+///
+/// Threads are parsed on up to `jobs` worker threads, but only the calling thread writes to the
+/// archive.
+pub(crate) struct Transcriber<T: std::io::Write> {
+    tar: tar::Builder<T>,
+    jobs: usize,
+    /// Directories already in the archive
+    dirs: HashSet<PathBuf>,
+    /// Thread (ops) files already in the archive
+    tids: HashSet<PathBuf>,
 }
 
-fn copy_inodes<P1: AsRef<Path>, P2: AsRef<Path>>(in_dir: P1, out_dir: P2) -> Result<()> {
-    let inodes_in_dir = in_dir.as_ref().join(probe_headers::INODES_SUBDIR);
-    let inodes_out_dir = out_dir.as_ref().join(probe_headers::INODES_SUBDIR);
-    std::fs::create_dir(&inodes_out_dir)?;
-    std::fs::read_dir(inodes_in_dir.clone())?
-        .map(|inode_contents| {
-            let name = inode_contents?.file_name();
-            std::fs::hard_link(inodes_in_dir.join(name.clone()), inodes_out_dir.join(name))?;
-            Ok(1usize)
-        })
-        .collect::<Result<Vec<_>>>()?;
-    Ok(())
-}
+impl<T: std::io::Write> Transcriber<T> {
+    pub(crate) fn new(tar: tar::Builder<T>, jobs: usize) -> Self {
+        Self {
+            tar,
+            jobs: jobs.max(1),
+            dirs: HashSet::new(),
+            tids: HashSet::new(),
+        }
+    }
 
-fn transcribe_ops<P1: AsRef<Path>, P2: AsRef<Path>>(in_dir: P1, out_dir: P2) -> Result<()> {
-    let pids_out_dir = out_dir.as_ref().join(probe_headers::PIDS_SUBDIR);
-    std::fs::create_dir(&pids_out_dir)?;
-    std::fs::read_dir(in_dir.as_ref().join(probe_headers::PIDS_SUBDIR))?
-        .map(|entry| {
-            let pid_in_dir = entry?.path();
-            let pid = filename_numeric(&pid_in_dir)?;
-            let pid_out_dir = pids_out_dir.join(pid.to_string());
-            transcribe_pid(&pid_in_dir, pid_out_dir)
+    /// Transcribe the threads which have finished, every [`POLL_INTERVAL`], until `exited` is
+    /// disconnected (i.e., the recorded command exited).
+    ///
+    /// A thread which can't be transcribed yet is skipped, and left for [`Transcriber::finish`]
+    /// to retry and report; only errors writing the archive stop this early.
+    pub(crate) fn transcribe_until_disconnected<P: AsRef<Path>>(
+        &mut self,
+        record_dir: P,
+        exited: mpsc::Receiver<()>,
+    ) -> Result<()> {
+        loop {
+            let count = self.transcribe_tids(&record_dir, false)?;
+            if count != 0 {
+                log::debug!("Transcribed {count} finished threads in the background");
+            }
+            match exited.recv_timeout(POLL_INTERVAL) {
+                Err(mpsc::RecvTimeoutError::Timeout) => continue,
+                _ => return Ok(()),
+            }
+        }
+    }
+
+    /// Transcribe every thread not already transcribed, the process tree context, and the inodes,
+    /// then finish the archive and return the writer underneath it.
+    pub(crate) fn finish<P: AsRef<Path>>(mut self, record_dir: P) -> Result<T> {
+        self.append_dirs(Path::new(probe_headers::PIDS_SUBDIR))?;
+        self.transcribe_tids(&record_dir, true)?;
+        self.transcribe_process_tree_context(&record_dir)?;
+        self.copy_inodes(&record_dir)?;
+        Ok(self.tar.into_inner()?)
+    }
+
+    fn transcribe_process_tree_context<P: AsRef<Path>>(&mut self, record_dir: P) -> Result<()> {
+        let ptc_file = record_dir
+            .as_ref()
+            .join(probe_headers::PROCESS_TREE_CONTEXT_FILE);
+        let ptc_mem = memory_parsing::Segments::single(0, std::fs::read(ptc_file)?);
+        let ptc = <probe_headers::ProcessTreeContext as memory_parsing::FromMemory>::from_memory(
+            &ptc_mem, 0,
+        )?
+        .0;
+        let mut bytes = Vec::new();
+        let mut serializer = rmp_serde::encode::Serializer::new(&mut bytes).with_struct_map();
+        use serde::Serialize;
+        ptc.serialize(&mut serializer)?;
+        self.append_file(
+            Path::new("process_tree_context.msgpack"),
+            bytes.len() as u64,
+            bytes.as_slice(),
+        )
+    }
+
+    fn copy_inodes<P: AsRef<Path>>(&mut self, record_dir: P) -> Result<()> {
+        let inodes_in_dir = record_dir.as_ref().join(probe_headers::INODES_SUBDIR);
+        let inodes_out_dir = Path::new(probe_headers::INODES_SUBDIR);
+        self.append_dirs(inodes_out_dir)?;
+        std::fs::read_dir(&inodes_in_dir)?
+            .map(|inode_contents| {
+                let name = inode_contents?.file_name();
+                // A copy libprobe was still making when the process was killed (see copier.h)
+                if Path::new(&name).extension() == Some(std::ffi::OsStr::new("tmp")) {
+                    return Ok(0usize);
+                }
+                self.tar
+                    .append_path_with_name(inodes_in_dir.join(&name), inodes_out_dir.join(&name))?;
+                Ok(1usize)
+            })
+            .collect::<Result<Vec<_>>>()?;
+        Ok(())
+    }
+
+    /// Transcribe the threads not already transcribed; unless `all`, only those which have
+    /// finished. Returns how many were transcribed.
+    ///
+    /// Unless `all`, threads (or processes) which fail to transcribe are skipped rather than
+    /// failing the rest; they are still not transcribed, so the next call tries them again.
+    fn transcribe_tids<P: AsRef<Path>>(&mut self, record_dir: P, all: bool) -> Result<usize> {
+        let mut pending = Vec::new();
+        for pid_entry in std::fs::read_dir(record_dir.as_ref().join(probe_headers::PIDS_SUBDIR))? {
+            let found = pid_entry
+                .wrap_err("Error reading the pids directory")
+                .and_then(|pid_entry| self.pending_tids(&pid_entry.path(), all, &mut pending));
+            match found {
+                Ok(()) => {}
+                Err(e) if !all => log::debug!("Leaving a process for later: {e:?}"),
+                Err(e) => return Err(e),
+            }
+        }
+        self.transcribe_in_parallel(pending, !all)
+    }
+
+    /// Add the threads of the process at `pid_in_dir` which are to be transcribed to `pending`,
+    /// as `(tid_in_dir, tid_out_file)`.
+    fn pending_tids(
+        &self,
+        pid_in_dir: &Path,
+        all: bool,
+        pending: &mut Vec<(PathBuf, PathBuf)>,
+    ) -> Result<()> {
+        let pid = filename_numeric(pid_in_dir)?;
+        let mut execs = std::fs::read_dir(pid_in_dir)?
+            .map(|entry| {
+                let exec_in_dir = entry?.path();
+                Ok((filename_numeric(&exec_in_dir)?, exec_in_dir))
+            })
+            .collect::<Result<Vec<_>>>()?;
+        execs.sort();
+        let last_exec = execs.last().map(|(exec, _)| *exec);
+        for (exec, exec_in_dir) in execs {
+            for tid_entry in
+                std::fs::read_dir(&exec_in_dir).wrap_err("Error opening ExecEpoch directory")?
+            {
+                let tid_in_dir = tid_entry?.path();
+                let tid = filename_numeric(&tid_in_dir)?;
+                let tid_out_file = Path::new(probe_headers::PIDS_SUBDIR)
+                    .join(pid.to_string())
+                    .join(exec.to_string())
+                    .join(tid.to_string());
+                if self.tids.contains(&tid_out_file) {
+                    continue;
+                }
+                let finished = all || Some(exec) != last_exec || !thread_is_running(pid, tid);
+                if !finished {
+                    continue;
+                }
+                pending.push((tid_in_dir, tid_out_file));
+            }
+        }
+        Ok(())
+    }
+
+    /// Parse the arenas of each `(tid_in_dir, tid_out_file)` on the worker threads, and append
+    /// the results to the archive as they come in. Returns how many were appended.
+    ///
+    /// If `skip_failures`, a thread which fails to parse is left out rather than failing the
+    /// rest; errors writing the archive fail regardless.
+    fn transcribe_in_parallel(
+        &mut self,
+        pending: Vec<(PathBuf, PathBuf)>,
+        skip_failures: bool,
+    ) -> Result<usize> {
+        let workers = self.jobs.min(pending.len());
+        let queue = std::sync::Mutex::new(pending.into_iter());
+        // Bounded, so that parsed threads don't pile up in memory faster than they are archived.
+        let (sender, receiver) = mpsc::sync_channel(workers);
+        std::thread::scope(|scope| -> Result<usize> {
+            for _ in 0..workers {
+                let sender = sender.clone();
+                let next = || queue.lock().expect("a worker panicked").next();
+                scope.spawn(move || {
+                    while let Some((tid_in_dir, tid_out_file)) = next() {
+                        let ops = transcribe_tid(&tid_in_dir);
+                        if sender.send((tid_out_file, ops)).is_err() {
+                            // The receiver gave up on an error
+                            break;
+                        }
+                    }
+                });
+            }
+            drop(sender);
+            let mut count = 0;
+            for (tid_out_file, ops) in receiver {
+                let ops = match ops {
+                    Ok(ops) => ops,
+                    Err(e) if skip_failures => {
+                        log::debug!("Leaving {tid_out_file:?} for later: {e:?}");
+                        continue;
+                    }
+                    Err(e) => return Err(e),
+                };
+                self.append_file(&tid_out_file, ops.size(), ops.reader())?;
+                self.tids.insert(tid_out_file);
+                count += 1;
+            }
+            Ok(count)
         })
-        .collect::<Result<Vec<_>>>()?;
-    Ok(())
+    }
+
+    fn append_dirs(&mut self, path: &Path) -> Result<()> {
+        let mut ancestors = path.ancestors().collect::<Vec<_>>();
+        ancestors.reverse();
+        for dir in ancestors {
+            if dir.as_os_str().is_empty() || self.dirs.contains(dir) {
+                continue;
+            }
+            let mut header = tar::Header::new_gnu();
+            header.set_entry_type(tar::EntryType::Directory);
+            header.set_mode(0o755);
+            header.set_size(0);
+            self.tar.append_data(&mut header, dir, std::io::empty())?;
+            self.dirs.insert(dir.to_owned());
+        }
+        Ok(())
+    }
+
+    fn append_file<R: std::io::Read>(&mut self, path: &Path, size: u64, data: R) -> Result<()> {
+        if let Some(parent) = path.parent() {
+            self.append_dirs(parent)?;
+        }
+        let mut header = tar::Header::new_gnu();
+        header.set_mode(0o644);
+        header.set_size(size);
+        self.tar.append_data(&mut header, path, data)?;
+        Ok(())
+    }
 }
 
-fn transcribe_pid<P1: AsRef<Path>, P2: AsRef<Path>>(pid_in_dir: P1, pid_out_dir: P2) -> Result<()> {
-    std::fs::create_dir(&pid_out_dir)?;
-    std::fs::read_dir(&pid_in_dir)?
-        .map(|entry| {
-            let exec_in_dir = entry?.path();
-            let exec = filename_numeric(&exec_in_dir)?;
-            let exec_out_dir = pid_out_dir.as_ref().join(exec.to_string());
-            transcribe_exec(&exec_in_dir, exec_out_dir)
-        })
-        .collect::<Result<Vec<_>>>()?;
-    Ok(())
+/// A thread's arenas are complete once the thread is gone.
+///
+/// Threads of an exec epoch before the last one are gone too, but `/proc` can't tell us that,
+/// since the exec-ing thread lives on (as the process leader) in the next epoch.
+fn thread_is_running(pid: usize, tid: usize) -> bool {
+    Path::new(&format!("/proc/{pid}/task/{tid}")).exists()
 }
 
-fn transcribe_exec<P1: AsRef<Path>, P2: AsRef<Path>>(
-    exec_in_dir: P1,
-    exec_out_dir: P2,
-) -> Result<()> {
-    std::fs::create_dir(&exec_out_dir).wrap_err("Failed to create ExecEpoch output directory")?;
-    std::fs::read_dir(&exec_in_dir)
-        .wrap_err("Error opening ExecEpoch directory")?
-        .map(|entry| {
-            let tid_in_dir = entry?.path();
-            let tid = filename_numeric(&tid_in_dir)?;
-            let tid_out_file = exec_out_dir.as_ref().join(tid.to_string());
-            transcribe_tid(&tid_in_dir, tid_out_file)
-        })
-        .collect::<Result<Vec<_>>>()?;
-    Ok(())
+/// The ops of one thread, parsed out of its arenas, to be written as a msgpack array.
+///
+/// The msgpack of a thread is never held in memory as a whole. A tar entry's header states its
+/// size, so [`transcribe_tid`] serializes the ops once only to count their bytes, and
+/// [`ThreadOps::reader`] serializes them again, one op at a time, as the archive reads them.
+pub struct ThreadOps {
+    arenas: memory_parsing::Segments,
+    op_pointers: Vec<usize>,
+    size: u64,
 }
 
-pub fn transcribe_tid<P1: AsRef<Path>, P2: AsRef<Path>>(
-    tid_in_dir: P1,
-    tid_out_file: P2,
-) -> Result<()> {
+pub fn transcribe_tid<P: AsRef<Path>>(tid_in_dir: P) -> Result<ThreadOps> {
     let data_arena_dir = tid_in_dir.as_ref().join(probe_headers::DATA_SUBDIR);
     let ops_arena_dir = tid_in_dir.as_ref().join(probe_headers::OPS_SUBDIR);
     let data_arena = {
@@ -110,57 +284,128 @@ pub fn transcribe_tid<P1: AsRef<Path>, P2: AsRef<Path>>(
             .wrap_err(format!("Failed to parse arena dir {data_arena_dir:?}"))?
     };
 
-    let mut ops = vec![];
-
-    let op_size = <probe_headers::Op as memory_parsing::SizedMemory>::size();
-    std::fs::read_dir(&ops_arena_dir)
+    // Ops are in the order of the op arenas' instantiations, not read_dir's order.
+    let mut ops_arena_files = std::fs::read_dir(&ops_arena_dir)
         .wrap_err(format!("Error opening ops directory {:?}", ops_arena_dir))?
         .map(|entry| {
             let ops_arena_file = entry.wrap_err("direntry")?.path();
-            let range;
-            let both_arenas;
-            {
-                let ops_arena_segment = probe_headers::parse_arena_file(&ops_arena_file).wrap_err(format!("parsing op segment in {:?}", ops_arena_file))?;
-                let ops_arena_segments = memory_parsing::Segments::from_segment(ops_arena_segment.clone());
-                range = ops_arena_segment.range().clone();
-                both_arenas = data_arena.extend(&ops_arena_segments).wrap_err(format!("combining data arena with op arena 0x{:08x}--0x{:08x} in {:?}", ops_arena_segment.range().start, ops_arena_segment.range().end, ops_arena_file))?;
-            }
-            range
-                .clone()
-                .step_by(op_size)
-                .map(|op_pointer| {
-                    let ret = <probe_headers::Op as memory_parsing::FromMemory>::from_memory(
-                        &both_arenas,
-                        op_pointer,
-                    )
-                    .wrap_err(format!(
-                        "Failed to parse op at 0x{op_pointer:08x} in op segment 0x{:08x}--0x{:08x}\n",
-                        range.start,
-                        range.end,
-                        // memory_parsing::Segment::new(op_pointer, ops_arena_segment.get(op_pointer).unwrap()[..op_size].to_vec()),
-                    ))?;
-                    ops.push(ret.0.clone());
-                    Ok(())
-                })
-                .collect::<Result<Vec<_>>>()
-                .wrap_err(format!("parsing ops in {:?}", ops_arena_file))?;
-
-            Ok(())
+            Ok((filename_numeric(&ops_arena_file)?, ops_arena_file))
+        })
+        .collect::<Result<Vec<_>>>()?;
+    ops_arena_files.sort();
+    let ops_arena_segments = ops_arena_files
+        .iter()
+        .map(|(_, ops_arena_file)| {
+            probe_headers::parse_arena_file(ops_arena_file)
+                .wrap_err(format!("parsing op segment in {:?}", ops_arena_file))
         })
         .collect::<Result<Vec<_>>>()?;
+    let ranges = ops_arena_segments
+        .iter()
+        .map(|segment| segment.range().clone())
+        .collect::<Vec<_>>();
+    // Combine once, rather than copying the data arena for every op arena
+    let all_arenas = data_arena
+        .extend(&memory_parsing::Segments::new(ops_arena_segments)?)
+        .wrap_err(format!(
+            "combining data arena with op arenas in {:?}",
+            ops_arena_dir
+        ))?;
+
+    let op_size = <probe_headers::Op as memory_parsing::SizedMemory>::size();
+    let op_pointers = ranges
+        .into_iter()
+        .flat_map(|range| range.step_by(op_size))
+        .collect::<Vec<_>>();
+
+    let mut thread_ops = ThreadOps {
+        arenas: all_arenas,
+        op_pointers,
+        size: 0,
+    };
+    let mut counter = ByteCounter(0);
+    rmp::encode::write_array_len(&mut counter, u32::try_from(thread_ops.op_pointers.len())?)?;
+    for &op_pointer in &thread_ops.op_pointers {
+        thread_ops
+            .write_op(op_pointer, &mut counter)
+            .wrap_err(format!("parsing ops in {ops_arena_dir:?}"))?;
+    }
+    thread_ops.size = counter.0;
+    Ok(thread_ops)
+}
+
+impl ThreadOps {
+    /// The number of bytes [`ThreadOps::reader`] yields
+    pub fn size(&self) -> u64 {
+        self.size
+    }
 
-    let mut tid_out_file = std::fs::OpenOptions::new()
-        .create_new(true)
-        .write(true)
-        .open(tid_out_file)?;
-    {
-        let mut serializer =
-            rmp_serde::encode::Serializer::new(&mut tid_out_file).with_struct_map();
+    pub fn reader(&self) -> impl std::io::Read + '_ {
+        let mut header = Vec::new();
+        rmp::encode::write_array_len(&mut header, self.op_pointers.len() as u32)
+            .expect("writing to a Vec can't fail");
+        ThreadOpsReader {
+            ops: self,
+            next_op: 0,
+            buffer: header,
+            pos: 0,
+        }
+    }
+
+    fn write_op<W: std::io::Write>(&self, op_pointer: usize, out: W) -> Result<()> {
         use serde::Serialize;
-        ops.serialize(&mut serializer)?;
+        let op = <probe_headers::Op as memory_parsing::FromMemory>::from_memory(
+            &self.arenas,
+            op_pointer,
+        )
+        .wrap_err(format!("Failed to parse op at 0x{op_pointer:08x}"))?
+        .0;
+        op.serialize(&mut rmp_serde::encode::Serializer::new(out).with_struct_map())?;
+        Ok(())
+    }
+}
+
+/// Serializes the ops of a [`ThreadOps`] as they are read.
+struct ThreadOpsReader<'a> {
+    ops: &'a ThreadOps,
+    next_op: usize,
+    /// The msgpack of the op (or, at first, of the array header) being read
+    buffer: Vec<u8>,
+    pos: usize,
+}
+
+impl std::io::Read for ThreadOpsReader<'_> {
+    fn read(&mut self, out: &mut [u8]) -> std::io::Result<usize> {
+        while self.pos == self.buffer.len() {
+            let Some(&op_pointer) = self.ops.op_pointers.get(self.next_op) else {
+                return Ok(0);
+            };
+            self.buffer.clear();
+            self.pos = 0;
+            self.ops
+                .write_op(op_pointer, &mut self.buffer)
+                .map_err(|err| std::io::Error::other(format!("{err:?}")))?;
+            self.next_op += 1;
+        }
+        let len = out.len().min(self.buffer.len() - self.pos);
+        out[..len].copy_from_slice(&self.buffer[self.pos..self.pos + len]);
+        self.pos += len;
+        Ok(len)
+    }
+}
+
+/// Discards what is written, but counts the bytes.
+struct ByteCounter(u64);
+
+impl std::io::Write for ByteCounter {
+    fn write(&mut self, buf: &[u8]) -> std::io::Result<usize> {
+        self.0 += buf.len() as u64;
+        Ok(buf.len())
     }
 
-    Ok(())
+    fn flush(&mut self) -> std::io::Result<()> {
+        Ok(())
+    }
 }
 
 fn filename_numeric<P: AsRef<Path>>(dir: P) -> Result<usize> {
@@ -33,6 +33,8 @@ fn inner() -> Result<()> {
     #define PROCESS_TREE_CONTEXT_FILE \"process_tree_context\"
     #define DATA_SUBDIR \"data\"
     #define OPS_SUBDIR \"ops\"
+    #define ARENA_BYTES_FILE \"arena_bytes\"
+    #define INODE_TABLE_FILE \"inode_table\"
 
     /*generate*/
     ",
@@ -41,6 +43,7 @@ fn inner() -> Result<()> {
         .with_tab_width(4)
         .with_style(cbindgen::Style::Tag)
         .include_item("ProcessTreeContext")
+        .include_item("OpCategory")
         .include_item("ProcessContext")
         .include_item("Op")
         .include_item("ArenaHeader")
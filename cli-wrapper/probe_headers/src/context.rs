@@ -11,6 +11,10 @@ pub const INODES_SUBDIR: &str = "inodes";
 pub const PROCESS_TREE_CONTEXT_FILE: &str = "process_tree_context";
 pub const DATA_SUBDIR: &str = "data";
 pub const OPS_SUBDIR: &str = "ops";
+pub const ARENA_BYTES_FILE: &str = "arena_bytes";
+pub const INODE_TABLE_FILE: &str = "inode_table";
+pub const DEFAULT_ARENA_INITIAL_SIZE: usize = 16 * 1024;
+pub const DEFAULT_ARENA_MAX_SIZE: usize = 16 * 1024 * 1024;
 // I would like to propagate this to C, if possible
 // https://github.com/mozilla/cbindgen/issues/927
 
@@ -35,6 +39,77 @@ pub enum CopyFiles {
     Eagerly,
 }
 
+/// How arenas get msync-ed when libprobe flushes them at exec and thread exit.
+///
+/// Arenas are shared mappings, so their contents are visible to the recorder as soon as they are
+/// written, whether or not they have been synced. Either way, a process syncs its arenas
+/// durably when it exits.
+///
+/// cbindgen:prefix-with-name
+#[derive(
+    MemoryParsable,
+    Copy,
+    Clone,
+    PartialEq,
+    Eq,
+    PartialOrd,
+    Ord,
+    clap::ValueEnum,
+    Debug,
+    serde::Serialize,
+    schemars::JsonSchema,
+)]
+#[repr(u8)]
+pub enum FlushMode {
+    /// Schedule writeback (MS_ASYNC) without blocking the traced process.
+    Async,
+    /// Block the traced process until writeback completes (MS_SYNC).
+    Sync,
+}
+
+/// Groups of ops that can be selected with `probe record --ops`.
+///
+/// `ProcessTreeContext::recorded_op_categories` has bit `1 << category` set for each recorded
+/// category. libprobe always records [`OpCategory::Process`] ops, since the happens-before graph
+/// can't be built without them.
+///
+/// cbindgen:prefix-with-name
+#[derive(Copy, Clone, PartialEq, Eq, PartialOrd, Ord, clap::ValueEnum, Debug)]
+#[repr(u8)]
+pub enum OpCategory {
+    /// InitExecEpoch, InitThread, Clone, Exec, Spawn, Wait, ExitProcess, ExitThread
+    Process,
+    /// Open, Close, Dup, MkFile, HardLink, SymbolicLink, Unlink, Rename
+    FileIo,
+    /// Stat, Access, ReadLink, UpdateMetadata
+    Metadata,
+    /// Readdir
+    Readdir,
+}
+
+impl OpCategory {
+    pub fn mask<'a, I: IntoIterator<Item = &'a OpCategory>>(categories: I) -> u8 {
+        categories
+            .into_iter()
+            .fold(1 << OpCategory::Process as u8, |mask, category| {
+                mask | (1 << *category as u8)
+            })
+    }
+
+    pub fn all_mask() -> u8 {
+        use clap::ValueEnum;
+        Self::mask(Self::value_variants())
+    }
+}
+
+/// probe_py/probe_py/consts.py copies this value, since OpCategory is not in the JSON schema
+/// probe_py's headers are generated from.
+#[cfg(test)]
+#[test]
+fn test_op_category_file_io() {
+    assert_eq!(OpCategory::FileIo as u8, 1);
+}
+
 /*
  * Note that these structs get used in shared mmapped memory.
  * Pointers mess everything up because the memory can be mapped to a different virtual address in a different address space (aka process).
@@ -54,8 +129,29 @@ pub struct FixedPath {
 pub struct ProcessTreeContext {
     pub libprobe_path: FixedPath,
     pub copy_files: CopyFiles,
+    /// If nonzero, files read (rather than written) which are at least this many bytes get copied
+    /// by a copier thread, so that the open which triggered the copy need not wait for it.
+    pub copy_files_async_min_size: usize,
     pub parent_of_root: u32,
     pub working_directory: FixedPath,
+    /// Capacity in bytes of the first ops and data arena of each thread.
+    pub arena_initial_size: usize,
+    /// Each time a thread fills an arena, its next one is twice as large, up to this many bytes.
+    pub arena_max_size: usize,
+    pub flush_mode: FlushMode,
+    /// Bitmask of [`OpCategory`]s to record; see [`OpCategory::mask`].
+    pub recorded_op_categories: u8,
+    /// Aggregate Open and Stat ops into per-(process, inode) AccessSummary ops.
+    pub summary: bool,
+    /// In summary mode, flush the summaries at least this often (in seconds), in addition to exec
+    /// and exit; 0 means only at exec and exit.
+    pub summary_interval: u32,
+    /// If nonzero, bound the total size of all arenas to roughly this many bytes.
+    ///
+    /// When the arenas of all processes together (counted in [`ARENA_BYTES_FILE`]) exceed the
+    /// budget, a thread which fills its op arena discards the ops in its older op arenas, except
+    /// for [`OpCategory::Process`] ops, and leaves a [`crate::ops::DroppedOps`] op in their place.
+    pub arena_budget: usize,
 }
 
 #[repr(C)]
@@ -35,6 +35,7 @@ fn main() -> Result<()> {
         probe_headers::TimeVal,
         probe_headers::Rusage,
         probe_headers::StatxTimestamp,
+        probe_headers::ResourceSample,
         probe_headers::PathArg,
         probe_headers::Inode,
         probe_headers::InitExecEpoch,
@@ -58,12 +58,32 @@ pub struct Inode {
     size: u64,
 }
 
+/// Resources used so far by a process (or a thread, in InitThread and ExitThread), sampled at the
+/// start and end of each exec epoch and thread.
+///
+/// The CPU time and block I/O keep counting across exec, so what an exec epoch (or thread) used is
+/// the difference between its samples. An exec epoch which ends in an exec has no ExitProcess;
+/// it ends at the InitExecEpoch of the next epoch.
+#[derive(MemoryParsable, JsonSchema, Serialize, Debug, PartialEq, Eq, Clone)]
+#[repr(C)]
+pub struct ResourceSample {
+    /// CLOCK_REALTIME when the sample was taken
+    time: StatxTimestamp,
+    user_cpu_us: u64,
+    system_cpu_us: u64,
+    /// Peak resident set size of the process, in KiB (not per-thread, even in thread samples)
+    max_rss_kib: u64,
+    /// Blocks (of 512 bytes) read from and written to the filesystem
+    blocks_in: u64,
+    blocks_out: u64,
+}
+
 // Making this be a struct helps the typing get "stronger"
 // Open Numbers can only be used where Open Numbers are expected.
 #[derive(MemoryParsable, JsonSchema, Serialize, Debug, PartialEq, Eq, Clone)]
 #[repr(C)]
 pub struct OpenNumber {
-    value: u16,
+    value: u32,
 }
 
 /// cbindgen:prefix-with-name
@@ -86,12 +106,14 @@ pub struct InitExecEpoch {
     std_in: Inode,
     std_out: Inode,
     std_err: Inode,
+    resources: ResourceSample,
 }
 
 #[derive(MemoryParsable, JsonSchema, Serialize, Debug, Clone)]
 #[repr(C)]
 pub struct InitThread {
     tid: libc::pid_t,
+    resources: ResourceSample,
 }
 
 #[derive(MemoryParsable, JsonSchema, Serialize, Debug, Clone)]
@@ -118,7 +140,52 @@ pub struct Exec {
     path: PathArg,
     inode: Inode,
     argv: StringArray,
+    // The environment is stored as a delta against the env of the InitExecEpoch of the calling exec epoch.
+    // `env` holds the entries which are not in that env, and `env_removed` the entries which are no longer present.
+    // See `Exec::expand_env`.
     env: StringArray,
+    env_removed: StringArray,
+}
+
+impl Exec {
+    /// Replace the env delta with the full environment, given the env of the InitExecEpoch of the calling exec epoch.
+    pub fn expand_env(&mut self, initial_env: &StringArray) {
+        self.env = expand_env_delta(initial_env, &self.env, &self.env_removed);
+        self.env_removed = StringArray(Vec::new());
+    }
+}
+
+/// The entries of `initial_env` which were not removed come first, in their original order, followed by the added entries.
+pub fn expand_env_delta(
+    initial_env: &StringArray,
+    added: &StringArray,
+    removed: &StringArray,
+) -> StringArray {
+    let removed: std::collections::HashSet<&[u8]> =
+        removed.0.iter().map(|entry| &entry[..]).collect();
+    StringArray(
+        initial_env
+            .0
+            .iter()
+            .filter(|entry| !removed.contains(&entry[..]))
+            .chain(added.0.iter())
+            .cloned()
+            .collect(),
+    )
+}
+
+#[cfg(test)]
+#[test]
+fn test_expand_env_delta() {
+    let env = expand_env_delta(
+        &StringArray(vec![b"A=1".to_vec(), b"B=2".to_vec(), b"C=1".to_vec()]),
+        &StringArray(vec![b"B=3".to_vec(), b"D=4".to_vec()]),
+        &StringArray(vec![b"B=2".to_vec(), b"C=1".to_vec()]),
+    );
+    assert_eq!(
+        env.0,
+        vec![b"A=1".to_vec(), b"B=3".to_vec(), b"D=4".to_vec()]
+    );
 }
 
 #[derive(MemoryParsable, JsonSchema, Serialize, Debug, Clone)]
@@ -150,13 +217,17 @@ pub struct Clone {
 #[derive(MemoryParsable, JsonSchema, Serialize, Debug, Clone)]
 #[repr(C)]
 pub struct ExitProcess {
+    /// The status passed to exit(), or -1 if the process exited without calling it (e.g., by
+    /// returning from main)
     status: libc::c_int,
+    resources: ResourceSample,
 }
 
 #[derive(MemoryParsable, JsonSchema, Serialize, Debug, Clone)]
 #[repr(C)]
 pub struct ExitThread {
     status: libc::c_int,
+    resources: ResourceSample,
 }
 
 #[derive(MemoryParsable, JsonSchema, Serialize, Debug, Clone)]
@@ -321,6 +392,39 @@ pub enum FileType {
     Pipe,
 }
 
+/// Aggregate of the accesses one process made to one inode, between two flushes of libprobe's
+/// summary table. In summary mode, these replace the individual Open and Stat ops. A process may
+/// emit several of these for the same inode (e.g., one per flush interval).
+#[derive(MemoryParsable, JsonSchema, Serialize, Debug, Clone)]
+#[repr(C)]
+pub struct AccessSummary {
+    /// The inode as of the last access
+    inode: Inode,
+    /// CLOCK_REALTIME of the first access
+    first_access: StatxTimestamp,
+    /// CLOCK_REALTIME of the last access
+    last_access: StatxTimestamp,
+    /// Opens that could read
+    n_reads: u32,
+    /// Opens that could write (including truncating ones)
+    n_writes: u32,
+    /// Opens with O_TRUNC
+    n_truncates: u32,
+    n_stats: u32,
+    /// Bitwise-or of the flags of every open
+    open_flags: libc::c_int,
+}
+
+/// Stands in for ops that were discarded to stay within `ProcessTreeContext::arena_budget`.
+///
+/// Only ops other than [`crate::OpCategory::Process`] ops are discarded, so the happens-before
+/// graph is intact, but the thread's file accesses are incomplete.
+#[derive(MemoryParsable, JsonSchema, Serialize, Debug, Clone)]
+#[repr(C)]
+pub struct DroppedOps {
+    n_ops: u32,
+}
+
 /// cbindgen:add-sentinel
 /// cbindgen:prefix-with-name
 #[derive(MemoryParsable, JsonSchema, Serialize, Debug, Clone)]
@@ -348,6 +452,8 @@ pub enum OpData {
     UpdateMetadata(UpdateMetadata),
     Wait(Wait),
     MkFile(MkFile),
+    AccessSummary(AccessSummary),
+    DroppedOps(DroppedOps),
 }
 
 // echo -e '#include <stdio.h>\\n#include <threads.h>\\nint main() { printf("%ld %ld\\\\n", sizeof(thrd_t), sizeof(thrd_start_t)); return 0; }' | gcc -Og -g -x c - && ./a.out && rm a.out
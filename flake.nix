@@ -162,6 +162,7 @@
                 ${cli-wrapper-pkgs.probe-cli}/bin/probe \
                 $out/bin/probe \
                 --set PROBE_BUILDAH ${pkgs.buildah}/bin/buildah \
+                --set PROBE_ZSTD ${pkgs.zstd}/bin/zstd \
                 --set PROBE_LIB ${libprobe}/lib \
                 --set PROBE_PYTHON ${python.withPackages (_: [probe-py])}/bin/python \
                 --set PROBE_PYTHONPATH ""
@@ -202,6 +203,7 @@
               python.pkgs.msgspec
               python.pkgs.networkx
               python.pkgs.numpy
+              python.pkgs.pyarrow
               python.pkgs.pydot
               python.pkgs.pygraphviz
               python.pkgs.rich
@@ -209,6 +211,7 @@
               python.pkgs.tqdm
               python.pkgs.typer
               python.pkgs.xdg-base-dirs
+              python.pkgs.zstandard
             ];
             nativeCheckInputs = [
               packages.types-networkx
@@ -298,12 +301,14 @@
             charmonium-time-block-pkg
             pypkgs.networkx
             pypkgs.numpy
+            pypkgs.pyarrow
             pypkgs.pydot
             pypkgs.rich
             pypkgs.sqlalchemy
             pypkgs.tqdm
             pypkgs.typer
             pypkgs.xdg-base-dirs
+            pypkgs.zstandard
 
             # probe_py.manual "dev time" requirements
             packages.types-networkx
@@ -322,6 +327,7 @@
           ]);
           shellHook = ''
             export PROBE_BUILDAH="${pkgs.buildah}/bin/buildah"
+            export PROBE_ZSTD="${pkgs.zstd}/bin/zstd"
             export PROBE_PYTHON="${probe-python}/bin/python"
             pushd $(git rev-parse --show-toplevel) > /dev/null
             source ./setup_devshell.sh
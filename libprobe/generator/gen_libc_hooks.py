@@ -89,6 +89,26 @@ class ErrnoDetector(FunctionalNodeVisitor[bool]):
             return []
 
 
+class OpTagDetector(FunctionalNodeVisitor[str]):
+    def visit_ID(self, node: ID) -> list[str]:
+        if node.name.startswith("OpData_"):
+            return [node.name]
+        else:
+            return []
+
+
+# Hooks that only emit these ops have no side-effects on libprobe's state (unlike open, close, exec, etc.).
+# If their ops are filtered out, they can skip straight to the real libc call.
+# Other hooks always run, but prov_log_record drops their filtered ops.
+stateless_op_tags = frozenset({
+    "OpData_Access",
+    "OpData_ReadLink",
+    "OpData_Readdir",
+    "OpData_Stat",
+    "OpData_UpdateMetadata",
+})
+
+
 def is_void(node: TypeDecl) -> bool:
     return isinstance(node.type, IdentifierType) and node.type.names[0] == "void"
 
@@ -367,6 +387,49 @@ def wrapper_func_body(func: ParsedFunc) -> typing.Sequence[Node]:
 
     noreturn = bool(find_decl(func.stmts, "noreturn", func.name))
 
+    op_tags = sorted(set(OpTagDetector().visit(Compound(block_items=list(func.stmts)))))
+    if not ignore_actions and op_tags and stateless_op_tags.issuperset(op_tags) and not func.variadic and not noreturn:
+        assert not find_decl(func.stmts, "pre_call", func.name) and not find_decl(func.stmts, "call", func.name), \
+            f"{func.name} has pre_call or call actions, so it can't skip them when its ops are not recorded"
+        passthrough_call = pycparser.c_ast.FuncCall(
+            name=pycparser.c_ast.ID(name=func_prefix + func.name),
+            args=pycparser.c_ast.ExprList(
+                exprs=[
+                    pycparser.c_ast.ID(name=param_name)
+                    for param_name, _ in func.params
+                ],
+            ),
+        )
+        any_op_recorded: Node = pycparser.c_ast.FuncCall(
+            name=pycparser.c_ast.ID(name="op_is_recorded"),
+            args=pycparser.c_ast.ExprList(exprs=[pycparser.c_ast.ID(name=op_tags[0])]),
+        )
+        for op_tag in op_tags[1:]:
+            any_op_recorded = pycparser.c_ast.BinaryOp(
+                op="||",
+                left=any_op_recorded,
+                right=pycparser.c_ast.FuncCall(
+                    name=pycparser.c_ast.ID(name="op_is_recorded"),
+                    args=pycparser.c_ast.ExprList(exprs=[pycparser.c_ast.ID(name=op_tag)]),
+                ),
+            )
+        pre_call_stmts.append(
+            pycparser.c_ast.If(
+                cond=pycparser.c_ast.FuncCall(
+                    name=pycparser.c_ast.ID(name="UNLIKELY"),
+                    args=pycparser.c_ast.ExprList(exprs=[
+                        pycparser.c_ast.UnaryOp(op="!", expr=any_op_recorded),
+                    ]),
+                ),
+                iftrue=Compound(block_items=(
+                    [passthrough_call, pycparser.c_ast.Return(expr=None)]
+                    if is_void(func.return_type) else
+                    [pycparser.c_ast.Return(expr=passthrough_call)]
+                )),
+                iffalse=None,
+            )
+        )
+
     # For some reason, Clang analyzer can suddenly prove that if execle returns, errno (call_errno) must be non-zero.
     # So this is a dead store.
     # But it can't prove that for the other execs
@@ -594,6 +657,7 @@ libc_hooks_c_preamble = """
 
 #include "../generated/headers.h"                            // for Op, OpCode
 #include "../src/arena.h"                                    // for prov_log...
+#include "../src/copier.h"                                   // for copier_drain
 #include "../src/debug_logging.h"                            // for DEBUG
 #include "../src/env.h"                                      // for arena_co...
 #include "../src/global_state.h"                             // for ensure_i...
@@ -602,6 +666,7 @@ libc_hooks_c_preamble = """
 #include "../src/prov_buffer.h"                              // for prov_log...
 #include "../src/prov_utils.h"                               // for create_p...
 #include "../src/pthread_helper.h"                           // for pthread_helper
+#include "../src/summary.h"                                  // for summary_flush
 #include "../src/util.h"                                     // for LIKELY
 
 #if defined(__GLIBC__) && __GLIBC_MINOR__ >= 34
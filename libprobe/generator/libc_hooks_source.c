@@ -1290,8 +1290,7 @@ int execv (const char *filename, char *const argv[]) {
         StringArray copied_argv = arena_copy_argv(get_data_arena(), (StringArray)argv, 0);
         size_t envc = 0;
         StringArray updated_env = update_env_with_probe_vars((StringArray)environ, &envc);
-        /* TODO: Avoid this copy */
-        StringArray copied_updated_env = arena_copy_argv(get_data_arena(), updated_env, envc);
+        struct EnvDelta env_delta = arena_copy_env_delta(get_data_arena(), updated_env, envc);
         struct Op op = {
             .data = {
                 .exec_tag = OpData_Exec,
@@ -1301,11 +1300,14 @@ int execv (const char *filename, char *const argv[]) {
                         .name = arena_strndup(get_data_arena(), filename, PATH_MAX),
                     },
                     .argv = copied_argv,
-                    .env = copied_updated_env,
+                    .env = env_delta.added,
+                    .env_removed = env_delta.removed,
                 },
             },
             .ferrno = 0,
         };
+        summary_flush();
+        copier_drain();
         if (LIKELY(prov_log_is_enabled())) {
             prov_log_record(op);
         }
@@ -1352,7 +1354,7 @@ int execl (const char *filename, const char *arg0, ...) {
         StringArray copied_argv = arena_copy_argv(get_data_arena(), (StringArray)argv, argc);
         size_t envc = 0;
         StringArray updated_env = update_env_with_probe_vars((StringArray)environ, &envc);
-        StringArray copied_updated_env = arena_copy_argv(get_data_arena(), updated_env, envc);
+        struct EnvDelta env_delta = arena_copy_env_delta(get_data_arena(), updated_env, envc);
         struct Op op = {
             .data = {
                 .exec_tag = OpData_Exec,
@@ -1362,11 +1364,14 @@ int execl (const char *filename, const char *arg0, ...) {
                         .name = arena_strndup(get_data_arena(), filename, PATH_MAX),
                     },
                     .argv = copied_argv,
-                    .env = copied_updated_env,
+                    .env = env_delta.added,
+                    .env_removed = env_delta.removed,
                 },
             },
             .ferrno = 0,
         };
+        summary_flush();
+        copier_drain();
         if (LIKELY(prov_log_is_enabled())) {
             prov_log_record(op);
         }
@@ -1390,7 +1395,7 @@ int execve (const char *filename, char *const argv[], char *const env[]) {
         StringArray copied_argv = arena_copy_argv(get_data_arena(), (StringArray)argv, 0);
         size_t envc = 0;
         StringArray updated_env = update_env_with_probe_vars((StringArray)env, &envc);
-        StringArray copied_updated_env = arena_copy_argv(get_data_arena(), updated_env, envc);
+        struct EnvDelta env_delta = arena_copy_env_delta(get_data_arena(), updated_env, envc);
         struct Op op = {
             .data = {
                 .exec_tag = OpData_Exec,
@@ -1400,11 +1405,14 @@ int execve (const char *filename, char *const argv[], char *const env[]) {
                         .name = arena_strndup(get_data_arena(), filename, PATH_MAX),
                     },
                     .argv = copied_argv,
-                    .env = copied_updated_env,
+                    .env = env_delta.added,
+                    .env_removed = env_delta.removed,
                 },
             },
             .ferrno = 0,
         };
+        summary_flush();
+        copier_drain();
         if (LIKELY(prov_log_is_enabled())) {
             prov_log_record(op);
         }
@@ -1427,7 +1435,7 @@ int fexecve (int fd, char *const argv[], char *const env[]) {
         StringArray copied_argv = arena_copy_argv(get_data_arena(), (StringArray)argv, 0);
         size_t envc = 0;
         StringArray updated_env = update_env_with_probe_vars((StringArray)env, &envc);
-        StringArray copied_updated_env = arena_copy_argv(get_data_arena(), updated_env, 0);
+        struct EnvDelta env_delta = arena_copy_env_delta(get_data_arena(), updated_env, envc);
         struct Op op = {
             .data = {
                 .exec_tag = OpData_Exec,
@@ -1437,10 +1445,13 @@ int fexecve (int fd, char *const argv[], char *const env[]) {
                         .name = NULL,
                     },
                     .argv = copied_argv,
-                    .env = copied_updated_env,
+                    .env = env_delta.added,
+                    .env_removed = env_delta.removed,
                 },
             },
         };
+        summary_flush();
+        copier_drain();
         if (LIKELY(prov_log_is_enabled())) {
             prov_log_record(op);
         }
@@ -1473,7 +1484,7 @@ int execle (const char *filename, const char *arg0, ...) {
         va_end(ap);
         size_t envc = 0;
         StringArray updated_env = update_env_with_probe_vars((StringArray)env, &envc);
-        StringArray copied_updated_env = arena_copy_argv(get_data_arena(), updated_env, envc);
+        struct EnvDelta env_delta = arena_copy_env_delta(get_data_arena(), updated_env, envc);
         struct Op op = {
             .data = {
                 .exec_tag = OpData_Exec,
@@ -1483,11 +1494,14 @@ int execle (const char *filename, const char *arg0, ...) {
                         .name = arena_strndup(get_data_arena(), filename, PATH_MAX),
                     },
                     .argv = copied_argv,
-                    .env = copied_updated_env,
+                    .env = env_delta.added,
+                    .env_removed = env_delta.removed,
                 },
             },
             .ferrno = 0,
         };
+        summary_flush();
+        copier_drain();
         if (LIKELY(prov_log_is_enabled())) {
             prov_log_record(op);
         }
@@ -1520,7 +1534,7 @@ int execvp (const char *filename, char *const argv[]) {
         StringArray copied_argv = arena_copy_argv(get_data_arena(), (StringArray)argv, 0);
         size_t envc = 0;
         StringArray updated_env = update_env_with_probe_vars((StringArray)environ, &envc);
-        StringArray copied_updated_env = arena_copy_argv(get_data_arena(), updated_env, envc);
+        struct EnvDelta env_delta = arena_copy_env_delta(get_data_arena(), updated_env, envc);
         struct Op op = {
             .data = {
                 .exec_tag = OpData_Exec,
@@ -1530,11 +1544,14 @@ int execvp (const char *filename, char *const argv[]) {
                         .name = arena_strndup(get_data_arena(), bin_path, PATH_MAX),
                     },
                     .argv = copied_argv,
-                    .env = copied_updated_env,
+                    .env = env_delta.added,
+                    .env_removed = env_delta.removed,
                 },
             },
             .ferrno = 0,
         };
+        summary_flush();
+        copier_drain();
         if (LIKELY(prov_log_is_enabled())) {
             prov_log_record(op);
         }
@@ -1574,7 +1591,7 @@ int execlp (const char *filename, const char *arg0, ...) {
         StringArray copied_argv = arena_copy_argv(get_data_arena(), (StringArray)argv, argc);
         size_t envc = 0;
         StringArray updated_env = update_env_with_probe_vars((StringArray)environ, &envc);
-        StringArray copied_updated_env = arena_copy_argv(get_data_arena(), updated_env, envc);
+        struct EnvDelta env_delta = arena_copy_env_delta(get_data_arena(), updated_env, envc);
         struct Op op = {
             .data = {
                 .exec_tag = OpData_Exec,
@@ -1584,11 +1601,14 @@ int execlp (const char *filename, const char *arg0, ...) {
                         .name = arena_strndup(get_data_arena(), bin_path, PATH_MAX),
                     },
                     .argv = copied_argv,
-                    .env = copied_updated_env,
+                    .env = env_delta.added,
+                    .env_removed = env_delta.removed,
                 },
             },
             .ferrno = 0,
         };
+        summary_flush();
+        copier_drain();
         if (LIKELY(prov_log_is_enabled())) {
             prov_log_record(op);
         }
@@ -1622,7 +1642,7 @@ int execvpe(const char *filename, char *const argv[], char *const envp[]) {
         StringArray copied_argv = arena_copy_argv(get_data_arena(), (StringArray)argv, 0);
         size_t envc = 0;
         StringArray updated_env = update_env_with_probe_vars((StringArray)envp, &envc);
-        StringArray copied_updated_env = arena_copy_argv(get_data_arena(), updated_env, envc);
+        struct EnvDelta env_delta = arena_copy_env_delta(get_data_arena(), updated_env, envc);
         struct Op op = {
             .data = {
                 .exec_tag = OpData_Exec,
@@ -1632,10 +1652,13 @@ int execvpe(const char *filename, char *const argv[], char *const envp[]) {
                         .name = arena_strndup(get_data_arena(), bin_path, PATH_MAX),
                     },
                     .argv = copied_argv,
-                    .env = copied_updated_env,
+                    .env = env_delta.added,
+                    .env_removed = env_delta.removed,
                 },
             },
         };
+        summary_flush();
+        copier_drain();
         if (LIKELY(prov_log_is_enabled())) {
             prov_log_record(op);
         }
@@ -1664,7 +1687,7 @@ int posix_spawn(pid_t* restrict pid, const char* restrict path,
         StringArray copied_argv = arena_copy_argv(get_data_arena(), (StringArray)argv, 0);
         size_t envc = 0;
         StringArray updated_env = update_env_with_probe_vars((StringArray)envp, &envc);
-        StringArray copied_updated_env = arena_copy_argv(get_data_arena(), (StringArray)updated_env, envc);
+        struct EnvDelta env_delta = arena_copy_env_delta(get_data_arena(), updated_env, envc);
 
         struct Op spawn_op = {
             .data = {
@@ -1676,7 +1699,8 @@ int posix_spawn(pid_t* restrict pid, const char* restrict path,
                             .name = arena_strndup(get_data_arena(), path, PATH_MAX),
                         },
                         .argv = copied_argv,
-                        .env = copied_updated_env,
+                        .env = env_delta.added,
+                        .env_removed = env_delta.removed,
                     },
                     .child_pid = 0,
                 },
@@ -1714,7 +1738,7 @@ int posix_spawnp(pid_t* restrict pid, const char* restrict file,
         StringArray copied_argv = arena_copy_argv(get_data_arena(), (StringArray)argv, 0);
         size_t envc = 0;
         StringArray updated_env = update_env_with_probe_vars((StringArray)envp, &envc);
-        StringArray copied_updated_env = arena_copy_argv(get_data_arena(), updated_env, envc);
+        struct EnvDelta env_delta = arena_copy_env_delta(get_data_arena(), updated_env, envc);
 
         struct Op spawn_op = {
             .data = {
@@ -1726,7 +1750,8 @@ int posix_spawnp(pid_t* restrict pid, const char* restrict file,
                             .name = arena_strndup(get_data_arena(), bin_path, PATH_MAX),
                         },
                         .argv = copied_argv,
-                        .env = copied_updated_env,
+                        .env = env_delta.added,
+                        .env_removed = env_delta.removed,
                     },
                     .child_pid = 0,
                 }
@@ -2164,10 +2189,7 @@ int pthread_create(pthread_t *restrict thread,
 
 void pthread_exit(void* inner_ret) {
     void* call = ({
-        struct Op op = {
-            .data = {.exit_thread_tag = OpData_ExitThread, .exit_thread = {0}},
-        };
-        prov_log_record(op);
+        emit_exit_thread_op();
         struct PthreadReturnVal* pthread_return_val = EXPECT_NONNULL(malloc(sizeof(struct PthreadReturnVal)));
         pthread_return_val->type_id = PTHREAD_RETURN_VAL_TYPE_ID;
         pthread_return_val->pthread_id = get_pthread_id();
@@ -2319,12 +2341,9 @@ int mkfifoat(int fd, const char* pathname, mode_t mode) {
 // functions we're not interposing, but need for libprobe functionality
 char* strerror(int errnum) { }
 void exit(int status) {
-    void* precall = ({
-        struct Op op = {
-            .data = {.exit_process_tag = OpData_ExitProcess, .exit_process = {status}},
-            .ferrno = 0,
-        };
-        prov_log_record(op);
+    void* pre_call = ({
+        /* The destructor records ExitProcess, once the atexit handlers are done */
+        set_exit_status(status);
     });
     bool noreturn = true;
 }
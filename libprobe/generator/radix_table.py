@@ -121,13 +121,121 @@ def multilevel_table(
     ]))
 
 
+def shared_multilevel_table(
+        c_header: pathlib.Path,
+        c_source: pathlib.Path,
+        name: str,
+        value_type: str,
+        log_lengths: typing.Sequence[int],
+) -> None:
+    """Like multilevel_table, but the table lives in one region of memory which several processes may map at different addresses.
+
+    So levels refer to each other by their offset from the start of the table, rather than by pointer.
+    New levels are bump-allocated from the rest of the region, which must be zero-initialized (e.g., a fresh file).
+    Since another process may be killed at any moment, nobody waits on anybody:
+    a level is allocated first, then published with a CAS; the loser of a race leaks its allocation.
+    """
+    n_levels = len(log_lengths)
+    last_level = n_levels - 1
+    log_length = sum(log_lengths)
+    if log_length > 64:
+        raise ValueError("Cannot go bigger than 64 log_lengths")
+    lowest_bit = [log_length - sum(log_lengths[:i + 1]) for i in range(n_levels)]
+
+    camel_case = "".join(part.capitalize() for part in name.split())
+    snakecase = name.replace(" ", "_")
+    index_type = "uint64_t"
+    fn_attrs = "__attribute__((visibility(\"hidden\")))"
+    c_header.write_text("\n".join([
+        "#pragma once",
+        "#define _GNU_SOURCE",
+        *(["#include <stdbool.h>"] if value_type == "bool" else []),
+        "#include <stddef.h>",
+        "#include <stdint.h>",
+        "",
+        f"struct _{camel_case}{last_level}Struct {{ _Atomic({value_type}) array [{1 << log_lengths[last_level]}]; }};",
+        *[
+            # Offsets of the next level; 0 means unallocated
+            f"struct _{camel_case}{i}Struct {{ _Atomic(uint64_t) array [{1 << log_lengths[i]}]; }};"
+            for i in range(last_level - 1, -1, -1)
+        ],
+        f"struct {camel_case} {{ _Atomic(uint64_t) used; struct _{camel_case}0Struct inner; }};",
+        "",
+        f"{fn_attrs} const _Atomic({value_type})* _Nullable {snakecase}_address_of_weak(const struct {camel_case}* _Nonnull {snakecase}, {index_type} index);",
+        "",
+        f"/* size is that of the whole region, including struct {camel_case}. Returns NULL if it is too small to allocate another level. */",
+        f"{fn_attrs} _Atomic({value_type})* _Nullable {snakecase}_address_of_strong(struct {camel_case}* _Nonnull {snakecase}, size_t size, {index_type} index);",
+        "",
+    ]))
+    checks = [
+        *([f"  if (index > {(1 << log_length) - 1}UL) {{ ERROR(\"%d-bit table not big enough to accommodate %lu\\n\", {log_length}, index); }}"] if log_length < 64 else []),
+        "  _Static_assert(ATOMIC_LLONG_LOCK_FREE == 2, \"\");",
+    ]
+    c_source.write_text("\n".join([
+        f"#include \"{c_header.relative_to(c_source.parent)}\"",
+        "",
+        "#include <stdatomic.h>",
+        "",
+        "#include \"../src/debug_logging.h\"",
+        "",
+        "#define _BITS(value, low, length) (((((1UL << length) - 1UL) << low) & value) >> low)",
+        "",
+        f"const _Atomic({value_type})* _Nullable {snakecase}_address_of_weak(const struct {camel_case}* _Nonnull {snakecase}, {index_type} index) {{",
+        *checks,
+        f"  const char* base = (const char*){snakecase};",
+        f"  const struct _{camel_case}0Struct* struct0 = &{snakecase}->inner;",
+        "",
+        *itertools.chain.from_iterable([
+            [
+                f"  uint64_t offset{i} = atomic_load(&struct{i}->array[_BITS(index, {lowest_bit[i]}UL, {log_lengths[i]}UL)]);",
+                f"  if (offset{i} == 0) {{ return NULL; }}",
+                f"  const struct _{camel_case}{i+1}Struct* struct{i+1} = (const struct _{camel_case}{i+1}Struct*)(base + offset{i});",
+                "",
+            ]
+            for i in range(last_level)
+        ]),
+        f"  return &struct{last_level}->array[_BITS(index, {lowest_bit[last_level]}UL, {log_lengths[last_level]}UL)];",
+        "}",
+        "",
+        f"_Atomic({value_type})* _Nullable {snakecase}_address_of_strong(struct {camel_case}* _Nonnull {snakecase}, size_t size, {index_type} index) {{",
+        *checks,
+        f"  char* base = (char*){snakecase};",
+        f"  struct _{camel_case}0Struct* struct0 = &{snakecase}->inner;",
+        "",
+        *itertools.chain.from_iterable([
+            [
+                f"  uint64_t offset{i} = atomic_load(&struct{i}->array[_BITS(index, {lowest_bit[i]}UL, {log_lengths[i]}UL)]);",
+                f"  if (offset{i} == 0) {{",
+                f"    uint64_t fresh{i} = sizeof(struct {camel_case}) + atomic_fetch_add(&{snakecase}->used, sizeof(struct _{camel_case}{i+1}Struct));",
+                f"    if (fresh{i} + sizeof(struct _{camel_case}{i+1}Struct) > size) {{ return NULL; }}",
+                f"    if (atomic_compare_exchange_strong(&struct{i}->array[_BITS(index, {lowest_bit[i]}UL, {log_lengths[i]}UL)], &offset{i}, fresh{i})) {{",
+                f"      offset{i} = fresh{i};",
+                "    }",
+                "  }",
+                f"  struct _{camel_case}{i+1}Struct* struct{i+1} = (struct _{camel_case}{i+1}Struct*)(base + offset{i});",
+                "",
+            ]
+            for i in range(last_level)
+        ]),
+        f"  return &struct{last_level}->array[_BITS(index, {lowest_bit[last_level]}UL, {log_lengths[last_level]}UL)];",
+        "}",
+    ]))
+
+
 def raise_(exc: Exception) -> typing.NoReturn:
     raise exc
 
 
-c_header = pathlib.Path(sys.argv[1])
-c_source = pathlib.Path(sys.argv[2])
-name = sys.argv[3]
-value = sys.argv[4]
-ints = list(map(int, sys.argv[5:]))
-multilevel_table(c_header, c_source, name, value, ints)
+args = sys.argv[1:]
+shared = args[0] == "--shared"
+if shared:
+    args = args[1:]
+c_header = pathlib.Path(args[0])
+c_source = pathlib.Path(args[1])
+name = args[2]
+value = args[3]
+ints = list(map(int, args[4:]))
+if shared:
+    shared_multilevel_table(c_header, c_source, name, value, ints)
+else:
+    multilevel_table(c_header, c_source, name, value, ints)
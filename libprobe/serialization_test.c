@@ -17,9 +17,9 @@ int main() {
     struct ArenaDir ops_arena;
     struct ArenaDir data_arena;
     arena_create(&ops_arena, ops_filename, strnlen(ops_filename, PATH_MAX), PATH_MAX,
-                 arena_capacity);
+                 arena_capacity, 4 * arena_capacity, NULL);
     arena_create(&data_arena, data_filename, strnlen(data_filename, PATH_MAX), PATH_MAX,
-                 arena_capacity);
+                 arena_capacity, 4 * arena_capacity, NULL);
     struct Inode inode = {
         .device_major = 123,
         .device_minor = 213,
@@ -1,7 +1,8 @@
 #include "arena.h"
 
-#include <fcntl.h>    // for AT_FDCWD, O_CREAT, O_RDWR
-#include <stdbool.h>  // for bool, false, true
+#include <fcntl.h>     // for AT_FDCWD, O_CREAT, O_RDWR
+#include <stdatomic.h> // for atomic_fetch_add, atomic_fetch_sub
+#include <stdbool.h>   // for bool, false, true
 #include <stddef.h>   // for size_t, NULL
 #include <stdint.h>   // for uintptr_t
 #include <stdio.h>    // for snprintf
@@ -14,9 +15,10 @@
 #include "probe_libc.h"    // for probe_libc_...
 
 #define MAX(a, b) ((a) < (b) ? (b) : (a))
+#define MIN(a, b) ((a) < (b) ? (a) : (b))
 
-unsigned char ceil_log2(unsigned int val) {
-    unsigned int ret = 0;
+unsigned char ceil_log2(size_t val) {
+    unsigned char ret = 0;
     bool is_greater = false;
     while (val > 1) {
         is_greater |= val & 1;
@@ -44,9 +46,10 @@ static inline size_t __arena_align(size_t offset, size_t alignment) {
 
 #define ARENA_CURRENT arena_dir->__tail->arena_list[arena_dir->__tail->next_free_slot - 1]
 
+/* min_capacity already includes the struct ArenaHeader */
 static inline void arena_reinstantiate(struct ArenaDir* arena_dir, size_t min_capacity) {
-    size_t capacity = 1 << MAX(ceil_log2(probe_libc_getpagesize()),
-                               ceil_log2(min_capacity + sizeof(struct ArenaHeader)));
+    size_t capacity = ((size_t)1)
+                      << MAX(ceil_log2(probe_libc_getpagesize()), ceil_log2(min_capacity));
 
     /* Create a new mmap */
     snprintf(arena_dir->__dir_buffer + arena_dir->__dir_len,
@@ -92,6 +95,10 @@ static inline void arena_reinstantiate(struct ArenaDir* arena_dir, size_t min_ca
     ARENA_CURRENT->capacity = capacity;
     ARENA_CURRENT->used = sizeof(struct ArenaHeader);
 
+    if (arena_dir->__bytes_in_use) {
+        atomic_fetch_add(arena_dir->__bytes_in_use, capacity);
+    }
+
     /* Update for next instantiation */
     arena_dir->__next_instantiation++;
 }
@@ -100,9 +107,14 @@ void* arena_calloc(struct ArenaDir* arena_dir, size_t type_count, size_t type_si
     size_t padding = __arena_align(ARENA_CURRENT->used, _Alignof(void*)) - ARENA_CURRENT->used;
     if (ARENA_CURRENT->used + padding + type_count * type_size > ARENA_CURRENT->capacity) {
         /* Current arena is too small for this allocation;
-         * Let's allocate a new one. */
-        arena_reinstantiate(arena_dir, MAX(ARENA_CURRENT->capacity,
-                                           type_count * type_size + sizeof(struct ArenaHeader)));
+         * Let's allocate a new one.
+         * Each instantiation costs an openat, ftruncate, mmap, and close (and later an msync and munmap),
+         * so busy threads grow geometrically up to __max_capacity.
+         * Threads that never fill their first arena never pay for more than the initial capacity.
+         * A single allocation larger than __max_capacity still gets an arena big enough to hold it. */
+        size_t grown_capacity = MIN(2 * ARENA_CURRENT->capacity, arena_dir->__max_capacity);
+        arena_reinstantiate(arena_dir, MAX(grown_capacity, type_count * type_size +
+                                                               sizeof(struct ArenaHeader)));
         padding = 0;
         ASSERTF(ARENA_CURRENT->used + padding + type_count * type_size <= ARENA_CURRENT->capacity,
                 "Capacity calculation is wrong (%ld + %ld + %ld * %ld should be <= %ld)",
@@ -123,7 +135,8 @@ void* arena_strndup(struct ArenaDir* arena, const char* string, size_t max_size)
 }
 
 void arena_create(struct ArenaDir* arena_dir, char* dir_buffer, size_t dir_len,
-                  size_t dir_buffer_max, size_t arena_capacity) {
+                  size_t dir_buffer_max, size_t initial_capacity, size_t max_capacity,
+                  _Atomic(uint64_t)* bytes_in_use) {
     // TODO: error handling on optimized builds too
     EXPECT(== 0, probe_libc_mkdirat(AT_FDCWD, dir_buffer, 0777));
     struct ArenaListElem* tail = EXPECT_NONNULL(malloc(sizeof(struct ArenaListElem)));
@@ -136,7 +149,10 @@ void arena_create(struct ArenaDir* arena_dir, char* dir_buffer, size_t dir_len,
     arena_dir->__dir_buffer_max = dir_buffer_max;
     arena_dir->__tail = tail;
     arena_dir->__next_instantiation = 0;
-    arena_reinstantiate(arena_dir, arena_capacity);
+    arena_dir->__max_capacity = MAX(initial_capacity, max_capacity);
+    arena_dir->__bytes_in_use = bytes_in_use;
+    arena_dir->__released_before = 0;
+    arena_reinstantiate(arena_dir, initial_capacity);
     ASSERTF(dir_buffer[arena_dir->__dir_len - 1] == '/', "arena_dir should end in / \"%s\" %zu",
             dir_buffer, arena_dir->__dir_len - 1);
 }
@@ -187,30 +203,32 @@ void arena_drop_after_fork(struct ArenaDir* arena_dir) {
     arena_dir->__next_instantiation = 0;
 }
 
-void arena_sync(struct ArenaDir* arena_dir) {
+void arena_sync(struct ArenaDir* arena_dir, bool durable) {
     struct ArenaListElem* current = arena_dir->__tail;
     while (current) {
         for (size_t i = 0; i < current->next_free_slot; ++i) {
             struct ArenaHeader* arena = current->arena_list[i];
             if (arena != NULL) {
                 // msync but no mmunmap
-                EXPECT(== 0,
-                       probe_libc_msync((void*)arena->base_address, arena->capacity, MS_SYNC));
+                EXPECT(== 0, probe_libc_msync((void*)arena->base_address, arena->capacity,
+                                              durable ? MS_SYNC : MS_ASYNC));
             }
         }
         current = current->prev;
     }
 }
 
-void arena_uninstantiate_all_but_last(struct ArenaDir* arena_dir) {
+void arena_uninstantiate_all_but_last(struct ArenaDir* arena_dir, bool durable) {
     struct ArenaListElem* current = arena_dir->__tail;
     bool is_tail = true;
     while (current) {
         for (size_t i = 0; i + ((size_t)is_tail) < current->next_free_slot; ++i) {
             struct ArenaHeader* arena = current->arena_list[i];
             if (arena != NULL) {
-                EXPECT(== 0,
-                       probe_libc_msync((void*)arena->base_address, arena->capacity, MS_SYNC));
+                /* munmap does not discard dirty pages of a shared mapping,
+                 * so a non-durable uninstantiate need not wait for writeback. */
+                EXPECT(== 0, probe_libc_msync((void*)arena->base_address, arena->capacity,
+                                              durable ? MS_SYNC : MS_ASYNC));
                 EXPECT(== 0, probe_libc_munmap((void*)arena->base_address, arena->capacity));
                 current->arena_list[i] = NULL;
             }
@@ -231,6 +249,51 @@ bool arena_is_initialized(struct ArenaDir* arena_dir) {
     return arena_dir->__tail != NULL;
 }
 
+size_t arena_instantiation(struct ArenaDir* arena_dir) { return ARENA_CURRENT->instantiation; }
+
+size_t arena_capacity(struct ArenaDir* arena_dir) { return ARENA_CURRENT->capacity; }
+
+void arena_start_new(struct ArenaDir* arena_dir, size_t min_capacity) {
+    arena_reinstantiate(arena_dir, min_capacity);
+}
+
+void arena_release_older_than(struct ArenaDir* arena_dir, size_t instantiation,
+                              void (*compact)(struct ArenaHeader* arena)) {
+    size_t page_size = probe_libc_getpagesize();
+    struct ArenaListElem* current = arena_dir->__tail;
+    while (current) {
+        for (size_t i = 0; i < current->next_free_slot; ++i) {
+            struct ArenaHeader* arena = current->arena_list[i];
+            /* Arenas before __released_before were compacted and released by an earlier call;
+             * compacting them again would redo that work on every rollover. */
+            if (arena == NULL || arena->instantiation >= instantiation ||
+                arena->instantiation < arena_dir->__released_before) {
+                continue;
+            }
+            size_t keep = sizeof(struct ArenaHeader);
+            if (compact) {
+                compact(arena);
+                keep = arena->used;
+            }
+            keep = __arena_align(keep, page_size);
+            if (keep < arena->capacity) {
+                /* MADV_REMOVE punches a hole in the backing file, like fallocate(FALLOC_FL_PUNCH_HOLE) */
+                result err = probe_libc_madvise((void*)arena->base_address + keep,
+                                                arena->capacity - keep, MADV_REMOVE);
+                if (err != 0) {
+                    WARNING("Could not release arena %ld (error=%d); is the filesystem unable to "
+                            "punch holes?",
+                            arena->instantiation, err);
+                } else if (arena_dir->__bytes_in_use) {
+                    atomic_fetch_sub(arena_dir->__bytes_in_use, arena->capacity - keep);
+                }
+            }
+        }
+        current = current->prev;
+    }
+    arena_dir->__released_before = MAX(arena_dir->__released_before, instantiation);
+}
+
 // getconf -a | grep ARG_MAX
 #define ARG_MAX 2505728
 
@@ -6,6 +6,7 @@
 #include "../src/probe_libc.h"
 #include <stdbool.h> // for bool
 #include <stddef.h>  // for size_t
+#include <stdint.h>  // for uint64_t
 
 struct ArenaDir {
     char* _Nonnull __dir_buffer;
@@ -13,6 +14,11 @@ struct ArenaDir {
     size_t __dir_buffer_max;
     struct ArenaListElem* _Nullable __tail;
     size_t __next_instantiation;
+    size_t __max_capacity;
+    /* If non-NULL, the bytes each arena occupies on disk are added to (and, when released, subtracted from) this counter */
+    _Atomic(uint64_t)* _Nullable __bytes_in_use;
+    /* Arenas with a lower instantiation have already been released */
+    size_t __released_before;
 };
 
 __attribute__((visibility("hidden"))) void* _Nonnull arena_calloc(
@@ -38,7 +44,9 @@ __attribute__((visibility("hidden"))) void* _Nonnull arena_strndup(struct ArenaD
 __attribute__((visibility("hidden"))) void arena_create(struct ArenaDir* _Nonnull arena_dir,
                                                         char* _Nonnull dir_buffer, size_t dir_len,
                                                         size_t dir_buffer_max,
-                                                        size_t arena_capacity);
+                                                        size_t initial_capacity,
+                                                        size_t max_capacity,
+                                                        _Atomic(uint64_t)* _Nullable bytes_in_use);
 
 /*
  * Client MUST call arena_destroy or arena_sync for the changes to be saved
@@ -56,14 +64,45 @@ __attribute__((visibility("hidden"))) void arena_destroy(struct ArenaDir* _Nonnu
 __attribute__((visibility("hidden"))) void
 arena_drop_after_fork(struct ArenaDir* _Nonnull arena_dir);
 
-__attribute__((visibility("hidden"))) void arena_sync(struct ArenaDir* _Nonnull arena_dir);
+/*
+ * If durable, block until the arenas are written back (MS_SYNC).
+ * Otherwise, only schedule the writeback (MS_ASYNC).
+ * Since arenas are MAP_SHARED, other processes reading the files see their contents either way.
+ */
+__attribute__((visibility("hidden"))) void arena_sync(struct ArenaDir* _Nonnull arena_dir,
+                                                      bool durable);
 
 __attribute__((visibility("hidden"))) void
-arena_uninstantiate_all_but_last(struct ArenaDir* _Nonnull arena_dir);
+arena_uninstantiate_all_but_last(struct ArenaDir* _Nonnull arena_dir, bool durable);
 
 __attribute__((visibility("hidden"))) bool
 arena_is_initialized(struct ArenaDir* _Nonnull arena_dir);
 
+/* Instantiation number of the arena currently being allocated from */
+__attribute__((visibility("hidden"))) size_t
+arena_instantiation(struct ArenaDir* _Nonnull arena_dir);
+
+/* Capacity of the arena currently being allocated from */
+__attribute__((visibility("hidden"))) size_t arena_capacity(struct ArenaDir* _Nonnull arena_dir);
+
+/* Move on to a new arena of at least min_capacity bytes (including the header), even if the current one has room */
+__attribute__((visibility("hidden"))) void arena_start_new(struct ArenaDir* _Nonnull arena_dir,
+                                                           size_t min_capacity);
+
+/*
+ * Give back the disk space of every (mapped) arena whose instantiation is less than `instantiation`.
+ *
+ * If compact is non-NULL, it is called on each such arena first; it may rewrite the arena's contents and arena->used, and everything past arena->used gets released.
+ * Arenas released by a previous call are skipped, so each arena is compacted at most once.
+ * If compact is NULL, everything but the header is released.
+ *
+ * The pages are punched out of the file rather than unmapped (see prov_log_record), so they read as zero afterwards.
+ * Client MUST ensure nothing still points into the released part.
+ * */
+__attribute__((visibility("hidden"))) void
+arena_release_older_than(struct ArenaDir* _Nonnull arena_dir, size_t instantiation,
+                         void (*_Nullable compact)(struct ArenaHeader* _Nonnull arena));
+
 /* Copy char* const argv[] into the arena.
  * If argc argument is 0, compute argc and store there (if the size actually was zero, this is no bug).
  * If argc argument is positive, assume that is the argc.
@@ -0,0 +1,197 @@
+#include "copier.h"
+
+#include <fcntl.h>   // for AT_FDCWD
+#include <limits.h>  // IWYU pragma: keep for PATH_MAX
+#include <pthread.h> // for pthread_mutex_t, pthread_cond_t, pthread_sigmask
+#include <signal.h>  // for sigset_t, sigfillset, SIG_SETMASK
+#include <stddef.h>  // for size_t, NULL
+#include <stdio.h>   // for snprintf
+#include <sys/stat.h> // IWYU pragma: keep for statx, STATX_MTIME, STATX_CTIME, STATX_SIZE
+// IWYU pragma: no_include "bits/pthreadtypes.h"  for pthread_mutex_t
+// IWYU pragma: no_include "bits/sigset.h"        for sigset_t
+// IWYU pragma: no_include "linux/limits.h"       for PATH_MAX
+// IWYU pragma: no_include "linux/stat.h"         for statx, STATX_MTIME, STATX_CTIME, STATX_SIZE
+
+#include "../generated/headers.h"    // for Inode
+#include "../generated/libc_hooks.h" // for client_pthread_create
+#include "debug_logging.h"           // for DEBUG, WARNING, EXPECT
+#include "probe_libc.h"              // for probe_copy_fd, probe_libc_strncpy, probe_libc_close
+#include "util.h"                    // for CHECK_SNPRINTF
+
+#define COPIER_QUEUE_SIZE 64
+
+struct CopyJob {
+    int src_fd;
+    /* The version of the file to copy */
+    struct Inode inode;
+    char dst_path[PATH_MAX];
+};
+
+/* Threads of the same process share one copier */
+static pthread_mutex_t copier_lock = PTHREAD_MUTEX_INITIALIZER;
+/* Signaled when a job is queued */
+static pthread_cond_t copier_queued = PTHREAD_COND_INITIALIZER;
+/* Signaled when the last pending job is done */
+static pthread_cond_t copier_idle = PTHREAD_COND_INITIALIZER;
+static struct CopyJob copier_queue[COPIER_QUEUE_SIZE];
+static size_t copier_queue_head = 0;
+static size_t copier_queue_len = 0;
+/* Queued, plus the one being copied */
+static size_t copier_pending = 0;
+static bool copier_started = false;
+/*
+ * The fds of the job being copied (its source, then the temporary copy), or -1.
+ * Only the copier thread sets these; they are for a forked child,
+ * which inherits the fds but not the thread.
+ */
+static int copier_copying_fds[2] = {-1, -1};
+
+static inline bool same_version(const struct statx* _Nonnull statx_buf,
+                                const struct Inode* _Nonnull inode) {
+    return statx_buf->stx_size == inode->size &&
+           statx_buf->stx_mtime.tv_sec == inode->mtime.tv_sec &&
+           statx_buf->stx_mtime.tv_nsec == inode->mtime.tv_nsec &&
+           statx_buf->stx_ctime.tv_sec == inode->ctime.tv_sec &&
+           statx_buf->stx_ctime.tv_nsec == inode->ctime.tv_nsec;
+}
+
+/*
+ * Closes one of copier_copying_fds.
+ * It stops being tracked first, so a child forked in between never closes a reused fd number.
+ */
+static void close_copying_fd(size_t idx) {
+    int fd = copier_copying_fds[idx];
+    copier_copying_fds[idx] = -1;
+    probe_libc_close(fd);
+}
+
+/*
+ * Another process may write the file while we copy it; it skips its own copy, since the inode table says this version is being copied.
+ * So copy to a temporary name, and only rename it into place if the file is still the version we set out to copy.
+ * Otherwise the store lacks that version, which is better than holding a torn copy of it.
+ */
+static void copy_job(struct CopyJob* _Nonnull job) {
+    char tmp_path[PATH_MAX];
+    CHECK_SNPRINTF(tmp_path, PATH_MAX, "%s.tmp", job->dst_path);
+    result_int tmp_fd = probe_libc_openat(AT_FDCWD, tmp_path, O_WRONLY | O_CREAT, 0666);
+    if (tmp_fd.error) {
+        /* Not ERROR: exiting would take the client down from a thread it doesn't know about */
+        WARNING("Could not create %s", tmp_path);
+        return;
+    }
+    copier_copying_fds[1] = tmp_fd.value;
+    result copied = probe_copy_fd(job->src_fd, tmp_fd.value, job->inode.size);
+    close_copying_fd(1);
+    if (copied != 0) {
+        WARNING("Copying to %s failed", job->dst_path);
+    } else {
+        struct statx statx_buf;
+        if (probe_libc_statx(job->src_fd, NULL, AT_EMPTY_PATH,
+                             STATX_MTIME | STATX_CTIME | STATX_SIZE, &statx_buf) != 0 ||
+            !same_version(&statx_buf, &job->inode)) {
+            WARNING("%s changed while it was being copied; not keeping the copy", job->dst_path);
+        } else if (probe_libc_renameat(AT_FDCWD, tmp_path, AT_FDCWD, job->dst_path) != 0) {
+            WARNING("Could not move the copy into %s", job->dst_path);
+        } else {
+            return;
+        }
+    }
+    probe_libc_unlinkat(AT_FDCWD, tmp_path, 0);
+}
+
+static void* _Nullable copier_main(void* _Nullable arg) {
+    (void)arg;
+    EXPECT(== 0, pthread_mutex_lock(&copier_lock));
+    while (true) {
+        while (copier_queue_len == 0) {
+            EXPECT(== 0, pthread_cond_wait(&copier_queued, &copier_lock));
+        }
+        /* Copy the job out, since its slot may be reused as soon as we unlock */
+        struct CopyJob job = copier_queue[copier_queue_head];
+        /* Tracked before it leaves the queue, so a child forked in between closes it either way */
+        copier_copying_fds[0] = job.src_fd;
+        __atomic_thread_fence(__ATOMIC_SEQ_CST);
+        copier_queue_head = (copier_queue_head + 1) % COPIER_QUEUE_SIZE;
+        --copier_queue_len;
+        EXPECT(== 0, pthread_mutex_unlock(&copier_lock));
+
+        DEBUG("Copying %s in the background", job.dst_path);
+        copy_job(&job);
+        close_copying_fd(0);
+
+        EXPECT(== 0, pthread_mutex_lock(&copier_lock));
+        --copier_pending;
+        if (copier_pending == 0) {
+            EXPECT(== 0, pthread_cond_broadcast(&copier_idle));
+        }
+    }
+    return NULL;
+}
+
+/* Call with copier_lock held */
+static bool copier_start() {
+    /* The client's signal handlers should not run on our thread, so it starts with every signal blocked. */
+    sigset_t all_signals;
+    sigset_t old_mask;
+    sigfillset(&all_signals);
+    EXPECT(== 0, pthread_sigmask(SIG_SETMASK, &all_signals, &old_mask));
+    pthread_t thread;
+    /* Not through our pthread_create wrapper, since this thread is not the client's to record */
+    int ret = client_pthread_create(&thread, NULL, copier_main, NULL);
+    EXPECT(== 0, pthread_sigmask(SIG_SETMASK, &old_mask, NULL));
+    if (ret != 0) {
+        WARNING("Could not start the copier thread; copying synchronously");
+        return false;
+    }
+    EXPECT(== 0, pthread_detach(thread));
+    return true;
+}
+
+bool copier_submit(int src_fd, const char* _Nonnull dst_path, struct Inode inode) {
+    EXPECT(== 0, pthread_mutex_lock(&copier_lock));
+    if (!copier_started) {
+        copier_started = copier_start();
+    }
+    bool submitted = copier_started && copier_queue_len < COPIER_QUEUE_SIZE;
+    if (submitted) {
+        struct CopyJob* job =
+            &copier_queue[(copier_queue_head + copier_queue_len) % COPIER_QUEUE_SIZE];
+        job->src_fd = src_fd;
+        job->inode = inode;
+        probe_libc_strncpy(job->dst_path, dst_path, PATH_MAX);
+        ++copier_queue_len;
+        ++copier_pending;
+        EXPECT(== 0, pthread_cond_signal(&copier_queued));
+    }
+    EXPECT(== 0, pthread_mutex_unlock(&copier_lock));
+    return submitted;
+}
+
+void copier_drain() {
+    EXPECT(== 0, pthread_mutex_lock(&copier_lock));
+    while (copier_pending != 0) {
+        DEBUG("Waiting for %zu background copies", copier_pending);
+        EXPECT(== 0, pthread_cond_wait(&copier_idle, &copier_lock));
+    }
+    EXPECT(== 0, pthread_mutex_unlock(&copier_lock));
+}
+
+void copier_reset_after_fork() {
+    /* The parent's copier thread may have held the lock at the time of the fork. */
+    EXPECT(== 0, pthread_mutex_init(&copier_lock, NULL));
+    EXPECT(== 0, pthread_cond_init(&copier_queued, NULL));
+    EXPECT(== 0, pthread_cond_init(&copier_idle, NULL));
+    /* The parent copies these; the child only inherited the fds */
+    for (size_t idx = 0; idx < copier_queue_len; ++idx) {
+        probe_libc_close(copier_queue[(copier_queue_head + idx) % COPIER_QUEUE_SIZE].src_fd);
+    }
+    for (size_t idx = 0; idx < 2; ++idx) {
+        if (copier_copying_fds[idx] != -1) {
+            close_copying_fd(idx);
+        }
+    }
+    copier_queue_head = 0;
+    copier_queue_len = 0;
+    copier_pending = 0;
+    copier_started = false;
+}
@@ -0,0 +1,28 @@
+#pragma once
+
+#define _GNU_SOURCE
+
+#include <stdbool.h> // for bool
+
+#include "../generated/headers.h" // for Inode
+
+/*
+ * With ProcessTreeContext.copy_files_async_min_size, large files which are only being read get copied into the store by a copier thread,
+ * so the open that triggered the copy returns without waiting for it.
+ * The copier reads through its own read-only fd, so the copy still succeeds if the client closes or unlinks the file meanwhile.
+ *
+ * Pending copies are drained before anything could change what they copy (a write access from this process) and before it is too late (exec, exit).
+ * Other processes are not held back, so each copy is made under a temporary name and only renamed into place if the file did not change meanwhile.
+ * A copy still pending when the process is killed, or calls _exit, is left incomplete (under its temporary name).
+ */
+
+/* Hand src_fd (which is closed when done) to the copier thread, to copy version inode of it to dst_path.
+ * Returns false if the copier can't take it (e.g., its queue is full); then the caller still owns src_fd. */
+__attribute__((visibility("hidden"))) bool copier_submit(int src_fd, const char* _Nonnull dst_path,
+                                                         struct Inode inode);
+
+/* Wait for all submitted copies to finish */
+__attribute__((visibility("hidden"))) void copier_drain();
+
+/* The child of a fork has no copier thread, and none of the parent's copies to wait for */
+__attribute__((visibility("hidden"))) void copier_reset_after_fork();
@@ -2,10 +2,12 @@
 
 #include <limits.h>  // IWYU pragma: keep for PATH_MAX
 #include <stdbool.h> // for bool, false, true
-#include <stdlib.h>  // for malloc
+#include <stdint.h>  // for uint64_t, SIZE_MAX
+#include <stdlib.h>  // for malloc, calloc, free
 // IWYU pragma: no_include "linux/limits.h"  for PATH_MAX
 
 #include "../generated/headers.h" // for FixedPath, LD_PRELOAD_VAR, PROBE_...
+#include "arena.h"                // for arena_copy_argv
 #include "debug_logging.h"        // for DEBUG, ASSERTF, EXPECT_NONNULL
 #include "global_state.h"         // for get_libprobe_path, get_probe_dir
 #include "probe_libc.h"           // for probe_libc_...
@@ -114,3 +116,116 @@ char const* const* update_env_with_probe_vars(char const* const* env, size_t* ne
 
     return (const char* const*)new_env;
 }
+
+/*
+ * The initial env is indexed by an open-addressing hash table of its entries,
+ * so computing a delta is linear in the size of the env rather than quadratic.
+ * */
+struct InitialEnvSlot {
+    uint64_t hash;
+    size_t length;
+    /* Index into initial_env, or SIZE_MAX if the slot is empty */
+    size_t index;
+};
+static StringArray initial_env = NULL;
+static size_t initial_envc = 0;
+static struct InitialEnvSlot* initial_env_slots = NULL;
+static size_t initial_env_slots_mask = 0;
+
+static inline uint64_t hash_env_entry(const char* entry, size_t* length) {
+    /* FNV-1a */
+    uint64_t hash = 0xcbf29ce484222325;
+    const char* ptr = entry;
+    for (; *ptr != '\0'; ++ptr) {
+        hash = (hash ^ (unsigned char)*ptr) * 0x100000001b3;
+    }
+    *length = (size_t)(ptr - entry);
+    return hash;
+}
+
+static inline size_t lookup_initial_env(const char* entry) {
+    if (!initial_env_slots) {
+        return SIZE_MAX;
+    }
+    size_t length = 0;
+    uint64_t hash = hash_env_entry(entry, &length);
+    for (size_t slot = hash & initial_env_slots_mask;; slot = (slot + 1) & initial_env_slots_mask) {
+        const struct InitialEnvSlot* candidate = &initial_env_slots[slot];
+        if (candidate->index == SIZE_MAX) {
+            return SIZE_MAX;
+        }
+        if (candidate->hash == hash && candidate->length == length &&
+            probe_libc_memcmp(initial_env[candidate->index], entry, length) == 0) {
+            return candidate->index;
+        }
+    }
+}
+
+void set_initial_env(StringArray env) {
+    /* After a fork, the table inherited from the parent points into the parent's (now dropped) arenas. */
+    free(initial_env_slots);
+    initial_env = env;
+    initial_envc = 0;
+    for (char const* const* env_pair = env; *env_pair != NULL; ++env_pair) {
+        ++initial_envc;
+    }
+    size_t n_slots = 16;
+    while (n_slots < 2 * initial_envc) {
+        n_slots *= 2;
+    }
+    initial_env_slots = EXPECT_NONNULL(malloc(n_slots * sizeof(struct InitialEnvSlot)));
+    initial_env_slots_mask = n_slots - 1;
+    for (size_t slot = 0; slot < n_slots; ++slot) {
+        initial_env_slots[slot].index = SIZE_MAX;
+    }
+    for (size_t idx = 0; idx < initial_envc; ++idx) {
+        size_t length = 0;
+        uint64_t hash = hash_env_entry(env[idx], &length);
+        size_t slot = hash & initial_env_slots_mask;
+        while (initial_env_slots[slot].index != SIZE_MAX) {
+            slot = (slot + 1) & initial_env_slots_mask;
+        }
+        initial_env_slots[slot] = (struct InitialEnvSlot){hash, length, idx};
+    }
+}
+
+struct EnvDelta arena_copy_env_delta(struct ArenaDir* arena_dir, char const* const* env,
+                                     size_t envc) {
+    if (envc == 0) {
+        for (char const* const* env_pair = env; *env_pair != NULL; ++env_pair) {
+            ++envc;
+        }
+    }
+
+    char const** added = EXPECT_NONNULL(malloc((envc + 1) * sizeof(char*)));
+    size_t n_added = 0;
+    bool* kept = EXPECT_NONNULL(calloc(initial_envc + 1, sizeof(bool)));
+    for (size_t idx = 0; idx < envc; ++idx) {
+        size_t initial_idx = lookup_initial_env(env[idx]);
+        if (initial_idx == SIZE_MAX) {
+            added[n_added++] = env[idx];
+        } else {
+            kept[initial_idx] = true;
+        }
+    }
+    added[n_added] = NULL;
+
+    char const** removed = EXPECT_NONNULL(malloc((initial_envc + 1) * sizeof(char*)));
+    size_t n_removed = 0;
+    for (size_t idx = 0; idx < initial_envc; ++idx) {
+        if (!kept[idx]) {
+            removed[n_removed++] = initial_env[idx];
+        }
+    }
+    removed[n_removed] = NULL;
+
+    struct EnvDelta delta = {
+        .added = arena_copy_argv(arena_dir, added, n_added),
+        .removed = arena_copy_argv(arena_dir, removed, n_removed),
+    };
+    DEBUG("env delta: %ld added, %ld removed", n_added, n_removed);
+    free(added);
+    free(removed);
+    free(kept);
+    return delta;
+}
@@ -4,5 +4,27 @@
 #include "../generated/headers.h"
 #include <stddef.h> // for size_t
 
+struct ArenaDir;
+
 __attribute__((visibility("hidden"))) StringArray update_env_with_probe_vars(
     char const* _Nullable const* _Nonnull user_env, size_t* _Nonnull updated_env_size);
+
+/*
+ * Exec ops store their environment as a delta against the env of the InitExecEpoch op of the current exec epoch.
+ * Scripts which exec many small tools mostly pass their environment through unchanged, so the delta is usually tiny.
+ * */
+struct EnvDelta {
+    /* Entries in the new env which are not in the initial env */
+    StringArray added;
+    /* Entries in the initial env which are not in the new env */
+    StringArray removed;
+};
+
+/* Remember the env of the current exec epoch (already copied into the data arena), against which deltas are computed. */
+__attribute__((visibility("hidden"))) void set_initial_env(StringArray initial_env);
+
+/* Copy the delta between env and the initial env into the arena.
+ * As in arena_copy_argv, if envc is 0, compute it.
+ * */
+__attribute__((visibility("hidden"))) struct EnvDelta
+arena_copy_env_delta(struct ArenaDir* _Nonnull arena_dir, StringArray env, size_t envc);
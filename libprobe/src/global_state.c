@@ -3,9 +3,11 @@
 #include <fcntl.h>     // for AT_FDCWD, O_CREAT, O_PATH, O_RD...
 #include <limits.h>    // IWYU pragma: keep for PATH_MAX
 #include <pthread.h>   // for pthread_mutex_t
+#include <stdatomic.h> // for atomic_load
 #include <stdbool.h>   // for true, bool, false
 #include <stdlib.h>    // for free
 #include <sys/mman.h>  // IWYU pragma: keep for PROT_*, MAP_*
+#include <sys/resource.h> // for RUSAGE_SELF, RUSAGE_THREAD
 #include <sys/stat.h>  // IWYU pragma: keep for STATX_BASIC_STATS, statx
 #include <sys/types.h> // for pid_t
 #include <unistd.h>    // for confstr, _CS_PATH
@@ -18,9 +20,14 @@
 #include "../generated/libc_hooks.h"  // for client_...
 #include "../generated/size_checks.h" // IWYU pragma: keep
 #include "arena.h"                    // for arena_is_initialized, arena_create
+#include "copier.h"                   // for copier_drain, copier_reset_after_fork
 #include "debug_logging.h"            // for ASSERTF, EXPECT, DEBUG, ERROR
+#include "env.h"                      // for set_initial_env
 #include "probe_libc.h"               // for probe_libc_...
-#include "prov_buffer.h"              // for prov_log_try, prov_log_record, prov_log_save
+#include "prov_buffer.h"              // for prov_log_record
+#include "prov_utils.h"               // for op_code_to_category, sample_resources
+#include "ring.h"                     // for ring_reset_after_fork
+#include "summary.h"                  // for summary_flush, summary_reset_after_fork
 #include "util.h"                     // for CHECK_SNPRINTF, list_dir, UNLIKELY
 
 #ifdef NDEBUG
@@ -160,6 +167,76 @@ const struct FixedPath* _Nonnull get_libprobe_path() {
     return &(get_process_tree_context()->libprobe_path);
 }
 enum CopyFiles get_copy_files_mode() { return get_process_tree_context()->copy_files; }
+size_t get_copy_files_async_min_size() {
+    return get_process_tree_context()->copy_files_async_min_size;
+}
+enum FlushMode get_flush_mode() { return get_process_tree_context()->flush_mode; }
+bool get_summary_mode() { return get_process_tree_context()->summary; }
+uint32_t get_summary_interval() { return get_process_tree_context()->summary_interval; }
+size_t get_arena_budget() { return get_process_tree_context()->arena_budget; }
+
+/*
+ * Shared by every process in the tree, through a file in probe_dir.
+ * Only mapped if the recording is bounded.
+ */
+static _Atomic(uint64_t)* __arena_bytes = NULL;
+static inline void init_arena_bytes() {
+    if (get_arena_budget() != 0) {
+        const struct FixedPath* probe_dir = get_probe_dir();
+        char path_buf[PATH_MAX] = {0};
+        probe_libc_memcpy(path_buf, probe_dir->bytes, probe_dir->len);
+        probe_libc_memcpy(path_buf + probe_dir->len, "/" ARENA_BYTES_FILE "\0",
+                          (sizeof(ARENA_BYTES_FILE) + 1));
+        __arena_bytes = open_and_mmap(path_buf, true, sizeof(uint64_t));
+    }
+}
+bool arena_budget_exceeded() {
+    return __arena_bytes && atomic_load(__arena_bytes) > get_arena_budget();
+}
+
+/*
+ * Shared by every process in the tree, through a file in probe_dir.
+ * Only mapped if copying files.
+ * The file is sparse; only the parts of the table that get used take up space.
+ */
+static struct InodeTable* __inode_table = NULL;
+static inline void init_inode_table() {
+    enum CopyFiles mode = get_copy_files_mode();
+    if (mode == CopyFiles_Lazily || mode == CopyFiles_Eagerly) {
+        const struct FixedPath* probe_dir = get_probe_dir();
+        char path_buf[PATH_MAX] = {0};
+        probe_libc_memcpy(path_buf, probe_dir->bytes, probe_dir->len);
+        probe_libc_memcpy(path_buf + probe_dir->len, "/" INODE_TABLE_FILE "\0",
+                          (sizeof(INODE_TABLE_FILE) + 1));
+        __inode_table = open_and_mmap(path_buf, true, INODE_TABLE_SIZE);
+    }
+}
+struct InodeTable* _Nonnull get_inode_table() { return EXPECT_NONNULL(__inode_table); }
+
+_Static_assert(OpData_Sentinel <= 64, "__recorded_ops has one bit per OpData_Tag");
+uint64_t __recorded_ops = 0;
+static inline void init_recorded_ops() {
+    /* Process ops are always recorded; the happens-before graph is built from them. */
+    uint8_t categories =
+        get_process_tree_context()->recorded_op_categories | (1 << OpCategory_Process);
+    __recorded_ops = 0;
+    for (int tag = 0; tag < OpData_Sentinel; ++tag) {
+        if (categories & (1 << op_code_to_category(tag))) {
+            __recorded_ops |= ((uint64_t)1) << tag;
+        }
+    }
+    if (get_summary_mode()) {
+        /* Open and Stat ops feed the summary table (see summary.h).
+         * Other file ops have no inode to be summarized under, so they are not recorded. */
+        uint64_t summarized_ops = (((uint64_t)1) << OpData_Open) | (((uint64_t)1) << OpData_Stat);
+        for (int tag = 0; tag < OpData_Sentinel; ++tag) {
+            if (op_code_to_category(tag) == OpCategory_Process) {
+                summarized_ops |= ((uint64_t)1) << tag;
+            }
+        }
+        __recorded_ops &= summarized_ops;
+    }
+}
 
 static inline void create_epoch_dir() {
     char path_buf[PATH_MAX] = {0};
@@ -211,11 +288,13 @@ struct ThreadState {
 typedef struct ThreadState* ThreadTable1[256];
 typedef ThreadTable1* ThreadTable0[256];
 ThreadTable0 __thread_table = {NULL};
+/* Guards publishing states in __thread_table, unpublishing and freeing them, and walking the table
+ * from another thread (see sync_all_thread_arenas). */
+static pthread_mutex_t __thread_table_lock = PTHREAD_MUTEX_INITIALIZER;
 static inline void init_tid(struct ThreadState* state) { state->tid = probe_libc_gettid(); }
 PthreadID increment_pthread_id() {
     return __atomic_add_fetch(&__pthread_id_counter, 1, __ATOMIC_RELAXED);
 }
-static const size_t prov_log_arena_size = 64 * 1024;
 static inline void init_paths(struct ThreadState* state) {
     const struct FixedPath* probe_dir = get_probe_dir();
     pid_t pid = get_pid();
@@ -237,10 +316,11 @@ static inline void init_paths(struct ThreadState* state) {
     check_fixed_path((&state->data_path));
 }
 static inline void init_arenas(struct ThreadState* state) {
+    const struct ProcessTreeContext* ptc = get_process_tree_context();
     arena_create(&state->ops_arena, state->ops_path.bytes, state->ops_path.len, PATH_MAX,
-                 prov_log_arena_size);
+                 ptc->arena_initial_size, ptc->arena_max_size, __arena_bytes);
     arena_create(&state->data_arena, state->data_path.bytes, state->data_path.len, PATH_MAX,
-                 prov_log_arena_size);
+                 ptc->arena_initial_size, ptc->arena_max_size, __arena_bytes);
     ASSERTF(arena_is_initialized(&state->ops_arena), "");
     ASSERTF(arena_is_initialized(&state->data_arena), "");
 }
@@ -250,12 +330,16 @@ static inline struct ThreadState* _Nonnull get_thread_state() {
 void free_thread_state(void* _Nonnull arg) {
     struct ThreadState* state = EXPECT_NONNULL(arg);
     /* TODO: Insert exit op */
-    arena_sync(&state->data_arena);
-    arena_sync(&state->ops_arena);
+    bool durable = get_flush_mode() == FlushMode_Sync;
+    arena_sync(&state->data_arena, durable);
+    arena_sync(&state->ops_arena, durable);
     uint8_t pthread_id_level0 = (state->pthread_id & 0xFF00) >> 8;
     uint8_t pthread_id_level1 = (state->pthread_id & 0x00FF);
-    free(state);
+    /* Unpublish and free under the lock, so sync_all_thread_arenas does not use a freed state */
+    EXPECT(== 0, pthread_mutex_lock(&__thread_table_lock));
     (*__thread_table[pthread_id_level0])[pthread_id_level1] = NULL;
+    free(state);
+    EXPECT(== 0, pthread_mutex_unlock(&__thread_table_lock));
 }
 static inline void init_thread_state(PthreadID pthread_id) {
     struct ThreadState* state = EXPECT_NONNULL(calloc(1, sizeof(struct ThreadState)));
@@ -268,6 +352,7 @@ static inline void init_thread_state(PthreadID pthread_id) {
     EXPECT(== 0, pthread_setspecific(__thread_state_key, state));
     uint8_t pthread_id_level0 = (state->pthread_id & 0xFF00) >> 8;
     uint8_t pthread_id_level1 = (state->pthread_id & 0x00FF);
+    EXPECT(== 0, pthread_mutex_lock(&__thread_table_lock));
     if (!__thread_table[pthread_id_level0]) {
         __thread_table[pthread_id_level0] = EXPECT_NONNULL(calloc(1, sizeof(ThreadTable1)));
     }
@@ -276,8 +361,11 @@ static inline void init_thread_state(PthreadID pthread_id) {
             "ThreadTable at %d = %d << 8 | %d already occupied with %p", state->pthread_id,
             pthread_id_level0, pthread_id_level1, (*level1)[pthread_id_level1]);
     (*level1)[pthread_id_level1] = state;
+    EXPECT(== 0, pthread_mutex_unlock(&__thread_table_lock));
 }
 static inline void drop_threads_after_fork() {
+    /* Another thread of the parent may have held it; only this thread survives the fork */
+    EXPECT(== 0, pthread_mutex_init(&__thread_table_lock, NULL));
     for (PthreadID pthread_id = 0; pthread_id < __pthread_id_counter; ++pthread_id) {
         uint8_t pthread_id_level0 = (pthread_id & 0xFF00) >> 8;
         uint8_t pthread_id_level1 = (pthread_id & 0x00FF);
@@ -301,6 +389,25 @@ static inline void drop_threads_after_fork() {
     }
     __pthread_id_counter = 1;
 }
+void sync_all_thread_arenas(bool durable) {
+    EXPECT(== 0, pthread_mutex_lock(&__thread_table_lock));
+    /* increment_pthread_id pre-increments, so the newest thread's ID is the counter itself.
+     * The loop counter is wider than PthreadID, so the loop ends even at its maximum. */
+    PthreadID last_pthread_id = __atomic_load_n(&__pthread_id_counter, __ATOMIC_RELAXED);
+    for (uint32_t pthread_id = 0; pthread_id <= last_pthread_id; ++pthread_id) {
+        uint8_t pthread_id_level0 = (pthread_id & 0xFF00) >> 8;
+        uint8_t pthread_id_level1 = (pthread_id & 0x00FF);
+        ThreadTable1* level1 = __thread_table[pthread_id_level0];
+        /* Pthread IDs are handed out before their thread is initialized (see increment_pthread_id),
+         * so either level may still be empty. */
+        struct ThreadState* state = level1 ? (*level1)[pthread_id_level1] : NULL;
+        if (state) {
+            arena_sync(&state->data_arena, durable);
+            arena_sync(&state->ops_arena, durable);
+        }
+    }
+    EXPECT(== 0, pthread_mutex_unlock(&__thread_table_lock));
+}
 struct ArenaDir* _Nonnull get_op_arena() { return &(get_thread_state()->ops_arena); }
 struct ArenaDir* _Nonnull get_data_arena() { return &(get_thread_state()->data_arena); }
 pid_t get_tid() { return get_thread_state()->tid; }
@@ -339,6 +446,8 @@ static inline void emit_init_epoch_op() {
     if (cmdline.error) {
         ERROR("");
     }
+    StringArray env = arena_copy_argv(get_data_arena(), (StringArray)probe_environ, 0);
+    set_initial_env(env);
     struct Op init_epoch_op = {
         .data =
             {
@@ -354,10 +463,11 @@ static inline void emit_init_epoch_op() {
                                 .name = arena_strndup(get_data_arena(), exe.bytes, exe.len + 1),
                             },
                         .argv = arena_copy_cmdline(get_data_arena(), cmdline),
-                        .env = arena_copy_argv(get_data_arena(), (StringArray)probe_environ, 0),
+                        .env = env,
                         .std_in = get_inode(0),
                         .std_out = get_inode(1),
                         .std_err = get_inode(2),
+                        .resources = sample_resources(RUSAGE_SELF),
                     },
             },
     };
@@ -367,11 +477,31 @@ static inline void emit_init_epoch_op() {
 
 static inline void emit_init_thread_op() {
     struct Op init_thread_op = {
-        .data = {.init_thread_tag = OpData_InitThread, .init_thread = {.tid = get_tid()}},
+        .data = {.init_thread_tag = OpData_InitThread,
+                 .init_thread = {.tid = get_tid(), .resources = sample_resources(RUSAGE_THREAD)}},
     };
     prov_log_record(init_thread_op);
 }
 
+void emit_exit_thread_op() {
+    prov_log_record((struct Op){
+        .data = {.exit_thread_tag = OpData_ExitThread,
+                 .exit_thread = {.status = 0, .resources = sample_resources(RUSAGE_THREAD)}},
+    });
+}
+
+/* -1 unless the process called exit() */
+static int __exit_status = -1;
+void set_exit_status(int status) { __exit_status = status; }
+
+static inline void emit_exit_process_op() {
+    prov_log_record((struct Op){
+        .data = {.exit_process_tag = OpData_ExitProcess,
+                 .exit_process = {.status = __exit_status,
+                                  .resources = sample_resources(RUSAGE_SELF)}},
+    });
+}
+
 bool is_thread_inited() { return !!pthread_getspecific(__thread_state_key); }
 
 bool is_proc_inited() {
@@ -398,6 +528,10 @@ void init_after_fork() {
     create_epoch_dir();
     init_thread_state_key();
     drop_threads_after_fork();
+    summary_reset_after_fork();
+    ring_reset_after_fork();
+    copier_reset_after_fork();
+    __exit_status = -1;
     init_thread_state(0);
     ASSERTF(is_proc_inited(), "Failed to init proc");
     ASSERTF(is_thread_inited(), "Failed to init thread");
@@ -415,6 +549,9 @@ void init_proc() {
     init_pid(false);
     init_probe_dir();
     init_process_tree_context();
+    init_recorded_ops();
+    init_arena_bytes();
+    init_inode_table();
     init_process_context();
     create_epoch_dir();
     init_default_path();
@@ -450,3 +587,16 @@ __attribute__((constructor)) void constructor() {
         init_proc();
     }
 }
+
+/* Destructors run when the process exits (but not on _exit or a successful exec).
+ * In FlushMode_Async, this is the only place where the arenas get synced durably. */
+__attribute__((destructor)) void destructor() {
+    if (is_proc_inited() && is_thread_inited()) {
+        DEBUG("Library destructor. Syncing arenas");
+        summary_flush();
+        copier_drain();
+        emit_exit_process_op();
+        /* Not just this thread's arenas; other threads never get another chance to sync. */
+        sync_all_thread_arenas(true);
+    }
+}
@@ -3,7 +3,8 @@
 #define _GNU_SOURCE
 
 #include <stdbool.h>   // for bool
-#include <stdint.h>    // for uint16_t
+#include <stddef.h>    // for size_t
+#include <stdint.h>    // for uint16_t, uint64_t
 #include <sys/types.h> // for pid_t
 
 #include "../generated/headers.h" // for CopyFiles
@@ -44,6 +45,36 @@ __attribute__((visibility("hidden"))) const struct FixedPath* _Nonnull get_libpr
 
 __attribute__((visibility("hidden"))) enum CopyFiles get_copy_files_mode();
 
+__attribute__((visibility("hidden"))) size_t get_copy_files_async_min_size();
+
+__attribute__((visibility("hidden"))) enum FlushMode get_flush_mode();
+
+__attribute__((visibility("hidden"))) bool get_summary_mode();
+
+__attribute__((visibility("hidden"))) uint32_t get_summary_interval();
+
+/* 0 if the recording is unbounded */
+__attribute__((visibility("hidden"))) size_t get_arena_budget();
+
+/* Whether the arenas of all processes together exceed the arena budget; always false if unbounded */
+__attribute__((visibility("hidden"))) bool arena_budget_exceeded();
+
+/* Size of the region reserved for the inode table (see generated/inode_table.h) */
+#define INODE_TABLE_SIZE (((size_t)1) << 30)
+
+struct InodeTable;
+
+/* Which inodes have been read or copied, by any process of the recording; only if copying files */
+__attribute__((visibility("hidden"))) struct InodeTable* _Nonnull get_inode_table();
+
+/* Bit (1 << tag) is set if ops with that OpData_Tag should be recorded.
+ * This is read in every hook, so it is exposed directly rather than through a getter. */
+__attribute__((visibility("hidden"))) extern uint64_t __recorded_ops;
+
+static inline bool op_is_recorded(enum OpData_Tag tag) {
+    return __recorded_ops & (((uint64_t)1) << tag);
+}
+
 __attribute__((visibility("hidden"))) ExecEpoch get_exec_epoch_safe();
 
 __attribute__((visibility("hidden"))) ExecEpoch get_exec_epoch();
@@ -52,6 +83,9 @@ __attribute__((visibility("hidden"))) struct ArenaDir* _Nonnull get_op_arena();
 
 __attribute__((visibility("hidden"))) struct ArenaDir* _Nonnull get_data_arena();
 
+/* Sync the arenas of every live thread in this process, not just the calling one */
+__attribute__((visibility("hidden"))) void sync_all_thread_arenas(bool durable);
+
 __attribute__((visibility("hidden"))) PthreadID get_pthread_id();
 
 __attribute__((visibility("hidden"))) PthreadID increment_pthread_id();
@@ -64,6 +98,13 @@ __attribute__((visibility("hidden"))) void ensure_thread_initted();
 
 __attribute__((visibility("hidden"))) void init_thread(PthreadID);
 
+/* Record ExitThread; call just before the current thread exits */
+__attribute__((visibility("hidden"))) void emit_exit_thread_op();
+
+/* The ExitProcess op is recorded by the destructor, after atexit handlers had their turn.
+ * This remembers the status for it, if the process called exit(). */
+__attribute__((visibility("hidden"))) void set_exit_status(int status);
+
 __attribute__((visibility("hidden"))) bool is_thread_inited();
 
 __attribute__((visibility("hidden"))) void init_after_fork();
@@ -4,7 +4,9 @@
 #include <fcntl.h>       // for O_RDONLY, O_CLOEXEC
 #include <features.h>    // for __GLIBC_MINOR__, __GLIBC__
 #include <limits.h>      // IWYU pragma: keep for SSIZE_MAX
+#include <linux/fs.h>    // for FICLONE
 #include <linux/prctl.h> // for PR_*
+#include <stdbool.h>     // for bool
 #include <stddef.h>      // for size_t, NULL
 #include <stdint.h>      // for uint64_t, uintptr_t, int_fast16_t
 #include <stdio.h>       // for sprintf
@@ -364,6 +366,19 @@ result probe_libc_statx(int dirfd, const char* _Nullable path, int flags, unsign
     SYSCALL_ERROR_OPTION(retval);
 }
 
+result probe_libc_renameat(int old_dirfd, const char* _Nonnull old_path, int new_dirfd,
+                           const char* _Nonnull new_path) {
+    /* aarch64 has no renameat, only renameat2 */
+    ssize_t retval = probe_syscall5(SYS_renameat2, old_dirfd, (uintptr_t)old_path, new_dirfd,
+                                    (uintptr_t)new_path, 0);
+    SYSCALL_ERROR_OPTION(retval);
+}
+
+result probe_libc_unlinkat(int dirfd, const char* _Nonnull path, int flags) {
+    ssize_t retval = probe_syscall3(SYS_unlinkat, dirfd, (uintptr_t)path, flags);
+    SYSCALL_ERROR_OPTION(retval);
+}
+
 result probe_libc_mkdirat(int dirfd, const char* _Nonnull path, mode_t mode) {
     ssize_t retval = probe_syscall3(SYS_mkdirat, dirfd, (uintptr_t)path, mode);
     SYSCALL_ERROR_OPTION(retval);
@@ -459,29 +474,73 @@ result_ssize_t probe_libc_sendfile(int out_fd, int in_fd, off_t* _Nullable offse
     SYSCALL_ERROR_RESULT(result_ssize_t, retval);
 }
 
+result_ssize_t probe_libc_copy_file_range(int in_fd, off_t* _Nullable in_offset, int out_fd,
+                                          off_t* _Nullable out_offset, size_t count) {
+    ssize_t retval = probe_syscall6(SYS_copy_file_range, in_fd, (uintptr_t)in_offset, out_fd,
+                                    (uintptr_t)out_offset, count, /*flags*/ 0);
+    SYSCALL_ERROR_RESULT(result_ssize_t, retval);
+}
+
+result probe_libc_ioctl(int fd, unsigned long request, unsigned long arg) {
+    ssize_t retval = probe_syscall3(SYS_ioctl, fd, request, arg);
+    SYSCALL_ERROR_OPTION(retval);
+}
+
+result probe_libc_getrusage(int who, struct rusage* _Nonnull usage) {
+    ssize_t retval = probe_syscall2(SYS_getrusage, who, (uintptr_t)usage);
+    SYSCALL_ERROR_OPTION(retval);
+}
+
+/* These mean "not between these two files", rather than that something went wrong */
+static inline bool copy_unsupported(int error) {
+    return error == EXDEV || error == EINVAL || error == ENOSYS || error == EOPNOTSUPP;
+}
+
+result probe_copy_fd(int src_fd, int dst_fd, ssize_t size) {
+    /* A reflink shares the source's extents (Btrfs, XFS, bcachefs, ...), so it takes constant time. */
+    if (probe_libc_ioctl(dst_fd, FICLONE, src_fd) == 0) {
+        return 0;
+    }
+
+    /*
+     * copy_file_range can still avoid the round-trip through userspace, and some filesystems (NFS, CIFS) copy server-side.
+     * The kernel advances the offsets.
+     */
+    off_t src_offset = 0;
+    off_t dst_offset = 0;
+    bool in_kernel = true;
+    while (src_offset < size) {
+        result_ssize_t written =
+            in_kernel ? probe_libc_copy_file_range(src_fd, &src_offset, dst_fd, &dst_offset, SSIZE_MAX)
+                      : probe_libc_sendfile(dst_fd, src_fd, &src_offset, SSIZE_MAX);
+        if (written.error) {
+            if (in_kernel && src_offset == 0 && copy_unsupported(written.error)) {
+                in_kernel = false;
+                continue;
+            }
+            return written.error;
+        }
+        if (written.value == 0) {
+            /* The file shrank since we stat-ed it */
+            break;
+        }
+    }
+    return 0;
+}
+
 result probe_copy_file(int src_fd, int dst_dirfd, const char* _Nullable dst_path, ssize_t size) {
-    // See https://stackoverflow.com/a/2180157
     result_int dst_fd = probe_libc_openat(dst_dirfd, dst_path, O_WRONLY | O_CREAT, 0666);
     if (dst_fd.error) {
         probe_libc_close(src_fd);
         return (result)dst_fd.error;
     }
 
-    off_t copied = 0;
-    while (copied < size) {
-        result_ssize_t written = probe_libc_sendfile(dst_fd.value, src_fd, &copied, SSIZE_MAX);
-        if (written.error) {
-            probe_libc_close(src_fd);
-            probe_libc_close(dst_fd.value);
-            return written.error;
-        }
-        copied += written.value;
-    }
+    result ret = probe_copy_fd(src_fd, dst_fd.value, size);
 
     probe_libc_close(src_fd);
     probe_libc_close(dst_fd.value);
 
-    return 0;
+    return ret;
 }
 
 result_mem probe_libc_mmap(void* _Nullable addr, size_t len, int prot, int flags, int fd) {
@@ -503,6 +562,11 @@ result probe_libc_msync(void* _Nonnull addr, size_t len, int flags) {
     SYSCALL_ERROR_OPTION(retval);
 }
 
+result probe_libc_madvise(void* _Nonnull addr, size_t len, int advice) {
+    ssize_t retval = probe_syscall3(SYS_madvise, (uintptr_t)addr, len, advice);
+    SYSCALL_ERROR_OPTION(retval);
+}
+
 char* _Nonnull probe_libc_strncpy(char* _Nonnull dest, const char* _Nonnull src, size_t dsize) {
     size_t i = 0;
     for (; i < dsize; ++i) {
@@ -6,6 +6,8 @@
 #include <sys/types.h> // for pid_t, ssize_t, off_t
 // IWYU pragma: no_include "unistd.h" for environ
 
+struct rusage;
+
 #define ATTR_HIDDEN __attribute__((visibility("hidden")))
 
 // effectively a Result<()>, in standard C convention, 0 for success, >0 for error
@@ -64,6 +66,7 @@ ATTR_HIDDEN pid_t probe_libc_gettid(void);
 
 ATTR_HIDDEN result_int probe_libc_openat(int dirfd, const char* _Nullable path, int flags,
                                          mode_t mode);
+ATTR_HIDDEN result_int probe_libc_dup(int oldfd);
 
 /*
  * There is nothing useful to do with an error on close.
@@ -75,6 +78,9 @@ ATTR_HIDDEN void probe_libc_close(int fd);
 ATTR_HIDDEN result probe_libc_ftruncate(int fd, off_t length);
 ATTR_HIDDEN result probe_libc_statx(int dirfd, const char* _Nullable restrict path, int flags,
                                     unsigned int mask, void* _Nonnull restrict statxbuf);
+ATTR_HIDDEN result probe_libc_renameat(int old_dirfd, const char* _Nonnull old_path,
+                                       int new_dirfd, const char* _Nonnull new_path);
+ATTR_HIDDEN result probe_libc_unlinkat(int dirfd, const char* _Nonnull path, int flags);
 ATTR_HIDDEN result probe_libc_mkdirat(int dirfd, const char* _Nonnull path, mode_t mode);
 
 // implementing the flags parameter without soundness bugs requires using the
@@ -88,6 +94,18 @@ ATTR_HIDDEN result_int probe_libc_fcntl(int fd, int op, unsigned long arg);
 ATTR_HIDDEN result_ssize_t probe_read_all(int fd, void* _Nonnull buf, size_t n);
 ATTR_HIDDEN result_sized_mem probe_read_all_alloc(int fd);
 ATTR_HIDDEN result_sized_mem probe_read_all_alloc_path(int dirfd, const char* _Nonnull path);
+ATTR_HIDDEN result_ssize_t probe_libc_copy_file_range(int in_fd, off_t* _Nullable in_offset,
+                                                      int out_fd, off_t* _Nullable out_offset,
+                                                      size_t count);
+ATTR_HIDDEN result probe_libc_ioctl(int fd, unsigned long request, unsigned long arg);
+ATTR_HIDDEN result probe_libc_getrusage(int who, struct rusage* _Nonnull usage);
+
+// Copies size bytes of src_fd (from its start) to dst_fd, leaving both open.
+// Tries a reflink (FICLONE) first, then copy_file_range, then sendfile.
+ATTR_HIDDEN result probe_copy_fd(int src_fd, int dst_fd, ssize_t size);
+
+// Copies size bytes of src_fd (from its start) to a new file, and closes src_fd.
+// Tries a reflink (FICLONE) first, then copy_file_range, then sendfile.
 ATTR_HIDDEN result probe_copy_file(int src_fd, int dst_dirfd, const char* _Nullable dst_path,
                                    ssize_t size);
 
@@ -98,6 +116,7 @@ ATTR_HIDDEN result_mem probe_libc_mmap(void* _Nullable addr, size_t len, int pro
                                        int fd);
 ATTR_HIDDEN result probe_libc_munmap(void* _Nonnull addr, size_t len);
 ATTR_HIDDEN result probe_libc_msync(void* _Nonnull addr, size_t len, int flags);
+ATTR_HIDDEN result probe_libc_madvise(void* _Nonnull addr, size_t len, int advice);
 
 ATTR_HIDDEN char* _Nonnull probe_libc_strncpy(char* restrict _Nonnull dest,
                                               const char* restrict _Nonnull src, size_t dsize);
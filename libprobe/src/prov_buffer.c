@@ -14,22 +14,26 @@
 
 #include "../generated/fd_table.h"    // for fd_table_address_of_strong
 #include "../generated/headers.h"     // for Inode, OpenNumber, Op, OpData_Tag
-#include "../generated/inode_table.h" // for inode_table_address_of_strong
+#include "../generated/inode_table.h" // for inode_table_address_of_strong, InodeTable
 #include "../generated/libc_hooks.h"  // for client_fopen, client_openat
 #include "arena.h"                    // for arena_strndup, arena_sync, are...
+#include "copier.h"                   // for copier_submit, copier_drain
 #include "debug_logging.h"            // for DEBUG, ERROR, ASSERTF
 #include "errno.h"                    // for errno
-#include "global_state.h"             // for get_data_arena, get_op_arena
+#include "global_state.h"             // for get_data_arena, get_op_arena, get_inode_table, ...
 #include "linux/stat.h"               // for statx, STATX_CTIME, STATX_INO
 #include "probe_libc.h"               // for probe_copy_file, probe_libc_fa...
+#include "ring.h"                     // for ring_after_record
+#include "summary.h"                  // for summary_absorb
 #include "stdio.h"                    // for fileno
 #include "util.h"                     // for BORROWED, CHECK_SNPRINTF
 
 void prov_log_save() {
     /* TODO: ensure we call Arena save in atexit, pthread_cleanup_push */
     DEBUG("prov log save");
-    arena_sync(get_op_arena());
-    arena_sync(get_data_arena());
+    bool durable = get_flush_mode() == FlushMode_Sync;
+    arena_sync(get_op_arena(), durable);
+    arena_sync(get_data_arena(), durable);
 }
 
 enum AccessType {
@@ -48,22 +52,22 @@ static inline void path_to_id_string(const struct Inode inode, BORROWED char* st
         (long long int)inode.mtime.tv_sec, inode.mtime.tv_nsec, inode.size);
 }
 
-static int copy_to_store(int fd, struct Inode inode) {
+/*
+ * The copy of each inode version goes to INODES_SUBDIR/<id string>.
+ * If might_be_stored, another process may have copied it already, so check first.
+ */
+static int copy_to_store(enum AccessType access, int fd, struct Inode inode, bool might_be_stored) {
     static thread_local struct FixedPath store_path;
     static thread_local bool initialized = false;
     if (!initialized) {
         store_path = *get_probe_dir();
+        store_path.len += CHECK_SNPRINTF(store_path.bytes + store_path.len,
+                                         (int)(PATH_MAX - store_path.len), "/" INODES_SUBDIR);
         initialized = true;
     }
     store_path.bytes[store_path.len] = '/';
     path_to_id_string(inode, store_path.bytes + store_path.len + 1);
-    /*
-    ** We take precautions to avoid calling copy(f) if copy(f) is already called in the same process.
-    ** But it may have been already called in a different process!
-    ** Especially coreutils used in every script.
-     */
-    result access = probe_libc_faccessat(AT_FDCWD, store_path.bytes, F_OK);
-    if (access == 0) {
+    if (might_be_stored && probe_libc_faccessat(AT_FDCWD, store_path.bytes, F_OK) == 0) {
         return 0;
     } else if ((inode.mode & S_IFMT) == S_IFDIR) {
         ERROR("Can't copy directory %ld", inode.number);
@@ -72,7 +76,23 @@ static int copy_to_store(int fd, struct Inode inode) {
         return 0;
     } else if ((inode.mode & S_IFMT) == S_IFREG) {
         DEBUG("Copying regular file %ld", inode.number);
-        return (int)probe_copy_file(fd, AT_FDCWD, store_path.bytes, inode.size);
+        /*
+         * fd may be the client's fd, which may be write-only, and probe_copy_file consumes its source.
+         * So copy from a read-only reopening of the same file.
+         */
+        char fd_path[PATH_MAX];
+        CHECK_SNPRINTF(fd_path, PATH_MAX, "/proc/self/fd/%d", fd);
+        result_int src_fd = probe_libc_openat(AT_FDCWD, fd_path, O_RDONLY, 0);
+        if (src_fd.error) {
+            WARNING("Could not reopen %ld for reading; not copying it", inode.number);
+            return 0;
+        }
+        size_t async_min_size = get_copy_files_async_min_size();
+        if (access == READ_ACCESS && async_min_size != 0 && (size_t)inode.size >= async_min_size &&
+            copier_submit(src_fd.value, store_path.bytes, inode)) {
+            return 0;
+        }
+        return (int)probe_copy_file(src_fd.value, AT_FDCWD, store_path.bytes, inode.size);
     } else if ((inode.mode & S_IFMT) == S_IFCHR) {
         DEBUG("Copying block device file %ld", inode.number);
         // TODO
@@ -84,12 +104,58 @@ static int copy_to_store(int fd, struct Inode inode) {
     }
 }
 
-static struct InodeTable read_inodes;
-static struct InodeTable copied_or_overwritten_inodes;
+/*
+ * Flags of each inode in the inode table, which every process of the recording shares.
+ * So a process knows without a syscall whether any process may have copied an inode.
+ * The flags are per inode, not per inode version, and another process may have changed the inode
+ * since it set them; so once INODE_COPIED_OR_OVERWRITTEN is set, only the store can tell whether
+ * this version was copied (see copy_to_store's might_be_stored).
+ */
+#define INODE_READ ((uint8_t)1)
+#define INODE_COPIED_OR_OVERWRITTEN ((uint8_t)2)
+
+/* Set flags on the inode at index; returns which flags were set before.
+ * If the inode table is full, returns 0 and sets *table_full. */
+static uint8_t set_inode_flags(uint64_t index, uint8_t flags, bool* _Nonnull table_full) {
+    _Atomic(uint8_t)* _Nullable loc =
+        inode_table_address_of_strong(get_inode_table(), INODE_TABLE_SIZE, index);
+    *table_full = !loc;
+    if (UNLIKELY(!loc)) {
+        static bool warned = false;
+        if (!warned) {
+            warned = true;
+            WARNING("The inode table is full; deduplicating copies through the filesystem instead");
+        }
+        return 0;
+    }
+    return atomic_fetch_or(loc, flags);
+}
+
+/* Flag the inode at index as copied; returns whether a copy of its current version may already be
+ * in the store, because some process flagged it before or the table is full. */
+static inline bool mark_copied(uint64_t index) {
+    bool table_full = false;
+    uint8_t before = set_inode_flags(index, INODE_COPIED_OR_OVERWRITTEN, &table_full);
+    return table_full || (before & INODE_COPIED_OR_OVERWRITTEN);
+}
+
+static inline uint8_t get_inode_flags(uint64_t index) {
+    const _Atomic(uint8_t)* _Nullable loc = inode_table_address_of_weak(get_inode_table(), index);
+    return loc ? atomic_load(loc) : 0;
+}
+
+static inline bool copy_files_is_enabled() {
+    enum CopyFiles mode = get_copy_files_mode();
+    return mode == CopyFiles_Lazily || mode == CopyFiles_Eagerly;
+}
 
 static void maybe_copy_to_store(enum AccessType access, int fd, struct Inode inode) {
     enum CopyFiles mode = get_copy_files_mode();
-    if ((mode == CopyFiles_Lazily || mode == CopyFiles_Eagerly)) {
+    if (copy_files_is_enabled()) {
+        if (access != READ_ACCESS && get_copy_files_async_min_size() != 0) {
+            /* A background copy of the file about to be written must not see the write */
+            copier_drain();
+        }
         ASSERTF(inode.device_major < 256,
                 "Unexpectedly large device major number, %d. Resize inode table levels",
                 inode.device_major);
@@ -100,40 +166,22 @@ static void maybe_copy_to_store(enum AccessType access, int fd, struct Inode ino
                 "Unexpectedly large inode, %lu. Resize inode table levels", inode.number);
         uint64_t index = (((uint64_t)(inode.device_major)) << 48L) |
                          (((uint64_t)(inode.device_minor)) << 32L) | inode.number;
+        bool table_full = false;
         if (mode == CopyFiles_Lazily) {
             if (access == READ_ACCESS) {
                 DEBUG("Reading %ld", inode.number);
-                _Atomic(bool)* _Nonnull read_loc =
-                    inode_table_address_of_strong(&read_inodes, index);
-                atomic_store(read_loc, true);
+                set_inode_flags(index, INODE_READ, &table_full);
             } else if (access == READ_WRITE_ACCESS || access == WRITE_ACCESS) {
-                _Atomic(bool)* _Nonnull coo_loc =
-                    inode_table_address_of_strong(&copied_or_overwritten_inodes, index);
-                if (atomic_exchange(coo_loc, true)) {
-                    DEBUG("Mutating, but not copying %ld since it is copied already or "
-                          "overwritten",
-                          inode.number);
-                } else {
-                    DEBUG("Mutating, therefore copying %ld", inode.number);
-                    if (copy_to_store(fd, inode) != 0) {
-                        ERROR("Copying failed");
-                    }
+                DEBUG("Mutating, therefore copying %ld unless this version is stored",
+                      inode.number);
+                if (copy_to_store(access, fd, inode, mark_copied(index)) != 0) {
+                    ERROR("Copying failed");
                 }
             } else if (access == TRUNCATE_WRITE_ACCESS) {
-                const _Atomic(bool)* _Nullable read_loc =
-                    inode_table_address_of_weak(&read_inodes, index);
-                if (read_loc && atomic_load(read_loc)) {
-                    _Atomic(bool)* _Nonnull coo_loc =
-                        inode_table_address_of_strong(&copied_or_overwritten_inodes, index);
-                    if (atomic_exchange(coo_loc, true)) {
-                        DEBUG("Mutating, but not copying %ld since it is copied already or "
-                              "overwritten",
-                              inode.number);
-                    } else {
-                        DEBUG("Replace after read %ld", inode.number);
-                        if (copy_to_store(fd, inode) != 0) {
-                            ERROR("Copying failed");
-                        }
+                if (get_inode_flags(index) & INODE_READ) {
+                    DEBUG("Replace after read %ld", inode.number);
+                    if (copy_to_store(access, fd, inode, mark_copied(index)) != 0) {
+                        ERROR("Copying failed");
                     }
                 } else {
                     DEBUG("Mutating, but not copying %ld since it was never read", inode.number);
@@ -141,14 +189,8 @@ static void maybe_copy_to_store(enum AccessType access, int fd, struct Inode ino
             }
         } else if (access == READ_ACCESS || access == READ_WRITE_ACCESS || access == WRITE_ACCESS) {
             ASSERTF(mode == CopyFiles_Eagerly, "");
-            _Atomic(bool)* _Nonnull coo_loc =
-                inode_table_address_of_strong(&copied_or_overwritten_inodes, index);
-            if (atomic_exchange(coo_loc, true)) {
-                DEBUG("Not copying %ld because already did", inode.number);
-            } else {
-                if (copy_to_store(fd, inode) != 0) {
-                    ERROR("Copying failed");
-                }
+            if (copy_to_store(access, fd, inode, mark_copied(index)) != 0) {
+                ERROR("Copying failed");
             }
         }
     }
@@ -193,7 +235,7 @@ OpenNumber dup_open_numbers(int old, int new) {
     return ret;
 }
 
-_Atomic(uint16_t) unused_open_number = 1;
+_Atomic(uint32_t) unused_open_number = 1;
 
 OpenNumber new_open_number(int fd) {
     OpenNumber ret = {atomic_fetch_add(&unused_open_number, 1)};
@@ -217,37 +259,33 @@ int open_wrapper(int dirfd, const char* filename, int flags, mode_t mode) {
 
     DEBUG("open_wrapper(%d, \"%s\", %d, %d), access=%d", dirfd, filename, flags, mode, access);
 
-    int nondestructive_flags = (flags & ~(O_CREAT | O_TRUNC | O_TMPFILE)) | O_RDONLY;
-    int saved_errno = 0;
-    int fd = client_openat(dirfd, filename, nondestructive_flags, mode);
-    struct Inode inode;
-    if (fd >= 0) {
-        inode = get_inode(fd);
-        maybe_copy_to_store(access, fd, inode);
-    } else {
-        saved_errno = errno;
-        // TODO: note the fact that the file did NOT exist
-    }
-
-    // TODO: If failed in a way that destructively-open would not fix, add op and leave
-
-    if (flags != nondestructive_flags) {
-        if (fd >= 0) {
-            DEBUG("Closing the RW version");
-            close(fd);
-        }
-        // TODO: try interpreting flags instead of doing close+open
-        fd = client_openat(dirfd, filename, flags, mode);
-        if (fd >= 0) {
-            inode = get_inode(fd);
-        } else {
-            saved_errno = errno;
+    /*
+     * Only a truncating open destroys the contents before we get a chance to look at the fd.
+     * In that case, and only if we are copying files, open the old inode first.
+     * Otherwise, nothing has been written through the new fd yet, so we can identify (and maybe copy) the inode through it.
+     * This way, each open costs one stat, except truncating opens in copy-files mode, which need both.
+     */
+    bool truncating = copy_files_is_enabled() && (flags & O_TRUNC);
+    if (truncating) {
+        int nondestructive_flags = (flags & ~(O_ACCMODE | O_CREAT | O_TRUNC | O_TMPFILE)) | O_RDONLY;
+        result_int old_fd = probe_libc_openat(dirfd, filename, nondestructive_flags, 0);
+        if (!old_fd.error) {
+            maybe_copy_to_store(access, old_fd.value, get_inode(old_fd.value));
+            probe_libc_close(old_fd.value);
         }
+        // TODO: note the fact that the file did NOT exist
     }
 
+    int fd = client_openat(dirfd, filename, flags, mode);
+    int saved_errno = errno;
+    struct Inode inode = {0};
     OpenNumber open_number = {0};
     if (fd >= 0) {
-        new_open_number(fd);
+        inode = get_inode(fd);
+        if (!truncating) {
+            maybe_copy_to_store(access, fd, inode);
+        }
+        open_number = new_open_number(fd);
     }
     prov_log_record((struct Op){
         .data =
@@ -271,11 +309,7 @@ int open_wrapper(int dirfd, const char* filename, int flags, mode_t mode) {
             },
         .ferrno = 0,
     });
-    if (fd < 0) {
-        errno = saved_errno;
-    } else {
-        errno = 0;
-    }
+    errno = fd < 0 ? saved_errno : 0;
     return fd;
 }
 
@@ -298,39 +332,28 @@ FILE* fopen_wrapper(const char* filename, const char* opentype) {
     if (opentype[1] == '+') {
         access = READ_WRITE_ACCESS;
     }
-    int saved_errno = 0;
-    FILE* file = client_fopen(filename, "r");
-    struct Inode inode;
-    if (file) {
-        inode = get_inode(fileno(file));
-        maybe_copy_to_store(access, fileno(file), inode);
-    } else {
-        saved_errno = errno;
-        // TODO: note the fact that the file did NOT exist
-    }
-
-    // TODO: If failed in a way that destructively-open would not fix, add op and leave
-
-    // We opened in read mode
-    // If we need any other kind of mode
-    // do an open/freopen
-    if (opentype[0] != 'r' || opentype[1] != '\0') {
-        if (file) {
-            file = client_freopen(filename, opentype, file);
-        } else {
-            file = client_fopen(filename, opentype);
-        }
-        if (file) {
-            inode = get_inode(fileno(file));
-        } else {
-            saved_errno = errno;
+    /* See open_wrapper; only "w" truncates. */
+    bool truncating = copy_files_is_enabled() && opentype[0] == 'w';
+    if (truncating) {
+        result_int old_fd = probe_libc_openat(AT_FDCWD, filename, O_RDONLY, 0);
+        if (!old_fd.error) {
+            maybe_copy_to_store(access, old_fd.value, get_inode(old_fd.value));
+            probe_libc_close(old_fd.value);
         }
     }
 
+    FILE* file = client_fopen(filename, opentype);
+    int saved_errno = errno;
+    struct Inode inode = {0};
     OpenNumber open_number = {0};
     if (file) {
-        new_open_number(fileno(file));
+        inode = get_inode(fileno(file));
+        if (!truncating) {
+            maybe_copy_to_store(access, fileno(file), inode);
+        }
+        open_number = new_open_number(fileno(file));
     }
+
     prov_log_record((struct Op){
         .data =
             {
@@ -353,7 +376,7 @@ FILE* fopen_wrapper(const char* filename, const char* opentype) {
         .ferrno = 0,
     });
 
-    errno = saved_errno;
+    errno = file ? 0 : saved_errno;
     return file;
 }
 
@@ -367,6 +390,14 @@ OpenNumber close_wrapper(int fd) {
 void prov_log_record(struct Op op) {
     // TODO: construct op in op arena place instead of copying into arena.
     ASSERTF(0 <= op.data.tag && op.data.tag < OpData_Sentinel, "%d", op.data.tag);
+    /* Hooks whose ops have no side-effects on libprobe's state skip the op entirely (see gen_libc_hooks.py).
+     * The rest (e.g., open, which tracks open numbers) still do their bookkeeping, but their op is dropped here. */
+    if (!op_is_recorded(op.data.tag)) {
+        return;
+    }
+    if (UNLIKELY(get_summary_mode()) && summary_absorb(&op)) {
+        return;
+    }
     /* #ifdef DEBUG_LOG */
     /*     char str[PATH_MAX * 2]; */
     /*     op_to_human_readable(str, PATH_MAX * 2, &op); */
@@ -406,6 +437,10 @@ void prov_log_record(struct Op op) {
     struct Op* dest = arena_calloc(get_op_arena(), 1, sizeof(struct Op));
     probe_libc_memcpy(dest, &op, sizeof(struct Op));
 
+    if (UNLIKELY(get_arena_budget() != 0)) {
+        ring_after_record();
+    }
+
     /* TODO: Special handling of ops that affect process state */
 
     /* Freeing up virtual memory space is good in theory,
@@ -414,8 +449,8 @@ void prov_log_record(struct Op op) {
      * We can only safely free the op arena.
      * If the system runs low on memory, I think Linux will page out the infrequently used mmapped regions,
      * which is what we want. */
-    /* arena_uninstantiate_all_but_last(get_data_arena()); */
-    /* arena_uninstantiate_all_but_last(get_op_arena()); */
+    /* arena_uninstantiate_all_but_last(get_data_arena(), false); */
+    /* arena_uninstantiate_all_but_last(get_op_arena(), false); */
 }
 
 bool prov_log_is_enabled() { return true; }
@@ -5,6 +5,7 @@
 #include <stdio.h>                // for FILE*
 #include <sys/types.h>            // for mode_t
 
+/* Flush this thread's arenas according to the flush mode */
 __attribute__((visibility("hidden"))) void prov_log_save();
 
 __attribute__((visibility("hidden"))) void prov_log_record(struct Op op);
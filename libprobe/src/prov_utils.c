@@ -6,14 +6,14 @@
 #include <sys/resource.h>  // IWYU pragma: keep for rusage
 #include <sys/stat.h>      // IWYU pragma: keep for stat, statx, statx_timestamp
 #include <sys/sysmacros.h> // for major, minor
-#include <time.h>          // for timespec
+#include <time.h>          // for timespec, clock_gettime, CLOCK_REALTIME
 // IWYU pragma: no_include "bits/types/struct_rusage.h"      for rusage, rusage::(anonymous)
 // IWYU pragma: no_include "linux/limits.h"                  for PATH_MAX
 // IWYU pragma: no_include "linux/stat.h"                    for statx, statx_timestamp
 
 #include "../generated/headers.h" // for OpCode, StatResult, Op
-#include "debug_logging.h"        // for DEBUG, EXPECT_NONNULL, NOT...
-#include "probe_libc.h"           // for probe_libc_strlen
+#include "debug_logging.h"        // for DEBUG, EXPECT, WARNING, NOT...
+#include "probe_libc.h"           // for probe_libc_strlen, probe_libc_getrusage
 #include "util.h"                 // for CHECK_SNPRINTF, BORROWED
 
 int fopen_to_flags(BORROWED const char* fopentype) {
@@ -80,11 +80,38 @@ BORROWED const char* op_code_to_string(enum OpData_Tag op_code) {
         return "Unlink";
     case OpData_Rename:
         return "Rename";
+    case OpData_AccessSummary:
+        return "AccessSummary";
+    case OpData_DroppedOps:
+        return "DroppedOps";
     default:
         return "UnknownOp";
     }
 }
 
+enum OpCategory op_code_to_category(enum OpData_Tag op_code) {
+    switch (op_code) {
+    case OpData_Open:
+    case OpData_Close:
+    case OpData_Dup:
+    case OpData_MkFile:
+    case OpData_HardLink:
+    case OpData_SymbolicLink:
+    case OpData_Unlink:
+    case OpData_Rename:
+        return OpCategory_FileIo;
+    case OpData_Stat:
+    case OpData_Access:
+    case OpData_ReadLink:
+    case OpData_UpdateMetadata:
+        return OpCategory_Metadata;
+    case OpData_Readdir:
+        return OpCategory_Readdir;
+    default:
+        return OpCategory_Process;
+    }
+}
+
 static const size_t MAX_OPCODE_STRING_LENGTH = 256;
 
 void op_to_human_readable(char* dest, int size, struct Op* op) {
@@ -113,7 +140,7 @@ void op_to_human_readable(char* dest, int size, struct Op* op) {
         break;
     }
     case OpData_Close: {
-        int fd_size = CHECK_SNPRINTF(dest, size, " fd=%d ", op->data.close.open_number.value);
+        int fd_size = CHECK_SNPRINTF(dest, size, " fd=%u ", op->data.close.open_number.value);
         dest += fd_size;
         size -= fd_size;
         break;
@@ -178,3 +205,20 @@ void stat_result_from_statx(struct StatResult* stat_result_buf, struct statx* st
     stat_result_buf->blocks = statx_buf->stx_blocks;
     stat_result_buf->blksize = statx_buf->stx_blksize;
 }
+
+struct ResourceSample sample_resources(int who) {
+    struct timespec now;
+    EXPECT(== 0, clock_gettime(CLOCK_REALTIME, &now));
+    struct rusage usage = {0};
+    if (probe_libc_getrusage(who, &usage) != 0) {
+        WARNING("getrusage failed; recording no resource usage");
+    }
+    return (struct ResourceSample){
+        .time = {.tv_sec = now.tv_sec, .tv_nsec = now.tv_nsec},
+        .user_cpu_us = usage.ru_utime.tv_sec * 1000000UL + usage.ru_utime.tv_usec,
+        .system_cpu_us = usage.ru_stime.tv_sec * 1000000UL + usage.ru_stime.tv_usec,
+        .max_rss_kib = usage.ru_maxrss,
+        .blocks_in = usage.ru_inblock,
+        .blocks_out = usage.ru_oublock,
+    };
+}
@@ -2,7 +2,8 @@
 
 #define _GNU_SOURCE
 
-#include "util.h"    // for BORROWED
+#include "../generated/headers.h" // for OpCategory, OpData_Tag
+#include "util.h"                 // for BORROWED
 #include <stdbool.h> // for bool
 
 struct Op;
@@ -14,6 +15,8 @@ struct rusage;
 
 __attribute__((visibility("hidden"))) void do_init_ops(bool was_epoch_initted);
 
+__attribute__((visibility("hidden"))) enum OpCategory op_code_to_category(enum OpData_Tag op_code);
+
 __attribute__((visibility("hidden"))) void op_to_human_readable(char* dest, int size, struct Op* op)
     __attribute__((nonnull));
 
@@ -30,3 +33,6 @@ stat_result_from_statx(struct StatResult* stat_result_buf, struct statx* statx_b
 
 __attribute__((visibility("hidden"))) void copy_rusage(struct Rusage* dst, struct rusage* src)
     __attribute__((nonnull));
+
+/* who is RUSAGE_SELF or RUSAGE_THREAD */
+__attribute__((visibility("hidden"))) struct ResourceSample sample_resources(int who);
@@ -16,6 +16,7 @@ void* pthread_helper(void* restrict uncasted_arg) {
     pthread_return_val->type_id = PTHREAD_RETURN_VAL_TYPE_ID;
     pthread_return_val->pthread_id = pthread_helper_arg->pthread_id;
     pthread_return_val->inner_ret = pthread_helper_arg->start_routine(inner_arg);
+    emit_exit_thread_op();
     free(pthread_helper_arg);
     return pthread_return_val;
 }
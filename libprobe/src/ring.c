@@ -0,0 +1,197 @@
+#include "ring.h"
+
+#include <limits.h>  // IWYU pragma: keep for PATH_MAX
+#include <stdbool.h> // for bool, true, false
+#include <stddef.h>  // for size_t
+#include <stdint.h>  // for uint32_t
+#include <stdlib.h>  // for free, realloc
+#include <threads.h> // for thread_local
+// IWYU pragma: no_include "linux/limits.h" for PATH_MAX
+
+#include "../generated/headers.h" // for Op, ArenaHeader, OpData_Tag, OpCategory
+#include "arena.h"                // for arena_release_older_than, arena_start_new
+#include "debug_logging.h"        // for DEBUG, EXPECT_NONNULL
+#include "env.h"                  // for set_initial_env
+#include "global_state.h"         // for get_op_arena, get_data_arena, arena_budget_exceeded
+#include "prov_utils.h"           // for op_code_to_category
+
+/*
+ * An op's strings are copied into the data arena after the previous op of the same thread was recorded.
+ * So the ops in an op arena only point into data arenas at least as new as the one that was current
+ * when the last op before that op arena was recorded; that is the op arena's data floor.
+ */
+struct RingState {
+    size_t op_instantiation;
+    /* As of the last recorded op */
+    size_t data_instantiation;
+    size_t data_floor;
+    size_t prev_data_floor;
+};
+static thread_local struct RingState ring = {0};
+
+/*
+ * Compacting an op arena copies the strings of its kept ops into data arenas of their own,
+ * which are never released, so the arena need not be compacted again when the data arenas it used to point into are released.
+ * Each run of such data arenas is stored as its first and last instantiation, in increasing order.
+ */
+struct PinnedRun {
+    size_t first;
+    size_t last;
+};
+struct PinnedRuns {
+    struct PinnedRun* _Nullable runs;
+    size_t len;
+    size_t cap;
+    /* Whether the current data arena is (the end of) a run that is still being filled */
+    bool filling;
+    /* Capacity of the data arena in use before the run, to resume at afterwards */
+    size_t resume_capacity;
+};
+static thread_local struct PinnedRuns pinned = {0};
+
+static inline struct ArenaDir* _Nonnull get_pinned_arena() {
+    struct ArenaDir* data_arena = get_data_arena();
+    if (!pinned.filling) {
+        if (pinned.len == pinned.cap) {
+            pinned.cap = pinned.cap ? 2 * pinned.cap : 16;
+            pinned.runs =
+                EXPECT_NONNULL(realloc(pinned.runs, pinned.cap * sizeof(struct PinnedRun)));
+        }
+        pinned.resume_capacity = arena_capacity(data_arena);
+        /* Kept strings are small; the arena grows by itself if they are not */
+        arena_start_new(data_arena, 0);
+        pinned.runs[pinned.len].first = arena_instantiation(data_arena);
+        pinned.filling = true;
+    }
+    return data_arena;
+}
+
+static inline void finish_pinned_run() {
+    if (pinned.filling) {
+        struct ArenaDir* data_arena = get_data_arena();
+        pinned.runs[pinned.len].last = arena_instantiation(data_arena);
+        ++pinned.len;
+        pinned.filling = false;
+        /* So the unpinned data that follows does not land in the run */
+        arena_start_new(data_arena, pinned.resume_capacity);
+    }
+}
+
+static bool is_pinned(size_t instantiation) {
+    size_t lo = 0;
+    size_t hi = pinned.len;
+    while (lo < hi) {
+        size_t mid = lo + (hi - lo) / 2;
+        if (pinned.runs[mid].last < instantiation) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+    return lo < pinned.len && pinned.runs[lo].first <= instantiation;
+}
+
+static inline char const* _Nullable copy_string(char const* _Nullable string) {
+    return string ? arena_strndup(get_pinned_arena(), string, PATH_MAX) : string;
+}
+
+static inline StringArray copy_string_array(StringArray array) {
+    return arena_copy_argv(get_pinned_arena(), array, 0);
+}
+
+static inline void copy_exec_strings(struct Exec* _Nonnull exec) {
+    exec->path.name = copy_string(exec->path.name);
+    exec->argv = copy_string_array(exec->argv);
+    exec->env = copy_string_array(exec->env);
+    exec->env_removed = copy_string_array(exec->env_removed);
+}
+
+/* Copy the strings of a kept op into pinned data arenas, since the data arenas they were in are about to be released */
+static void copy_op_strings(struct Op* _Nonnull op) {
+    switch (op->data.tag) {
+    case OpData_InitExecEpoch:
+        op->data.init_exec_epoch.exe.name = copy_string(op->data.init_exec_epoch.exe.name);
+        op->data.init_exec_epoch.argv = copy_string_array(op->data.init_exec_epoch.argv);
+        op->data.init_exec_epoch.env = copy_string_array(op->data.init_exec_epoch.env);
+        /* Exec ops compute their env delta against this (see env.h) */
+        set_initial_env(op->data.init_exec_epoch.env);
+        break;
+    case OpData_Exec:
+        copy_exec_strings(&op->data.exec);
+        break;
+    case OpData_Spawn:
+        copy_exec_strings(&op->data.spawn.exec);
+        break;
+    default:
+        /* The other process ops hold no pointers */
+        break;
+    }
+}
+
+/* Keep the process ops of an op arena, and merge everything else into one DroppedOps op at the end. */
+static void compact_ops(struct ArenaHeader* _Nonnull arena) {
+    struct Op* ops = (void*)arena->base_address + sizeof(struct ArenaHeader);
+    size_t n_ops = (arena->used - sizeof(struct ArenaHeader)) / sizeof(struct Op);
+    if (n_ops == 0) {
+        return;
+    }
+    struct Op last = ops[n_ops - 1];
+    size_t n_kept = 0;
+    uint32_t n_dropped = 0;
+    for (size_t idx = 0; idx < n_ops; ++idx) {
+        if (ops[idx].data.tag == OpData_DroppedOps) {
+            /* Left by a previous compaction of this arena */
+            n_dropped += ops[idx].data.dropped_ops.n_ops;
+        } else if (op_code_to_category(ops[idx].data.tag) == OpCategory_Process) {
+            copy_op_strings(&ops[idx]);
+            ops[n_kept] = ops[idx];
+            ++n_kept;
+        } else {
+            ++n_dropped;
+        }
+    }
+    if (n_dropped != 0) {
+        /* At least one op was removed, so there is room for this one */
+        ops[n_kept] = (struct Op){
+            .data = {.dropped_ops_tag = OpData_DroppedOps, .dropped_ops = {.n_ops = n_dropped}},
+            .pthread_id = last.pthread_id,
+            .iso_c_thread_id = last.iso_c_thread_id,
+            .ferrno = 0,
+        };
+        ++n_kept;
+    }
+    arena->used = sizeof(struct ArenaHeader) + n_kept * sizeof(struct Op);
+}
+
+/* Release all of a data arena but the header, unless it holds the strings of compacted ops */
+static void compact_data(struct ArenaHeader* _Nonnull arena) {
+    if (!is_pinned(arena->instantiation)) {
+        arena->used = sizeof(struct ArenaHeader);
+    }
+}
+
+void ring_after_record() {
+    size_t op_instantiation = arena_instantiation(get_op_arena());
+    if (op_instantiation != ring.op_instantiation) {
+        /* The op just recorded started a new op arena */
+        ring.op_instantiation = op_instantiation;
+        ring.prev_data_floor = ring.data_floor;
+        ring.data_floor = ring.data_instantiation;
+        if (arena_budget_exceeded()) {
+            DEBUG("Over the arena budget; discarding ops before op arena %ld and data before data "
+                  "arena %ld",
+                  op_instantiation - 1, ring.prev_data_floor);
+            /* The op arenas first, since compacting them copies strings into pinned data arenas */
+            arena_release_older_than(get_op_arena(), op_instantiation - 1, compact_ops);
+            finish_pinned_run();
+            arena_release_older_than(get_data_arena(), ring.prev_data_floor, compact_data);
+        }
+    }
+    ring.data_instantiation = arena_instantiation(get_data_arena());
+}
+
+void ring_reset_after_fork() {
+    ring = (struct RingState){0};
+    free(pinned.runs);
+    pinned = (struct PinnedRuns){0};
+}
@@ -0,0 +1,18 @@
+#pragma once
+
+#define _GNU_SOURCE
+
+/*
+ * When the recording is bounded (ProcessTreeContext.arena_budget), each thread's op arenas form a ring.
+ * If a thread fills its op arena while the arenas of all processes together exceed the budget,
+ * it discards the ops of all but its two newest op arenas, and the data arenas that only those ops pointed into.
+ * Process ops (see op_code_to_category) are kept, so the happens-before graph stays intact;
+ * their strings are copied once into data arenas which are never released,
+ * and a DroppedOps op stands in for the rest of each discarded op arena.
+ */
+
+/* Call after each op is written to this thread's op arena */
+__attribute__((visibility("hidden"))) void ring_after_record();
+
+/* The child of a fork starts with fresh arenas */
+__attribute__((visibility("hidden"))) void ring_reset_after_fork();
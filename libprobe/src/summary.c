@@ -0,0 +1,170 @@
+#include "summary.h"
+
+#include <fcntl.h>   // for O_ACCMODE, O_RDONLY, O_WRONLY, O_TRUNC
+#include <pthread.h> // for pthread_mutex_t, pthread_mutex_lock
+#include <stdbool.h> // for bool, true, false
+#include <stddef.h>  // for size_t, NULL
+#include <stdint.h>  // for uint64_t
+#include <stdlib.h>  // for calloc
+#include <time.h>    // for clock_gettime, CLOCK_REALTIME
+// IWYU pragma: no_include "bits/pthreadtypes.h"  for pthread_mutex_t
+// IWYU pragma: no_include "bits/time.h"          for CLOCK_REALTIME
+
+#include "../generated/headers.h" // for Op, AccessSummary, Inode, StatxTimestamp
+#include "debug_logging.h"        // for DEBUG, EXPECT, EXPECT_NONNULL
+#include "global_state.h"         // for get_summary_interval
+#include "probe_libc.h"           // for probe_libc_memset
+#include "prov_buffer.h"          // for prov_log_record
+#include "util.h"                 // for UNLIKELY
+
+/* Must be a power of 2 */
+#define SUMMARY_TABLE_SIZE 4096
+/* Open addressing degrades quickly past this load, so we flush instead of probing further. */
+#define SUMMARY_TABLE_MAX_LOAD (SUMMARY_TABLE_SIZE / 4 * 3)
+
+struct SummaryEntry {
+    bool used;
+    struct AccessSummary summary;
+};
+
+/* Threads of the same process share one table */
+static pthread_mutex_t summary_lock = PTHREAD_MUTEX_INITIALIZER;
+/* Allocated on the first absorbed op, so it costs nothing outside of summary mode. */
+static struct SummaryEntry* summary_table = NULL;
+static size_t summary_table_count = 0;
+static time_t summary_last_flush = 0;
+
+static inline uint64_t inode_hash(const struct Inode* inode) {
+    uint64_t hash = (((uint64_t)inode->device_major) << 32) | inode->device_minor;
+    hash ^= inode->number + 0x9E3779B97F4A7C15ULL + (hash << 6) + (hash >> 2);
+    return hash * 0x9E3779B97F4A7C15ULL;
+}
+
+static inline bool same_inode(const struct Inode* a, const struct Inode* b) {
+    return a->number == b->number && a->device_major == b->device_major &&
+           a->device_minor == b->device_minor;
+}
+
+static inline struct StatxTimestamp now() {
+    struct timespec ts;
+    EXPECT(== 0, clock_gettime(CLOCK_REALTIME, &ts));
+    return (struct StatxTimestamp){.tv_sec = ts.tv_sec, .tv_nsec = ts.tv_nsec};
+}
+
+/* Caller must hold summary_lock */
+static void summary_flush_locked(time_t time) {
+    DEBUG("Flushing %zu access summaries", summary_table_count);
+    for (size_t idx = 0; summary_table_count > 0 && idx < SUMMARY_TABLE_SIZE; ++idx) {
+        if (summary_table[idx].used) {
+            prov_log_record((struct Op){
+                .data =
+                    {
+                        .access_summary_tag = OpData_AccessSummary,
+                        .access_summary = summary_table[idx].summary,
+                    },
+                .ferrno = 0,
+            });
+            summary_table[idx].used = false;
+            summary_table_count--;
+        }
+    }
+    summary_last_flush = time;
+}
+
+/* Caller must hold summary_lock */
+static struct AccessSummary* _Nonnull summary_lookup(const struct Inode* inode,
+                                                     struct StatxTimestamp time) {
+    if (UNLIKELY(!summary_table)) {
+        summary_table = EXPECT_NONNULL(calloc(SUMMARY_TABLE_SIZE, sizeof(struct SummaryEntry)));
+        summary_last_flush = time.tv_sec;
+    }
+    size_t slot = inode_hash(inode) & (SUMMARY_TABLE_SIZE - 1);
+    while (summary_table[slot].used) {
+        if (same_inode(&summary_table[slot].summary.inode, inode)) {
+            return &summary_table[slot].summary;
+        }
+        slot = (slot + 1) & (SUMMARY_TABLE_SIZE - 1);
+    }
+    if (summary_table_count >= SUMMARY_TABLE_MAX_LOAD) {
+        summary_flush_locked(time.tv_sec);
+        slot = inode_hash(inode) & (SUMMARY_TABLE_SIZE - 1);
+    }
+    summary_table[slot].used = true;
+    summary_table_count++;
+    summary_table[slot].summary = (struct AccessSummary){
+        .inode = *inode,
+        .first_access = time,
+    };
+    return &summary_table[slot].summary;
+}
+
+bool summary_absorb(const struct Op* op) {
+    struct Inode inode;
+    switch (op->data.tag) {
+    case OpData_Open:
+        inode = op->data.open.inode;
+        break;
+    case OpData_Stat:
+        inode = (struct Inode){
+            .device_major = op->data.stat.stat_result.dev_major,
+            .device_minor = op->data.stat.stat_result.dev_minor,
+            .number = op->data.stat.stat_result.ino,
+            .mode = op->data.stat.stat_result.mode,
+            .mtime = op->data.stat.stat_result.mtime,
+            .ctime = op->data.stat.stat_result.ctime,
+            .size = op->data.stat.stat_result.size,
+        };
+        break;
+    default:
+        return false;
+    }
+    if (op->ferrno != 0) {
+        /* Failed accesses have no inode to attribute them to */
+        return true;
+    }
+
+    struct StatxTimestamp time = now();
+    EXPECT(== 0, pthread_mutex_lock(&summary_lock));
+    struct AccessSummary* summary = summary_lookup(&inode, time);
+    summary->inode = inode;
+    summary->last_access = time;
+    if (op->data.tag == OpData_Open) {
+        int flags = op->data.open.flags;
+        if ((flags & O_ACCMODE) != O_WRONLY) {
+            summary->n_reads++;
+        }
+        if ((flags & O_ACCMODE) != O_RDONLY) {
+            summary->n_writes++;
+        }
+        if (flags & O_TRUNC) {
+            summary->n_truncates++;
+        }
+        summary->open_flags |= flags;
+    } else {
+        summary->n_stats++;
+    }
+    uint32_t interval = get_summary_interval();
+    if (interval != 0 && time.tv_sec - summary_last_flush >= interval) {
+        summary_flush_locked(time.tv_sec);
+    }
+    EXPECT(== 0, pthread_mutex_unlock(&summary_lock));
+    return true;
+}
+
+void summary_flush() {
+    if (!summary_table) {
+        return;
+    }
+    EXPECT(== 0, pthread_mutex_lock(&summary_lock));
+    summary_flush_locked(now().tv_sec);
+    EXPECT(== 0, pthread_mutex_unlock(&summary_lock));
+}
+
+void summary_reset_after_fork() {
+    /* Another thread of the parent may have held the lock at the time of the fork. */
+    EXPECT(== 0, pthread_mutex_init(&summary_lock, NULL));
+    if (summary_table) {
+        probe_libc_memset(summary_table, 0, SUMMARY_TABLE_SIZE * sizeof(struct SummaryEntry));
+    }
+    summary_table_count = 0;
+}
@@ -0,0 +1,24 @@
+#pragma once
+
+#define _GNU_SOURCE
+
+#include <stdbool.h> // for bool
+
+struct Op;
+
+/*
+ * In summary mode (ProcessTreeContext.summary), Open and Stat ops are not written to the op arena.
+ * Instead, they are aggregated into a per-process table of AccessSummary, keyed by inode.
+ * The table is flushed as AccessSummary ops before exec, at exit, when it fills up, and every summary_interval seconds.
+ * Disk usage is then bounded by the number of distinct inodes a process touches between flushes, rather than by the number of ops.
+ */
+
+/* Returns true if the op was absorbed into the summary table, in which case it should not be recorded. */
+__attribute__((visibility("hidden"))) bool summary_absorb(const struct Op* _Nonnull op);
+
+/* Emit an AccessSummary op for every inode in the table and clear it.
+ * Does nothing if nothing was absorbed (e.g., not in summary mode). */
+__attribute__((visibility("hidden"))) void summary_flush();
+
+/* The child of a fork starts with an empty table; the parent's accesses are the parent's to flush. */
+__attribute__((visibility("hidden"))) void summary_reset_after_fork();
@@ -1,6 +1,13 @@
+from __future__ import annotations
 import collections
-from .ptypes import ProbeLog, HbGraph, OpQuad
-from .headers import Clone, Wait
+import functools
+import os
+import typing
+import msgspec
+import networkx
+import numpy
+from .ptypes import ProbeLog, HbGraph, OpQuad, ExecPair, Pid, ResourceUsage
+from .headers import Clone, Wait, Spawn, InitExecEpoch, TaskType
 
 
 def get_max_parallelism_latest(hb_graph: HbGraph, probe_log: ProbeLog) -> int:
@@ -40,3 +47,175 @@ def get_max_parallelism_latest(hb_graph: HbGraph, probe_log: ProbeLog) -> int:
             queue.append((neighbor, node))
 
     return max_counter
+
+
+class ParallelismStep(msgspec.Struct, frozen=True):
+    # Seconds since the first exec epoch started
+    time: float
+    # Exec epochs running from here until the next step
+    n_running: int
+
+
+class CriticalPathStep(msgspec.Struct, frozen=True):
+    pid: int
+    exec_no: int
+    name: str
+    cpu_time: float
+
+
+class PerfProfile(msgspec.Struct, frozen=True):
+    """How parallel a recorded run was, and how parallel it could be.
+
+    Times are in seconds.
+    Work is the total CPU time of every exec epoch.
+    The critical path is the path through the happens-before graph with the most CPU time; no schedule can finish before it.
+    So work / critical_path_cpu_time bounds the speedup on any number of CPUs.
+    """
+    makespan: float
+    work: float
+    critical_path_cpu_time: float
+    critical_path: list[CriticalPathStep]
+    parallelism: list[ParallelismStep]
+    max_parallelism: int
+    # work / makespan
+    average_parallelism: float
+    # CPUs -> Amdahl's bound on the speedup, taking the critical path as the serial fraction of the work
+    speedup_bounds: dict[int, float]
+
+
+def _seconds(delta: numpy.timedelta64) -> float:
+    return float(delta / numpy.timedelta64(1, "s"))
+
+
+def exec_name(probe_log: ProbeLog, exec_pair: ExecPair) -> str:
+    """The basename of argv[0] of an exec epoch, for labeling it."""
+    for thread in probe_log.processes[exec_pair.pid].execs[exec_pair.exec_no].threads.values():
+        for op in thread.ops:
+            if isinstance(op.data, InitExecEpoch):
+                arg0 = op.data.argv[0] if op.data.argv else (op.data.exe.name or b"")
+                return os.path.basename(arg0.decode(errors="backslashreplace"))
+    return "?"
+
+
+def _last_ops(probe_log: ProbeLog) -> typing.Mapping[OpQuad, ExecPair]:
+    """The op which ends each exec epoch, which is the last op of its main thread (or, lacking that, of any thread)."""
+    last_ops = {}
+    for pid, process in probe_log.processes.items():
+        for exec_no, exec in process.execs.items():
+            tid = pid.main_thread() if pid.main_thread() in exec.threads else max(exec.threads)
+            last_ops[OpQuad(pid, exec_no, tid, len(exec.threads[tid].ops) - 1)] = ExecPair(pid, exec_no)
+    return last_ops
+
+
+def critical_path(
+        hb_graph: HbGraph,
+        probe_log: ProbeLog,
+        usage: typing.Mapping[ExecPair, ResourceUsage],
+) -> tuple[float, list[ExecPair]]:
+    """The path through hb_graph with the most CPU time, and its exec epochs.
+
+    Each exec epoch's CPU time is counted at its last op, so a path counts an epoch if it passes through the epoch's end.
+    Epochs whose usage was not recorded count as 0.
+    """
+    last_ops = _last_ops(probe_log)
+    weights = {
+        node: _seconds(usage[exec_pair].cpu_time)
+        for node, exec_pair in last_ops.items()
+        if exec_pair in usage
+    }
+    # Longest path in a DAG: the heaviest path ending at each node, in topological order
+    heaviest = dict[OpQuad, float]()
+    predecessor = dict[OpQuad, OpQuad]()
+    for node in networkx.topological_sort(hb_graph):
+        best = max(hb_graph.predecessors(node), key=lambda pred: heaviest[pred], default=None)
+        heaviest[node] = (heaviest[best] if best is not None else 0.0) + weights.get(node, 0.0)
+        if best is not None:
+            predecessor[node] = best
+    if not heaviest:
+        return 0.0, []
+    end = max(heaviest, key=lambda node: heaviest[node])
+    path = [end]
+    while path[-1] in predecessor:
+        path.append(predecessor[path[-1]])
+    return heaviest[end], [last_ops[node] for node in reversed(path) if node in last_ops]
+
+
+def parallelism_profile(usage: typing.Mapping[ExecPair, ResourceUsage]) -> list[ParallelismStep]:
+    """How many exec epochs were running over time.
+
+    An epoch counts as running from its start to its end, even while it waits on a child.
+    """
+    if not usage:
+        return []
+    origin = min(exec_usage.start for exec_usage in usage.values())
+    deltas = collections.Counter[numpy.datetime64]()
+    for exec_usage in usage.values():
+        deltas[exec_usage.start] += 1
+        deltas[exec_usage.stop] -= 1
+    steps = []
+    n_running = 0
+    for time in sorted(deltas):
+        n_running += deltas[time]
+        steps.append(ParallelismStep(_seconds(time - origin), n_running))
+    return steps
+
+
+def perf_profile(hb_graph: HbGraph, probe_log: ProbeLog, max_cpus: int = 64) -> PerfProfile:
+    usage = probe_log.exec_resource_usage()
+    work = sum(_seconds(exec_usage.cpu_time) for exec_usage in usage.values())
+    makespan = (
+        _seconds(max(exec_usage.stop for exec_usage in usage.values()) - min(exec_usage.start for exec_usage in usage.values()))
+        if usage else 0.0
+    )
+    critical_path_cpu_time, path = critical_path(hb_graph, probe_log, usage)
+    profile = parallelism_profile(usage)
+    serial_fraction = critical_path_cpu_time / work if work else 1.0
+    return PerfProfile(
+        makespan=makespan,
+        work=work,
+        critical_path_cpu_time=critical_path_cpu_time,
+        critical_path=[
+            CriticalPathStep(
+                int(exec_pair.pid),
+                int(exec_pair.exec_no),
+                exec_name(probe_log, exec_pair),
+                _seconds(usage[exec_pair].cpu_time) if exec_pair in usage else 0.0,
+            )
+            for exec_pair in path
+        ],
+        parallelism=profile,
+        max_parallelism=max((step.n_running for step in profile), default=0),
+        average_parallelism=work / makespan if makespan else 0.0,
+        speedup_bounds={
+            cpus: 1 / (serial_fraction + (1 - serial_fraction) / cpus)
+            for cpus in (2 ** exponent for exponent in range(max_cpus.bit_length()))
+        },
+    )
+
+
+def folded_stacks(probe_log: ProbeLog) -> typing.Iterator[str]:
+    """The CPU time of each exec epoch, under the epochs that started its process, in the "folded stacks" format of flamegraph.pl and speedscope.
+
+    Each line is "root;...;parent;epoch microseconds", where microseconds are the epoch's own CPU time, without its children's.
+    """
+    usage = probe_log.exec_resource_usage()
+    parents = dict[Pid, ExecPair]()
+    for quad, op in probe_log.ops():
+        match op.data:
+            case Clone():
+                if op.ferrno == 0 and op.data.task_type == TaskType.PID:
+                    parents[Pid(op.data.task_id)] = quad.exec_pair()
+            case Spawn():
+                if op.ferrno == 0:
+                    parents[Pid(op.data.child_pid)] = quad.exec_pair()
+
+    @functools.cache
+    def stack(exec_pair: ExecPair) -> str:
+        name = exec_name(probe_log, exec_pair).replace(";", ":")
+        parent = parents.get(exec_pair.pid)
+        return f"{stack(parent)};{name}" if parent is not None else name
+
+    for exec_pair, exec_usage in sorted(usage.items()):
+        microseconds = exec_usage.cpu_time // numpy.timedelta64(1, "us")
+        if microseconds > 0:
+            yield f"{stack(exec_pair)} {microseconds}"
@@ -0,0 +1,47 @@
+"""The references a PROBE log checked in to a blob_store.BlobStore holds in place of its copied files.
+
+parser resolves these without importing blob_store, which itself reads PROBE logs through parser.
+"""
+
+from __future__ import annotations
+import pathlib
+import typing
+import msgspec
+from .ptypes import InodeVersion
+
+
+BLOB_REFS_FILE = "blob_refs.json"
+
+
+class BlobRefs(msgspec.Struct, frozen=True):
+    """The contents of BLOB_REFS_FILE in a checked-in PROBE log."""
+
+    store: str
+    recording: str
+    # inode version ID string (see InodeVersion.from_id_string) -> SHA-256 hex digest
+    digests: dict[str, str]
+
+
+def blob_path(store: pathlib.Path, digest: str) -> pathlib.Path:
+    return store / "objects" / digest[:2] / digest
+
+
+class ResolvedBlobRefs(typing.Mapping[InodeVersion, pathlib.Path]):
+    """The copied files of a checked-in PROBE log, which are looked up in the store only when accessed."""
+
+    def __init__(self, refs: BlobRefs, store: pathlib.Path | None = None) -> None:
+        self.refs = refs
+        self.store = (store if store is not None else pathlib.Path(refs.store)).resolve()
+        self._id_strings = {
+            InodeVersion.from_id_string(id_string): id_string
+            for id_string in refs.digests
+        }
+
+    def __getitem__(self, inode_version: InodeVersion) -> pathlib.Path:
+        return blob_path(self.store, self.refs.digests[self._id_strings[inode_version]])
+
+    def __iter__(self) -> typing.Iterator[InodeVersion]:
+        return iter(self._id_strings)
+
+    def __len__(self) -> int:
+        return len(self._id_strings)
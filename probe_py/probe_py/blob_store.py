@@ -0,0 +1,200 @@
+"""A shared, content-addressed store for the files copied into PROBE logs.
+
+With `probe record --copy-files`, every PROBE log carries its own copy of each file the command read (under `inodes/`).
+Recording the same toolchain over and over duplicates the same blobs in every log.
+
+Checking a PROBE log into a BlobStore moves its `inodes/` into the store, keyed by the SHA-256 of their contents, and leaves a BLOB_REFS_FILE (see blob_refs) in their place.
+parse_probe_log_ctx resolves those references in the store when they are looked up, rather than extracting anything.
+
+Each checked-in log holds one reference per blob it refers to; release() drops a log's references, and gc() deletes the blobs nobody refers to.
+The reference counts live in an SQLite database next to the blobs, so concurrent check-ins and GCs are serialized.
+"""
+
+from __future__ import annotations
+import contextlib
+import hashlib
+import io
+import os
+import pathlib
+import sqlite3
+import tarfile
+import tempfile
+import time
+import typing
+import uuid
+import msgspec
+from . import blob_refs
+from . import parser
+from .blob_refs import BLOB_REFS_FILE, BlobRefs
+from .persistent_provenance import PROBE_HOME
+
+
+DEFAULT_STORE = PROBE_HOME / "blobs"
+
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+# How long to wait for another check-in or GC to release the database
+_LOCK_TIMEOUT = 600.0
+
+
+# Check-ins write blobs to tmp/ before taking the database, so only old files there are abandoned
+_STALE_TMP_AGE = 24 * 60 * 60
+
+
+class BlobStore:
+    def __init__(self, root: pathlib.Path = DEFAULT_STORE) -> None:
+        self.root = root.resolve()
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        (self.root / "tmp").mkdir(exist_ok=True)
+        with self._transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS refs (
+                    recording TEXT NOT NULL,
+                    inode_version TEXT NOT NULL,
+                    digest TEXT NOT NULL REFERENCES blobs (digest),
+                    PRIMARY KEY (recording, inode_version)
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS refs_by_digest ON refs (digest)")
+
+    @contextlib.contextmanager
+    def _transaction(self) -> typing.Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.root / "refs.sqlite", timeout=_LOCK_TIMEOUT, isolation_level=None)
+        try:
+            # IMMEDIATE, so that a GC can't slip in between reading and writing
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            else:
+                db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def blob_path(self, digest: str) -> pathlib.Path:
+        return blob_refs.blob_path(self.root, digest)
+
+    def ref_count(self, digest: str) -> int:
+        with self._transaction() as db:
+            (count,) = db.execute("SELECT COUNT(*) FROM refs WHERE digest = ?", (digest,)).fetchone()
+        return typing.cast(int, count)
+
+    def _put(self, recording: str, inode_version: str, contents: typing.IO[bytes]) -> str:
+        """Add a reference from recording to contents, storing contents unless an identical blob is already stored."""
+        hasher = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.root / "tmp", delete=False) as tmp:
+            while chunk := contents.read(1 << 20):
+                hasher.update(chunk)
+                tmp.write(chunk)
+            size = tmp.tell()
+        digest = hasher.hexdigest()
+        try:
+            with self._transaction() as db:
+                db.execute("INSERT OR IGNORE INTO blobs (digest, size) VALUES (?, ?)", (digest, size))
+                db.execute(
+                    "INSERT OR REPLACE INTO refs (recording, inode_version, digest) VALUES (?, ?, ?)",
+                    (recording, inode_version, digest),
+                )
+                blob_path = self.blob_path(digest)
+                if not blob_path.exists():
+                    blob_path.parent.mkdir(exist_ok=True)
+                    os.chmod(tmp.name, 0o444)
+                    os.replace(tmp.name, blob_path)
+        finally:
+            pathlib.Path(tmp.name).unlink(missing_ok=True)
+        return digest
+
+    def check_in(self, probe_log: pathlib.Path) -> BlobRefs:
+        """Move the copied files of probe_log into the store, rewriting probe_log to refer to them.
+
+        probe_log keeps its compression.
+        """
+        recording = uuid.uuid4().hex
+        digests = dict[str, str]()
+        tmp_probe_log = probe_log.with_name(f".{probe_log.name}.{recording}")
+        try:
+            with parser.open_probe_log(probe_log) as src, _create_like(probe_log, tmp_probe_log) as dst:
+                for member in src:
+                    path = pathlib.PurePosixPath(member.name)
+                    if path.name == BLOB_REFS_FILE and len(path.parts) == 1:
+                        raise ValueError(f"{probe_log} is already checked in to a blob store")
+                    elif member.isfile() and path.parent == pathlib.PurePosixPath("inodes"):
+                        contents = src.extractfile(member)
+                        assert contents is not None
+                        digests[path.name] = self._put(recording, path.name, contents)
+                    elif path != pathlib.PurePosixPath("inodes"):
+                        dst.addfile(member, src.extractfile(member) if member.isfile() else None)
+                refs = BlobRefs(str(self.root), recording, digests)
+                refs_bytes = msgspec.json.encode(refs)
+                refs_member = tarfile.TarInfo(BLOB_REFS_FILE)
+                refs_member.size = len(refs_bytes)
+                refs_member.mode = 0o644
+                dst.addfile(refs_member, io.BytesIO(refs_bytes))
+            tmp_probe_log.replace(probe_log)
+        except BaseException:
+            tmp_probe_log.unlink(missing_ok=True)
+            self._release(recording)
+            raise
+        return refs
+
+    def release(self, refs: BlobRefs) -> None:
+        """Drop the references of a checked-in PROBE log, e.g., before deleting it."""
+        if pathlib.Path(refs.store).resolve() != self.root:
+            raise ValueError(f"Recording {refs.recording} was checked in to {refs.store}, not {self.root}")
+        self._release(refs.recording)
+
+    def _release(self, recording: str) -> None:
+        with self._transaction() as db:
+            db.execute("DELETE FROM refs WHERE recording = ?", (recording,))
+
+    def gc(self) -> tuple[int, int]:
+        """Delete the blobs which no recording refers to; returns how many, and their total size."""
+        with self._transaction() as db:
+            garbage = db.execute(
+                "SELECT digest, size FROM blobs WHERE NOT EXISTS (SELECT 1 FROM refs WHERE refs.digest = blobs.digest)"
+            ).fetchall()
+            db.execute("DELETE FROM blobs WHERE NOT EXISTS (SELECT 1 FROM refs WHERE refs.digest = blobs.digest)")
+            # While still holding the database, so no check-in can reference these blobs again meanwhile
+            for digest, _ in garbage:
+                self.blob_path(digest).unlink(missing_ok=True)
+        # Leftovers of check-ins which were killed before they could clean up
+        for tmp in (self.root / "tmp").iterdir():
+            if time.time() - tmp.stat().st_mtime > _STALE_TMP_AGE:
+                tmp.unlink(missing_ok=True)
+        return len(garbage), sum(size for _, size in garbage)
+
+
+def read_blob_refs(probe_log: pathlib.Path) -> BlobRefs | None:
+    """The BlobRefs of probe_log, or None if it has not been checked in."""
+    with parser.open_probe_log(probe_log) as tar:
+        for member in tar:
+            if member.name == BLOB_REFS_FILE:
+                contents = tar.extractfile(member)
+                assert contents is not None
+                return msgspec.json.decode(contents.read(), type=BlobRefs)
+    return None
+
+
+@contextlib.contextmanager
+def _create_like(probe_log: pathlib.Path, path: pathlib.Path) -> typing.Iterator[tarfile.TarFile]:
+    """Create a tar archive at path, compressed like probe_log."""
+    with probe_log.open("rb") as src:
+        magic = src.read(len(parser.ZSTD_MAGIC))
+    if magic == parser.ZSTD_MAGIC:
+        import zstandard
+        with path.open("wb") as dst, \
+             zstandard.ZstdCompressor(threads=-1).stream_writer(dst) as writer, \
+             tarfile.open(fileobj=writer, mode="w|") as tar:
+            yield tar
+    elif magic.startswith(_GZIP_MAGIC):
+        with tarfile.open(path, mode="w:gz") as tar:
+            yield tar
+    else:
+        with tarfile.open(path, mode="w") as tar:
+            yield tar
+
@@ -0,0 +1,87 @@
+"""A Bloom filter: a compact set of byte strings which may report false positives, but never false negatives.
+
+See persistent_provenance.get_writers, which keeps one in front of the persistent provenance database.
+"""
+
+from __future__ import annotations
+import hashlib
+import math
+import os
+import pathlib
+import struct
+import tempfile
+import typing
+import numpy
+import numpy.typing
+
+
+_MAGIC = b"PROBEBF1"
+
+
+# magic, capacity, number of hashes, number of items added
+_HEADER = struct.Struct("<8sQQQ")
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, bits_per_item: int = 10) -> None:
+        """A filter which keeps its false-positive rate (about 1% at 10 bits per item) for up to capacity items."""
+        self.capacity = capacity
+        self.n_hashes = max(1, round(bits_per_item * math.log(2)))
+        self.bits = numpy.zeros(max(1, capacity * bits_per_item // 8), dtype=numpy.uint8)
+        self.count = 0
+
+    @property
+    def n_bits(self) -> int:
+        return len(self.bits) * 8
+
+    def _positions(self, items: typing.Sequence[bytes]) -> numpy.typing.NDArray[numpy.uint64]:
+        """The bit positions of each item, one row per item.
+
+        Rather than computing n_hashes hashes, each item is hashed once into two halves h1 and h2, which are combined as h1 + i * h2.
+        This keeps the false-positive rate of independent hashes (Kirsch and Mitzenmacher, "Less Hashing, Same Performance").
+        """
+        digests = numpy.frombuffer(
+            b"".join(hashlib.blake2b(item, digest_size=16).digest() for item in items),
+            dtype="<u8",
+        ).reshape(len(items), 2)
+        # h2 is odd, so its multiples don't collapse onto a few positions
+        h1, h2 = digests[:, :1], digests[:, 1:] | numpy.uint64(1)
+        return (h1 + numpy.arange(self.n_hashes, dtype=numpy.uint64) * h2) % numpy.uint64(self.n_bits)
+
+    def add(self, items: typing.Sequence[bytes]) -> None:
+        if items:
+            positions = self._positions(items).ravel()
+            numpy.bitwise_or.at(self.bits, positions >> 3, numpy.left_shift(1, positions & 7).astype(numpy.uint8))
+            self.count += len(items)
+
+    def might_contain(self, items: typing.Sequence[bytes]) -> numpy.typing.NDArray[numpy.bool_]:
+        """Whether each item may have been added; False is certain."""
+        if not items:
+            return numpy.zeros(0, dtype=numpy.bool_)
+        positions = self._positions(items)
+        return typing.cast(
+            numpy.typing.NDArray[numpy.bool_],
+            ((self.bits[positions >> 3] >> (positions & 7).astype(numpy.uint8)) & 1).all(axis=1),
+        )
+
+    def save(self, path: pathlib.Path) -> None:
+        """Write the filter to path atomically, so readers see either the old or the new filter."""
+        with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", delete=False) as tmp:
+            tmp.write(_HEADER.pack(_MAGIC, self.capacity, self.n_hashes, self.count))
+            tmp.write(self.bits.tobytes())
+        os.replace(tmp.name, path)
+
+    @staticmethod
+    def load(path: pathlib.Path) -> BloomFilter:
+        data = path.read_bytes()
+        if len(data) < _HEADER.size:
+            raise ValueError(f"{path} is truncated")
+        magic, capacity, n_hashes, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a PROBE Bloom filter")
+        bloom_filter = BloomFilter.__new__(BloomFilter)
+        bloom_filter.capacity = capacity
+        bloom_filter.n_hashes = n_hashes
+        bloom_filter.bits = numpy.frombuffer(data, dtype=numpy.uint8, offset=_HEADER.size).copy()
+        bloom_filter.count = count
+        return bloom_filter
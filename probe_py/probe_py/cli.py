@@ -1,5 +1,6 @@
 from typing_extensions import Annotated
 import dataclasses
+import datetime
 import enum
 import json
 import os
@@ -9,26 +10,29 @@ import subprocess
 import sys
 import tempfile
 import textwrap
+import time
 import warnings
 import charmonium.time_block
 import msgspec
 import rich.console
 import rich.pretty
-import sqlalchemy.orm
 import tqdm
 import typer
+from . import analysis
+from . import blob_store
 from . import dataflow_graph as dataflow_graph_module
 from . import file_closure
 from . import graph_utils
 from . import hb_graph as hb_graph_module
+from . import hb_graph_accesses
 from . import headers as ops
 from . import parser
+from . import persistent_provenance
 from . import ptypes
 from . import scp as scp_module
 from . import ssh_argparser
 from . import util
 from . import validators
-from .persistent_provenance_db import get_engine
 
 
 console = rich.console.Console(stderr=True)
@@ -38,6 +42,8 @@ project_root = pathlib.Path(__file__).resolve().parent.parent.parent.parent
 app = typer.Typer(pretty_exceptions_show_locals=False)
 export_app = typer.Typer()
 app.add_typer(export_app, name="export")
+blobs_app = typer.Typer(help="Share copied files between PROBE logs in a content-addressed store.")
+app.add_typer(blobs_app, name="blobs")
 
 strict_option = typer.Option(
     "--strict/--loose",
@@ -65,6 +71,16 @@ def restore_sanity(strict: bool, debug: bool) -> None:
         ipdb.set_trace()
 
 
+def require_file_descriptors(probe_log: ptypes.ProbeLog) -> None:
+    if not probe_log.records_file_descriptors():
+        console.print(
+            "This probe log was recorded with --summary or without --ops=file-io, so it lacks the ops which open files; "
+            "re-record it without those options",
+            style="red",
+        )
+        raise typer.Exit(code=1)
+
+
 probe_log_help = typer.Option(
     "--probe-log",
     "-f",
@@ -72,6 +88,12 @@ probe_log_help = typer.Option(
 )
 
 
+blob_store_option = typer.Option(
+    "--store",
+    help="Directory of the blob store.",
+)
+
+
 @app.command()
 @charmonium.time_block.decor(print_start=False)
 def validate(
@@ -193,6 +215,7 @@ def dataflow_graph(
     """
     restore_sanity(strict, debug)
     probe_log_obj = parser.parse_probe_log(probe_log)
+    require_file_descriptors(probe_log_obj)
     hbg = hb_graph_module.probe_log_to_hb_graph(probe_log_obj)
     hb_graph_module.label_nodes(probe_log_obj, hbg)
     dfg, inode_to_paths = dataflow_graph_module.hb_graph_to_dataflow_graph2(probe_log_obj, hbg)
@@ -201,80 +224,145 @@ def dataflow_graph(
     graph_utils.serialize_graph(compressed_dfg, output)
 
 
+@export_app.command()
+@charmonium.time_block.decor(print_start=False)
+def accesses(
+        output: Annotated[
+            pathlib.Path,
+            typer.Argument(help="Directory in which to write accesses.parquet, inodes.parquet, and paths.parquet"),
+        ] = pathlib.Path("accesses"),
+        probe_log: Annotated[
+            pathlib.Path,
+            probe_log_help,
+        ] = pathlib.Path("probe_log"),
+        batch_size: Annotated[
+            int,
+            typer.Option(help="Number of accesses per Parquet row group"),
+        ] = 1 << 16,
+        strict: Annotated[bool, strict_option] = True,
+        debug: Annotated[bool, debug_option] = False,
+) -> None:
+    """
+    Write the file accesses in one possible schedule of probe_log as Parquet.
+
+    Inodes and paths are interned; accesses.parquet refers to rows of inodes.parquet and paths.parquet by inode_id and path_id.
+    """
+    # pyarrow ships no type hints
+    import pyarrow  # type: ignore[import-untyped]
+    import pyarrow.parquet  # type: ignore[import-untyped]
+    restore_sanity(strict, debug)
+    probe_log_obj = parser.parse_probe_log(probe_log)
+    require_file_descriptors(probe_log_obj)
+    hbg = hb_graph_module.probe_log_to_hb_graph(probe_log_obj)
+    output.mkdir(exist_ok=True, parents=True)
+    tables = hb_graph_accesses.AccessTables()
+    schema = pyarrow.schema([
+        (name, pyarrow.from_numpy_dtype(hb_graph_accesses.ACCESS_DTYPE[name]))
+        for name in hb_graph_accesses.ACCESS_DTYPE.names or ()
+    ])
+    n_accesses = 0
+    with pyarrow.parquet.ParquetWriter(output / "accesses.parquet", schema) as writer:
+        for batch in hb_graph_accesses.hb_graph_to_access_batches(probe_log_obj, hbg, tables, batch_size):
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(batch[name]) for name in schema.names],
+                schema=schema,
+            ))
+            n_accesses += len(batch)
+    pyarrow.parquet.write_table(
+        pyarrow.table({
+            "inode_id": range(len(tables.inodes)),
+            "host": [inode.host.name for inode in tables.inodes],
+            "device_major": [inode.device.major_id for inode in tables.inodes],
+            "device_minor": [inode.device.minor_id for inode in tables.inodes],
+            "number": [inode.number for inode in tables.inodes],
+            "mode": [inode.mode for inode in tables.inodes],
+        }),
+        output / "inodes.parquet",
+    )
+    pyarrow.parquet.write_table(
+        pyarrow.table({
+            "path_id": range(len(tables.paths)),
+            "path": [str(path) for path in tables.paths],
+        }),
+        output / "paths.parquet",
+    )
+    console.print(f"Wrote {n_accesses} accesses, {len(tables.inodes)} inodes, {len(tables.paths)} paths to {output}")
+
+
+class ProfileFormat(enum.StrEnum):
+    JSON = enum.auto()
+    FOLDED = enum.auto()
+
+
+@export_app.command()
+@charmonium.time_block.decor(print_start=False)
+def perf_profile(
+        output: Annotated[
+            pathlib.Path,
+            typer.Argument(),
+        ] = pathlib.Path("perf-profile.json"),
+        probe_log: Annotated[
+            pathlib.Path,
+            probe_log_help,
+        ] = pathlib.Path("probe_log"),
+        format: Annotated[
+            ProfileFormat,
+            typer.Option(help="json for the parallelism profile, critical path, and speedup bounds; folded for the CPU time of each process, as input to flamegraph.pl or speedscope"),
+        ] = ProfileFormat.JSON,
+        max_cpus: Annotated[
+            int,
+            typer.Option(help="Compute speedup bounds for up to this many CPUs"),
+        ] = 64,
+        strict: Annotated[bool, strict_option] = True,
+        debug: Annotated[bool, debug_option] = False,
+) -> None:
+    """
+    Write where the time of probe_log went, and how well it could parallelize.
+
+    CPU times come from libprobe's samples at the start and end of each exec epoch.
+    """
+    restore_sanity(strict, debug)
+    probe_log_obj = parser.parse_probe_log(probe_log)
+    match format:
+        case ProfileFormat.JSON:
+            hbg = hb_graph_module.probe_log_to_hb_graph(probe_log_obj)
+            profile = analysis.perf_profile(hbg, probe_log_obj, max_cpus)
+            output.write_bytes(msgspec.json.format(msgspec.json.encode(profile)))
+            console.print(
+                f"Work {profile.work:.2f}s, critical path {profile.critical_path_cpu_time:.2f}s, "
+                f"makespan {profile.makespan:.2f}s, average parallelism {profile.average_parallelism:.2f}"
+            )
+        case ProfileFormat.FOLDED:
+            output.write_text("".join(line + "\n" for line in analysis.folded_stacks(probe_log_obj)))
+
+
 @export_app.command()
 def store_dataflow_graph(
         probe_log: Annotated[
             pathlib.Path,
             probe_log_help,
         ] = pathlib.Path("probe_log"),
+        strict: Annotated[bool, strict_option] = True,
+        debug: Annotated[bool, debug_option] = False,
 ) -> None:
-    # probe_log = parser.parse_probe_log(probe_log)
-    # hbg = hb_graph_module.probe_log_to_hb_graph(probe_log)
-    # dfg = dataflow_graph_module.hb_graph_to_dataflow_graph(probe_log, hbg, True)
-    engine = get_engine()
-    with sqlalchemy.orm.Session(engine) as session:
-        raise NotImplementedError()
-        # for node in dfg.nodes():
-            # if isinstance(node, ProcessNode):
-            #     new_process = Process(process_id = int(node.pid), parent_process_id = 0, cmd = shlex.join(node.cmd), time = datetime.datetime.now())
-            #     session.add(new_process)
-
-        # for (node1, node2) in dfg.edges():
-            # if isinstance(node1, ProcessNode) and isinstance(node2, ProcessNode):
-            #     parent_process_id = node1.pid
-            #     child_process = session.get(Process, node2.pid)
-            #     if child_process:
-            #         child_process.parent_process_id = parent_process_id
-
-            # elif isinstance(node1, ProcessNode) and isinstance(node2, FileAccess):
-            #     inode_info = node2.inode_version
-            #     host = get_host_name()
-            #     stat_info = os.stat(node2.path)
-            #     mtime = int(stat_info.st_mtime * 1_000_000_000)
-            #     size = stat_info.st_size
-            #     new_output_inode = ProcessThatWrites(
-            #         inode=inode_info.inode,
-            #         process_id=node1.pid,
-            #         device=inode_info.inode.device,
-            #         host=host,
-            #         path=node2.path,
-            #         mtime=mtime,
-            #         size=size,
-            #     )
-            #     session.add(new_output_inode)
-
-            # elif isinstance(node1, FileAccess) and isinstance(node2, ProcessNode):
-            #     inode_info = node1.inode_version
-            #     host = get_host_name()
-            #     stat_info = os.stat(node1.path)
-            #     mtime = int(stat_info.st_mtime * 1_000_000_000)
-            #     size = stat_info.st_size
-            #     new_input_inode = ProcessInputs(
-            #         inode=inode_info.inode,
-            #         process_id=node2.pid,
-            #         device=inode_info.inode.device,
-            #         host=host,
-            #         path=node1.path,
-            #         mtime=mtime,
-            #         size=size,
-            #     )
-            #     session.add(new_input_inode)
-
-        raise NotImplementedError()
-        # root_process = None
-        # for node in dataflow_graph_module.nodes():
-        #     if isinstance(node, ProcessNode):
-        #         pid = node.pid
-        #         process_record = session.get(Process, pid)
-        #         if process_record and process_record.parent_process_id == 0:
-        #             if root_process is not None:
-        #                 print(f"Error: Two parent processes - {pid} and {root_process}")
-        #                 session.rollback()
-        #                 return
-        #             else:
-        #                 root_process = pid
-
-        session.commit()
+    """
+    Add the processes of probe_log, and the files they read and wrote, to the persistent provenance database.
+
+    See docs/persistent_prov.md.
+    """
+    restore_sanity(strict, debug)
+    probe_log_obj = parser.parse_probe_log(probe_log)
+    require_file_descriptors(probe_log_obj)
+    hbg = hb_graph_module.probe_log_to_hb_graph(probe_log_obj)
+    start = time.perf_counter()
+    with persistent_provenance.open_store() as session:
+        stats = persistent_provenance.ingest_probe_log(session, probe_log_obj, hbg)
+    elapsed = time.perf_counter() - start
+    console.print(
+        f"Stored {stats.processes} processes, {stats.inputs} inputs, and {stats.writes} writes "
+        f"({stats.duplicate_processes} processes and {stats.duplicate_writes} writes already stored) "
+        f"in {elapsed:.2f}s ({stats.rows / elapsed:.0f} rows/s)"
+    )
 
 
 @export_app.command()
@@ -533,6 +621,123 @@ def ops_jsonl(
                     }))
 
 
+@blobs_app.command()
+def check_in(
+        probe_log: Annotated[
+            pathlib.Path,
+            probe_log_help,
+        ] = pathlib.Path("probe_log"),
+        store: Annotated[
+            pathlib.Path,
+            blob_store_option,
+        ] = blob_store.DEFAULT_STORE,
+) -> None:
+    """
+    Move the copied files of probe_log into the blob store, leaving references in their place.
+    """
+    refs = blob_store.BlobStore(store).check_in(probe_log)
+    console.print(f"Checked in {len(refs.digests)} files as recording {refs.recording}")
+
+
+@blobs_app.command()
+def release(
+        probe_log: Annotated[
+            pathlib.Path,
+            probe_log_help,
+        ] = pathlib.Path("probe_log"),
+        store: Annotated[
+            pathlib.Path,
+            blob_store_option,
+        ] = blob_store.DEFAULT_STORE,
+) -> None:
+    """
+    Drop the references of probe_log to the blob store, e.g., before deleting it.
+
+    The blobs are only deleted by `gc`, once no PROBE log refers to them.
+    """
+    refs = blob_store.read_blob_refs(probe_log)
+    if refs is None:
+        console.print(f"{probe_log} is not checked in", style="red")
+        raise typer.Exit(code=1)
+    blob_store.BlobStore(store).release(refs)
+
+
+@blobs_app.command()
+def gc(
+        store: Annotated[
+            pathlib.Path,
+            blob_store_option,
+        ] = blob_store.DEFAULT_STORE,
+) -> None:
+    """
+    Delete the blobs which no PROBE log refers to.
+    """
+    n_blobs, n_bytes = blob_store.BlobStore(store).gc()
+    console.print(f"Deleted {n_blobs} blobs ({n_bytes} bytes)")
+
+
+@app.command()
+def lineage(
+        path: Annotated[
+            pathlib.Path,
+            typer.Argument(help="File whose current version to look up"),
+        ],
+        downstream: Annotated[
+            bool,
+            typer.Option("--downstream/--upstream", help="Whether to list what was derived from path, rather than what path was derived from"),
+        ] = False,
+) -> None:
+    """
+    List the processes and files that path was derived from, across every PROBE log in the persistent provenance database.
+
+    PROBE logs get into the database through `probe py export store-dataflow-graph`.
+    """
+    root = persistent_provenance.InodeVersion.from_local_path(path, None)
+    with persistent_provenance.open_store() as session:
+        graph = persistent_provenance.lineage_graph(session)
+        result = graph.downstream([root]) if downstream else graph.upstream([root])
+        processes = [
+            (process.time, process.cmd)
+            for process in persistent_provenance.get_process_rows(session, result.processes)
+        ]
+    if not processes:
+        console.print(f"No recorded process {'read' if downstream else 'wrote'} the current version of {path}")
+    for start, cmd in sorted(processes):
+        print(f"{start.isoformat()} {cmd}")
+    for file in sorted(
+            graph.path(inode_version) or inode_version.str_id()
+            for inode_version in result.inode_versions
+            if inode_version != root
+    ):
+        print(file)
+
+
+@app.command(name="gc")
+def gc_persistent_provenance(
+        keep_days: Annotated[
+            float,
+            typer.Option(help="Keep every process from the last this many days, and what it was derived from"),
+        ] = 90,
+        dry_run: Annotated[
+            bool,
+            typer.Option(help="Only count what would be dropped"),
+        ] = False,
+) -> None:
+    """
+    Shrink the persistent provenance database.
+
+    Drops the processes older than --keep-days which no file that still exists was derived from, then compacts the database.
+    """
+    stats = persistent_provenance.gc(datetime.timedelta(days=keep_days), dry_run=dry_run)
+    if dry_run:
+        console.print(f"Would drop {stats.processes_dropped} processes ({stats.rows_dropped} rows)")
+    else:
+        console.print(
+            f"Dropped {stats.processes_dropped} processes ({stats.rows_dropped} rows); "
+            f"database went from {stats.bytes_before} to {stats.bytes_after} bytes"
+        )
+
+
 # Example: scp Desktop/sample_example.txt root@136.183.142.28:/home/remote_dir
 @app.command(
 context_settings=dict(
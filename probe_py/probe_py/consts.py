@@ -34,3 +34,8 @@ AT_FDCWD: typing.Final = -100
 
 # echo -e '#define _GNU_SOURCE\n#include <fcntl.h>\nAT_EMPTY_PATH' | gcc -E - | tail --lines=1
 AT_EMPTY_PATH: typing.Final = 4096
+
+# Index of OpCategory::FileIo (Open, Close, Dup, ...) in cli-wrapper/probe_headers/src/context.rs;
+# ProcessTreeContext.recorded_op_categories has bit (1 << OP_CATEGORY_FILE_IO) set if those ops were recorded.
+# test_op_category_file_io there fails if that enum is reordered without updating this.
+OP_CATEGORY_FILE_IO: typing.Final = 1
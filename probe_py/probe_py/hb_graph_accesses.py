@@ -1,8 +1,12 @@
+from __future__ import annotations
 import collections
 import dataclasses
 import os
 import pathlib
+import typing
 import warnings
+import numpy
+import numpy.typing
 from . import graph_utils
 from . import headers as ops
 from . import ptypes
@@ -13,20 +17,62 @@ def hb_graph_to_accesses(
         hbg: ptypes.HbGraph,
 ) -> collections.abc.Iterator[ptypes.Access | ptypes.OpQuad]:
     """Reduces a happens-before graph to an ordered list of accesses in one possible schedule."""
+    tables = AccessTables()
+    for item in _schedule(probe_log, hbg, tables):
+        if isinstance(item, ptypes.OpQuad):
+            yield item
+        else:
+            phase, mode, inode_id, path_id, node, open_number = item
+            yield ptypes.Access(phase, mode, tables.inodes[inode_id], tables.paths[path_id], node, open_number)
+
+
+# phase, mode, inode ID, path ID, op node, open number; see _schedule
+_RawAccess: typing.TypeAlias = tuple[ptypes.Phase, ptypes.AccessMode, int, int, ptypes.OpQuad, ops.OpenNumber | None]
+
+
+def _schedule(
+        probe_log: ptypes.ProbeLog,
+        hbg: ptypes.HbGraph,
+        tables: AccessTables,
+) -> collections.abc.Iterator[_RawAccess | ptypes.OpQuad]:
+    """The schedule of hb_graph_to_accesses, with accesses as plain tuples whose inode and path are interned into tables.
+
+    Each inode and path is interned once per open (and each path once per directory and name), rather than once per access.
+    """
+
+    if not probe_log.records_file_descriptors():
+        raise ptypes.InvalidProbeLog(
+            "This probe log was recorded with --summary or without --ops=file-io, so it lacks the ops which open files",
+        )
 
     @dataclasses.dataclass
     class FileDescriptor2:
         mode: ptypes.AccessMode
-        inode: ptypes.Inode
-        path: pathlib.Path
+        inode_id: int
+        path_id: int
         cloexec: bool
 
     proc_fd_to_fd = collections.defaultdict[ptypes.Pid, dict[ops.OpenNumber, FileDescriptor2]](dict)
 
-    def close(open_number: ops.OpenNumber, node: ptypes.OpQuad) -> collections.abc.Iterator[ptypes.Access]:
+    # Paths are interned by (directory path id, name bytes).
+    # Most opens are relative to a handful of directories, so this avoids re-joining and re-decoding the same path objects for every open.
+    path_ids: dict[tuple[int, bytes], int] = {}
+
+    def intern_path(directory_path_id: int, name: bytes | None) -> int:
+        key = (directory_path_id, name or b"")
+        path_id = path_ids.get(key)
+        if path_id is None:
+            path_id = path_ids[key] = tables.path_id(tables.paths[directory_path_id] / key[1].decode())
+        return path_id
+
+    def resolve(pid: ptypes.Pid, path_arg: ops.PathArg) -> int:
+        return intern_path(proc_fd_to_fd[pid][path_arg.directory].path_id, path_arg.name)
+
+    last_ops_in_process = _last_ops_in_process(hbg)
+
+    def close(open_number: ops.OpenNumber, node: ptypes.OpQuad) -> collections.abc.Iterator[_RawAccess]:
         if file_desc := proc_fd_to_fd[node.pid].get(open_number):
-            file_desc = proc_fd_to_fd[node.pid][open_number]
-            yield ptypes.Access(ptypes.Phase.END, file_desc.mode, file_desc.inode, file_desc.path, node, open_number)
+            yield (ptypes.Phase.END, file_desc.mode, file_desc.inode_id, file_desc.path_id, node, open_number)
             del proc_fd_to_fd[node.pid][open_number]
         else:
             warnings.warn(ptypes.UnusualProbeLog(
@@ -40,16 +86,16 @@ def hb_graph_to_accesses(
             inode: ops.Inode,
             path_arg: ops.PathArg,
             open_number: ops.OpenNumber,
-    ) -> collections.abc.Iterator[ptypes.Access]:
+    ) -> collections.abc.Iterator[_RawAccess]:
         if open_number in proc_fd_to_fd[node.pid]:
             warnings.warn(ptypes.UnusualProbeLog(
                 f"ON {open_number} closed was without our knowledge before {node}.",
             ))
             yield from close(open_number, node)
-        path = proc_fd_to_fd[node.pid][path_arg.directory].path / (path_arg.name or b"").decode()
-        inode2 = ptypes.Inode.from_ops_inode(inode)
-        proc_fd_to_fd[node.pid][open_number] = FileDescriptor2(mode, inode2, path, cloexec)
-        yield ptypes.Access(ptypes.Phase.BEGIN, mode, inode2, path, node, open_number)
+        path_id = resolve(node.pid, path_arg)
+        inode_id = tables.inode_id(ptypes.Inode.from_ops_inode(inode))
+        proc_fd_to_fd[node.pid][open_number] = FileDescriptor2(mode, inode_id, path_id, cloexec)
+        yield (ptypes.Phase.BEGIN, mode, inode_id, path_id, node, open_number)
 
     for node in graph_utils.topological_sort_depth_first(
             hbg,
@@ -70,10 +116,10 @@ def hb_graph_to_accesses(
                     for on, file_desc in list(proc_fd_to_fd[node.pid].items()):
                         if file_desc.cloexec:
                             yield from close(on, node)
-                    exe_inode = ptypes.Inode.from_ops_inode(op_data.inode)
-                    path = proc_fd_to_fd[node.pid][op_data.path.directory].path / (op_data.path.name or b"").decode()
-                    yield ptypes.Access(ptypes.Phase.BEGIN, ptypes.AccessMode.EXEC, exe_inode, path, node, None)
-                    yield ptypes.Access(ptypes.Phase.END, ptypes.AccessMode.EXEC, exe_inode, path, node, None)
+                    exe_inode_id = tables.inode_id(ptypes.Inode.from_ops_inode(op_data.inode))
+                    path_id = resolve(node.pid, op_data.path)
+                    yield (ptypes.Phase.BEGIN, ptypes.AccessMode.EXEC, exe_inode_id, path_id, node, None)
+                    yield (ptypes.Phase.END, ptypes.AccessMode.EXEC, exe_inode_id, path_id, node, None)
             case ops.Close():
                 if op.ferrno == 0:
                     yield from close(op_data.open_number, node)
@@ -84,13 +130,95 @@ def hb_graph_to_accesses(
                         proc_fd_to_fd[target] = proc_fd_to_fd[node.pid]
                     else:
                         proc_fd_to_fd[target] = {**proc_fd_to_fd[node.pid]}
-        is_last_op_in_process = not any(
-            successor.pid == node.pid
-            for successor in hbg.successors(node)
-        )
-        if is_last_op_in_process:
+        if node in last_ops_in_process:
             for on in list(proc_fd_to_fd[node.pid].keys()):
                 yield from close(on, node)
 
     for pid, fd_table in proc_fd_to_fd.items():
         assert not fd_table, f"somehow we still have open file descriptors at the end. {pid} {fd_table}"
+
+
+def _last_ops_in_process(hbg: ptypes.HbGraph) -> frozenset[ptypes.OpQuad]:
+    """Nodes which have no happens-before successor in the same process, computed in one pass over the adjacency."""
+    return frozenset(
+        node
+        for node, successors in hbg.adjacency()
+        if all(successor.pid != node.pid for successor in successors)
+    )
+
+
+ACCESS_DTYPE = numpy.dtype([
+    # index into ptypes.Phase
+    ("phase", numpy.uint8),
+    # ptypes.AccessMode.value
+    ("mode", numpy.uint8),
+    ("inode_id", numpy.uint32),
+    ("path_id", numpy.uint32),
+    ("pid", numpy.int32),
+    ("exec_no", numpy.int32),
+    ("tid", numpy.int32),
+    ("op_no", numpy.int32),
+    # -1 when the access has no open number (e.g., exec)
+    ("open_number", numpy.int64),
+])
+
+
+_PHASE_CODES = {phase: code for code, phase in enumerate(ptypes.Phase)}
+
+
+@dataclasses.dataclass
+class AccessTables:
+    """Interned inodes and paths referred to by `inode_id` and `path_id` in access batches."""
+    inodes: list[ptypes.Inode] = dataclasses.field(default_factory=list)
+    paths: list[pathlib.Path] = dataclasses.field(default_factory=list)
+    _inode_ids: dict[ptypes.Inode, int] = dataclasses.field(default_factory=dict)
+    _path_ids: dict[pathlib.Path, int] = dataclasses.field(default_factory=dict)
+
+    def inode_id(self, inode: ptypes.Inode) -> int:
+        inode_id = self._inode_ids.get(inode)
+        if inode_id is None:
+            inode_id = self._inode_ids[inode] = len(self.inodes)
+            self.inodes.append(inode)
+        return inode_id
+
+    def path_id(self, path: pathlib.Path) -> int:
+        path_id = self._path_ids.get(path)
+        if path_id is None:
+            path_id = self._path_ids[path] = len(self.paths)
+            self.paths.append(path)
+        return path_id
+
+
+def hb_graph_to_access_batches(
+        probe_log: ptypes.ProbeLog,
+        hbg: ptypes.HbGraph,
+        tables: AccessTables,
+        batch_size: int = 1 << 16,
+) -> collections.abc.Iterator[numpy.typing.NDArray[typing.Any]]:
+    """Like `hb_graph_to_accesses`, but yields accesses as structured arrays of `ACCESS_DTYPE` of at most `batch_size` rows.
+
+    Inodes and paths are interned into `tables`, which grows as batches are yielded.
+    The op nodes interleaved in `hb_graph_to_accesses` are dropped; the schedule order is preserved in the row order.
+    Rows are filled straight from the schedule, without an `Access` per access.
+    """
+    rows = list[tuple[int, int, int, int, int, int, int, int, int]]()
+    for item in _schedule(probe_log, hbg, tables):
+        if isinstance(item, ptypes.OpQuad):
+            continue
+        phase, mode, inode_id, path_id, node, open_number = item
+        rows.append((
+            _PHASE_CODES[phase],
+            mode.value,
+            inode_id,
+            path_id,
+            node.pid,
+            node.exec_no,
+            node.tid,
+            node.op_no,
+            -1 if open_number is None else open_number.value,
+        ))
+        if len(rows) == batch_size:
+            yield numpy.array(rows, dtype=ACCESS_DTYPE)
+            rows.clear()
+    if rows:
+        yield numpy.array(rows, dtype=ACCESS_DTYPE)
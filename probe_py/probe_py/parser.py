@@ -6,31 +6,150 @@ import typing
 import tarfile
 import tempfile
 import contextlib
+import warnings
 import charmonium.time_block
 import msgspec
+from . import blob_refs
 from . import headers as ops
-from .ptypes import ProbeLog, InodeVersion, Pid, ExecNo, Tid, Host, KernelThread, Process, Exec
+from .ptypes import ProbeLog, InodeVersion, Pid, ExecNo, Tid, Host, KernelThread, Process, Exec, UnusualProbeLog, UNSAMPLED_RESOURCES
+
+
+class StringArrayInterner:
+    """Shares identical argv/env arrays (and identical strings within them) between ops.
+
+    Exec-heavy logs (e.g., builds) carry thousands of nearly identical environments.
+    Interning every string means near-identical environments differ only in the tuple of references, not in the bytes.
+    """
+
+    def __init__(self) -> None:
+        self._arrays = dict[tuple[bytes, ...], tuple[bytes, ...]]()
+        self._strings = dict[bytes, bytes]()
+
+    def intern(self, array: typing.Sequence[bytes]) -> tuple[bytes, ...]:
+        key = tuple(array)
+        if (interned := self._arrays.get(key)) is not None:
+            return interned
+        interned = tuple(self._strings.setdefault(string, string) for string in key)
+        self._arrays[interned] = interned
+        return interned
+
+    def intern_exec(self, exec: ops.Exec) -> ops.Exec:
+        return msgspec.structs.replace(exec, argv=self.intern(exec.argv), env=self.intern(exec.env))
+
+    def intern_op(self, op: ops.Op) -> ops.Op:
+        match op.data:
+            case ops.InitExecEpoch():
+                return msgspec.structs.replace(op, data=msgspec.structs.replace(op.data, argv=self.intern(op.data.argv), env=self.intern(op.data.env)))
+            case ops.Exec():
+                return msgspec.structs.replace(op, data=self.intern_exec(op.data))
+            case ops.Spawn():
+                return msgspec.structs.replace(op, data=msgspec.structs.replace(op.data, exec=self.intern_exec(op.data.exec)))
+            case _:
+                return op
+
+
+def _find_initial_env(threads: typing.Iterable[typing.Sequence[ops.Op]]) -> typing.Sequence[bytes] | None:
+    for ops_list in threads:
+        for op in ops_list:
+            if isinstance(op.data, ops.InitExecEpoch):
+                return op.data.env
+    return None
+
+
+def _expand_exec_env(exec: ops.Exec, initial_env: typing.Sequence[bytes]) -> ops.Exec:
+    removed = frozenset(exec.env_removed)
+    return msgspec.structs.replace(
+        exec,
+        env=[entry for entry in initial_env if entry not in removed] + list(exec.env),
+        env_removed=[],
+    )
+
+
+def expand_env_delta(op: ops.Op, initial_env: typing.Sequence[bytes]) -> ops.Op:
+    """libprobe records the env of Exec and Spawn ops as a delta against the env of the exec epoch's InitExecEpoch.
+
+    This replaces the delta with the full env (see `Exec::expand_env` in probe_headers).
+    """
+    match op.data:
+        case ops.Exec():
+            return msgspec.structs.replace(op, data=_expand_exec_env(op.data, initial_env))
+        case ops.Spawn():
+            return msgspec.structs.replace(op, data=msgspec.structs.replace(op.data, exec=_expand_exec_env(op.data.exec, initial_env)))
+        case _:
+            return op
+
+
+def _strip_dropped_ops(ops_list: typing.Sequence[ops.Op]) -> tuple[list[ops.Op], int]:
+    """Remove the DroppedOps markers which libprobe leaves in bounded recordings, and count the ops they stand for."""
+    n_dropped_ops = 0
+    kept: list[ops.Op] = []
+    for op in ops_list:
+        if isinstance(op.data, ops.DroppedOps):
+            n_dropped_ops += op.data.n_ops
+        else:
+            kept.append(op)
+    return kept, n_dropped_ops
+
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+@contextlib.contextmanager
+def open_probe_log(path_to_probe_log: pathlib.Path) -> typing.Iterator[tarfile.TarFile]:
+    """Open a PROBE log, whichever `--compression` it was written with.
+
+    tarfile detects gzip and uncompressed archives on its own, but not zstd.
+
+    """
+    with path_to_probe_log.open("rb") as file:
+        magic = file.read(len(ZSTD_MAGIC))
+        file.seek(0)
+        if magic == ZSTD_MAGIC:
+            try:
+                import zstandard
+            except ImportError as exc:
+                raise RuntimeError(f"{path_to_probe_log} is zstd-compressed; reading it requires the zstandard package") from exc
+            with zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True) as reader, \
+                 tarfile.open(fileobj=reader, mode="r|") as tar:
+                yield tar
+        else:
+            with tarfile.open(fileobj=file, mode="r") as tar:
+                yield tar
 
 
 @contextlib.contextmanager
 def parse_probe_log_ctx(
         path_to_probe_log: pathlib.Path,
+        intern_strings: bool = True,
+        store: pathlib.Path | None = None,
 ) -> typing.Iterator[ProbeLog]:
     """Parse probe log
 
     In this contextmanager, copied_files are extracted onto the disk.
+    If the PROBE log was checked in to a blob store (see blob_store.BlobStore.check_in), copied_files refer to the blobs in that store instead.
+    Pass store (the root of a blob store) to look them up in a store other than the one the PROBE log was checked in to.
+
+    If intern_strings, argv and env arrays which are equal share the same tuple (see StringArrayInterner).
 
     """
     with tempfile.TemporaryDirectory() as _tmpdir, charmonium.time_block.ctx("parse_probe_log_ctx", print_start=False):
         tmpdir = pathlib.Path(_tmpdir)
-        with tarfile.open(path_to_probe_log, mode="r") as tar:
+        with open_probe_log(path_to_probe_log) as tar:
             tar.extractall(tmpdir, filter="data")
         host = Host.localhost()
-        inodes = {
-            InodeVersion.from_id_string(file.name): file
-            for file in (tmpdir / "inodes").iterdir()
-        }
+        inodes: typing.Mapping[InodeVersion, pathlib.Path]
+        if (blob_refs_file := tmpdir / blob_refs.BLOB_REFS_FILE).exists():
+            inodes = blob_refs.ResolvedBlobRefs(
+                msgspec.json.decode(blob_refs_file.read_bytes(), type=blob_refs.BlobRefs),
+                store,
+            )
+        else:
+            inodes = {
+                InodeVersion.from_id_string(file.name): file
+                for file in (tmpdir / "inodes").iterdir()
+            }
 
+        interner = StringArrayInterner() if intern_strings else None
         processes = dict[Pid, Process]()
         pid_entries = list((tmpdir / "pids").iterdir())
         for pid_dir in tqdm.tqdm(
@@ -41,15 +160,27 @@ def parse_probe_log_ctx(
             execs = {}
             for epoch_dir in pid_dir.iterdir():
                 exec_no = ExecNo(epoch_dir.name)
-                threads = {}
-                for tid_file in epoch_dir.iterdir():
-                    tid = Tid(tid_file.name)
-                    ops_list = msgspec.msgpack.decode(
+                thread_ops = {
+                    Tid(tid_file.name): msgspec.msgpack.decode(
                         tid_file.read_bytes(),
                         type=list[ops.Op],
                         strict=True,
                     )
+                    for tid_file in epoch_dir.iterdir()
+                }
+                initial_env = _find_initial_env(thread_ops.values())
+                if initial_env is None:
+                    warnings.warn(UnusualProbeLog(f"No InitExecEpoch op in {pid} {exec_no}; exec environments will be partial"))
+                threads = {}
+                for tid, ops_list in thread_ops.items():
                     assert ops_list
+                    ops_list, n_dropped_ops = _strip_dropped_ops(ops_list)
+                    if n_dropped_ops:
+                        warnings.warn(UnusualProbeLog(f"{pid} {exec_no} {tid} dropped {n_dropped_ops} ops to stay within `probe record --max-size`; its file accesses are incomplete"))
+                    if initial_env is not None:
+                        ops_list = [expand_env_delta(op, initial_env) for op in ops_list]
+                    if interner is not None:
+                        ops_list = [interner.intern_op(op) for op in ops_list]
                     if not isinstance(ops_list[-1].data, (ops.ExitThread, ops.ExitProcess, ops.Exec)):
                         # Every thread should end in an ExitThread and possibly an ExitProcess
                         # Consider:
@@ -58,12 +189,12 @@ def parse_probe_log_ctx(
                         # The HB graph would be a tree, main[0] ---clone--> thread2[0].
                         # We can't put an HB edge from the last op of thread2 to the last op of main, and the HB graph 
                         ops_list.append(ops.Op(
-                            data=ops.ExitThread(status=0),
+                            data=ops.ExitThread(status=0, resources=UNSAMPLED_RESOURCES),
                             pthread_id=ops_list[-1].pthread_id,
                             iso_c_thread_id=ops_list[-1].iso_c_thread_id,
                             ferrno=0,
                         ))
-                    threads[tid] = KernelThread(tid, ops_list)
+                    threads[tid] = KernelThread(tid, ops_list, n_dropped_ops)
                 execs[exec_no] = Exec(exec_no, threads)
             processes[pid] = Process(pid, execs)
 
@@ -83,12 +214,13 @@ def parse_probe_log_ctx(
 
 def parse_probe_log(
         path_to_probe_log: pathlib.Path,
+        intern_strings: bool = True,
 ) -> ProbeLog:
     """Parse probe log.
 
     Unlike parse_probe_ctx, the copied_files will not be accessible.
     """
-    with parse_probe_log_ctx(path_to_probe_log) as probe_log:
+    with parse_probe_log_ctx(path_to_probe_log, intern_strings) as probe_log:
         return dataclasses.replace(
             probe_log,
             copied_files={},
@@ -1,16 +1,41 @@
 from __future__ import annotations
+import collections
+import contextlib
 import typing
 import os
 import random
+import shlex
 import socket
+import stat
+import time
 import json
 import datetime
 import dataclasses
+import itertools
 import pathlib
+import warnings
+import sqlalchemy
+import sqlalchemy.dialects.sqlite
+import sqlalchemy.orm
 import xdg_base_dirs
+from . import bloom_filter
+from . import hb_graph_accesses
+from . import headers as ops
+from . import persistent_provenance_db as db
+from . import ptypes
 
 
 PROBE_HOME = xdg_base_dirs.xdg_data_home() / "PROBE"
+DATABASE_PATH = PROBE_HOME / "provenance.db"
+
+# A Bloom filter of the inode versions which have a writer in the database, so most lookups of those without one never open it.
+# Every transaction which adds writers adds them to the filter before committing, while it holds the database's write lock (see _save_writer_filter).
+WRITER_FILTER_PATH = PROBE_HOME / "writers.bloom"
+_MIN_WRITER_FILTER_CAPACITY = 1 << 16
+
+# The layout persistent provenance used to be stored in: one JSON file per inode version and one per process.
+# Hosts we upload to without Python (see remote_access.upload_provenance_remote) still write it;
+# open_store() imports whatever it finds there.
 PROCESS_ID_THAT_WROTE_INODE_VERSION = PROBE_HOME / "process_id_that_wrote_inode_version"
 PROCESSES_BY_ID = PROBE_HOME / "processes_by_id"
 
@@ -68,6 +93,10 @@ class Inode:
             number = 0
         return f"{number:012x}-{self.device_major:04x}-{self.device_minor:04x}-{self.inode:016x}"
 
+    @staticmethod
+    def from_dict(data: typing.Mapping[str, typing.Any]) -> Inode:
+        return Inode(data['host'], data['device_major'], data['device_minor'], data['inode'])
+
     @staticmethod
     def from_local_path(path: pathlib.Path, stat_info: None | os.stat_result = None) -> Inode:
         if stat_info is None:
@@ -108,11 +137,15 @@ class InodeVersion:
     def str_id(self) -> str:
         return f"{self.inode.str_id()}-{self.mtime:016x}-{self.size:016x}"
 
+    @staticmethod
+    def from_dict(data: typing.Mapping[str, typing.Any]) -> InodeVersion:
+        return InodeVersion(Inode.from_dict(data['inode']), data['mtime'], data['size'])
+
     @staticmethod
     def from_local_path(path: pathlib.Path, stat_info: os.stat_result | None) -> InodeVersion:
         if stat_info is None:
             stat_info = os.stat(path)
-        mtime = int(stat_info.st_mtime * 1_000_000_000)
+        mtime = stat_info.st_mtime_ns
         size = stat_info.st_size
         return InodeVersion(Inode.from_local_path(path, stat_info), mtime, size)
 
@@ -134,6 +167,10 @@ class InodeMetadata:
             "gid": self.gid,
         }
 
+    @staticmethod
+    def from_dict(data: typing.Mapping[str, typing.Any]) -> InodeMetadata:
+        return InodeMetadata(Inode.from_dict(data['inode']), data['mode'], data['nlink'], data['uid'], data['gid'])
+
     @staticmethod
     def from_local_path(path: pathlib.Path, stat_info: os.stat_result | None) -> InodeMetadata:
         if stat_info is None:
@@ -172,6 +209,665 @@ class Process:
             'wd': str(self.wd),
         }
 
+    @staticmethod
+    def from_dict(data: typing.Mapping[str, typing.Any]) -> Process:
+        return Process(
+            frozenset(InodeVersion.from_dict(inode_version) for inode_version in data['input_inodes']),
+            frozenset(InodeMetadata.from_dict(metadata) for metadata in data['input_inode_metadatas']),
+            frozenset(InodeVersion.from_dict(inode_version) for inode_version in data['output_inodes']),
+            frozenset(InodeMetadata.from_dict(metadata) for metadata in data['output_inode_metadatas']),
+            datetime.datetime.fromisoformat(data['time']),
+            tuple(data['cmd']),
+            data['pid'],
+            tuple((key, value) for key, value in data['env']),
+            pathlib.Path(data['wd']),
+        )
+
+
+@contextlib.contextmanager
+def open_store(probe_home: pathlib.Path = PROBE_HOME) -> typing.Iterator[sqlalchemy.orm.Session]:
+    """Open a transaction on the persistent provenance database, which commits if the block exits normally.
+
+    Provenance left in the directory layout is imported first.
+    """
+    engine = db.get_engine(probe_home / DATABASE_PATH.name)
+    if _has_directory_layout(probe_home):
+        migrate_directory_layout(engine, probe_home)
+    with sqlalchemy.orm.Session(engine) as session, session.begin():
+        yield session
+        _save_writer_filter(session)
+
+
+def _has_directory_layout(probe_home: pathlib.Path) -> bool:
+    return (probe_home / PROCESSES_BY_ID.name).exists() or (probe_home / PROCESS_ID_THAT_WROTE_INODE_VERSION.name).exists()
+
+
+_INODE_VERSION_COLUMNS = ("host", "device_major", "device_minor", "inode", "mtime_sec", "mtime_nsec", "size")
+
+
+def _inode_version_columns(inode_version: InodeVersion) -> dict[str, typing.Any]:
+    mtime_sec, mtime_nsec = divmod(inode_version.mtime, 1_000_000_000)
+    return {
+        "host": inode_version.inode.host,
+        "device_major": inode_version.inode.device_major,
+        "device_minor": inode_version.inode.device_minor,
+        "inode": inode_version.inode.inode,
+        "mtime_sec": mtime_sec,
+        "mtime_nsec": mtime_nsec,
+        "size": inode_version.size,
+    }
+
+
+def _inode_version_of_row(row: db.ProcessInputs | db.ProcessThatWrites) -> InodeVersion:
+    return InodeVersion(
+        Inode(row.host, row.device_major, row.device_minor, row.inode),
+        row.mtime_sec * 1_000_000_000 + row.mtime_nsec,
+        row.size,
+    )
+
+
+# The columns of _INODE_VERSION_COLUMNS, which identify an inode version in the tables
+_InodeVersionKey: typing.TypeAlias = tuple[str, int, int, int, int, int, int]
+
+
+def _inode_version_key(inode_version: InodeVersion) -> _InodeVersionKey:
+    columns = _inode_version_columns(inode_version)
+    return typing.cast(_InodeVersionKey, tuple(columns[column] for column in _INODE_VERSION_COLUMNS))
+
+
+def _inode_version_of_key(key: _InodeVersionKey) -> InodeVersion:
+    host, device_major, device_minor, inode, mtime_sec, mtime_nsec, size = key
+    return InodeVersion(Inode(host, device_major, device_minor, inode), mtime_sec * 1_000_000_000 + mtime_nsec, size)
+
+
+def _filter_item(key: _InodeVersionKey) -> bytes:
+    return repr(key).encode()
+
+
+def _writer_filter_path(session: sqlalchemy.orm.Session) -> pathlib.Path:
+    database = session.get_bind().engine.url.database
+    assert database is not None
+    return pathlib.Path(database).with_name(WRITER_FILTER_PATH.name)
+
+
+def _rebuild_writer_filter(session: sqlalchemy.orm.Session) -> bloom_filter.BloomFilter:
+    """Build the writer filter from scratch, with room for the writers to double."""
+    keys = session.execute(sqlalchemy.select(*(getattr(db.ProcessThatWrites, column) for column in _INODE_VERSION_COLUMNS))).all()
+    writer_filter = bloom_filter.BloomFilter(max(_MIN_WRITER_FILTER_CAPACITY, 2 * len(keys)))
+    writer_filter.add([_filter_item(typing.cast(_InodeVersionKey, tuple(key))) for key in keys])
+    writer_filter.save(_writer_filter_path(session))
+    return writer_filter
+
+
+# The session.info entry of the writers this transaction added, which _save_writer_filter adds to the filter
+_NEW_WRITER_KEYS = "new_writer_keys"
+
+
+def _add_to_writer_filter(session: sqlalchemy.orm.Session, keys: typing.Iterable[_InodeVersionKey]) -> None:
+    """Call after adding writers of keys in this transaction; they are added to the filter just before it commits."""
+    session.info.setdefault(_NEW_WRITER_KEYS, []).extend(keys)
+
+
+def _save_writer_filter(session: sqlalchemy.orm.Session) -> None:
+    """Add the writers this transaction added to the writer filter, rewriting it once per transaction rather than once per put_writes.
+
+    Call just before committing, while the transaction holds the write lock, so no other writer saves the filter in between.
+    """
+    keys: list[_InodeVersionKey] = session.info.pop(_NEW_WRITER_KEYS, [])
+    if not keys:
+        return
+    try:
+        writer_filter = bloom_filter.BloomFilter.load(_writer_filter_path(session))
+    except (OSError, ValueError):
+        writer_filter = None
+    if writer_filter is None or writer_filter.count + len(keys) > writer_filter.capacity:
+        _rebuild_writer_filter(session)
+    else:
+        writer_filter.add([_filter_item(key) for key in keys])
+        writer_filter.save(_writer_filter_path(session))
+
+
+def _changed(session: sqlalchemy.orm.Session) -> None:
+    """Note that this transaction changes the stored provenance, invalidating cached LineageGraphs."""
+    insert = sqlalchemy.dialects.sqlite.insert(db.Generation).values(id=0, value=1)
+    session.execute(insert.on_conflict_do_update(index_elements=["id"], set_={"value": db.Generation.value + 1}))
+
+
+def put_writes(session: sqlalchemy.orm.Session, inode_version_writes: typing.Mapping[InodeVersion, int | None]) -> None:
+    """Record which process wrote each inode version, replacing any previous writer."""
+    rows = [
+        {**_inode_version_columns(inode_version), "process_id": process_id}
+        for inode_version, process_id in inode_version_writes.items()
+        # None means we know of no writer, which is what having no row means
+        if process_id is not None
+    ]
+    if rows:
+        _changed(session)
+        insert = sqlalchemy.dialects.sqlite.insert(db.ProcessThatWrites)
+        session.execute(
+            insert.on_conflict_do_update(
+                index_elements=_INODE_VERSION_COLUMNS,
+                set_={"process_id": insert.excluded.process_id},
+            ),
+            rows,
+        )
+        _add_to_writer_filter(session, [
+            typing.cast(_InodeVersionKey, tuple(row[column] for column in _INODE_VERSION_COLUMNS))
+            for row in rows
+        ])
+
+
+def put_process(session: sqlalchemy.orm.Session, process: Process) -> int:
+    """Record process, its inputs, and its outputs as a new process, and return its ID in this database.
+
+    process.pid is not reused: it may come from another host's database or be made up (as for scp),
+    so it may be the ID of an unrelated process recorded here.
+    """
+    _changed(session)
+    process_id = session.execute(
+        sqlalchemy.insert(db.Process).values(
+            parent_process_id=None,
+            cmd=shlex.join(process.cmd),
+            time=process.time,
+            env=[list(env_item) for env_item in process.env],
+            wd=str(process.wd),
+        ).returning(db.Process.process_id)
+    ).scalar_one()
+    if process.input_inodes:
+        session.execute(
+            sqlalchemy.insert(db.ProcessInputs),
+            [
+                {**_inode_version_columns(inode_version), "process_id": process_id}
+                for inode_version in process.input_inodes
+            ],
+        )
+    metadatas = [
+        *((False, metadata) for metadata in process.input_inode_metadatas),
+        *((True, metadata) for metadata in process.output_inode_metadatas),
+    ]
+    if metadatas:
+        session.execute(
+            sqlalchemy.insert(db.ProcessInodeMetadata),
+            [
+                {
+                    "process_id": process_id,
+                    "output": output,
+                    "host": metadata.inode.host,
+                    "device_major": metadata.inode.device_major,
+                    "device_minor": metadata.inode.device_minor,
+                    "inode": metadata.inode.inode,
+                    "mode": metadata.mode,
+                    "nlink": metadata.nlink,
+                    "uid": metadata.uid,
+                    "gid": metadata.gid,
+                }
+                for output, metadata in metadatas
+            ],
+        )
+    put_writes(session, {inode_version: process_id for inode_version in process.output_inodes})
+    return process_id
+
+
+def put_provenance(
+        session: sqlalchemy.orm.Session,
+        processes: typing.Mapping[int, Process],
+        inode_version_writes: typing.Mapping[InodeVersion, int | None],
+        stored_process_ids: typing.Container[int] = frozenset(),
+) -> dict[int, int]:
+    """Record processes, keyed by their IDs elsewhere, and which of them wrote each inode version.
+
+    Each process gets a new ID (see put_process), and inode_version_writes is remapped to match;
+    writes by processes not in processes are dropped.
+    Processes in stored_process_ids are already recorded here under the same ID, so they are neither recorded again nor remapped.
+    Returns the ID here of each process.
+    """
+    process_ids = {
+        process_id: process_id if process_id in stored_process_ids else put_process(session, process)
+        for process_id, process in processes.items()
+    }
+    put_writes(session, {
+        inode_version: process_ids.get(process_id) if process_id is not None else None
+        for inode_version, process_id in inode_version_writes.items()
+    })
+    return process_ids
+
+
+def get_process(session: sqlalchemy.orm.Session, process_id: int) -> Process | None:
+    row = session.get(db.Process, process_id)
+    if row is None:
+        return None
+    inputs = session.scalars(sqlalchemy.select(db.ProcessInputs).where(db.ProcessInputs.process_id == process_id))
+    outputs = session.scalars(sqlalchemy.select(db.ProcessThatWrites).where(db.ProcessThatWrites.process_id == process_id))
+    metadatas = [
+        (metadata.output, InodeMetadata(
+            Inode(metadata.host, metadata.device_major, metadata.device_minor, metadata.inode),
+            metadata.mode,
+            metadata.nlink,
+            metadata.uid,
+            metadata.gid,
+        ))
+        for metadata in session.scalars(
+            sqlalchemy.select(db.ProcessInodeMetadata).where(db.ProcessInodeMetadata.process_id == process_id)
+        )
+    ]
+    return Process(
+        frozenset(_inode_version_of_row(input) for input in inputs),
+        frozenset(metadata for output, metadata in metadatas if not output),
+        frozenset(_inode_version_of_row(output) for output in outputs),
+        frozenset(metadata for output, metadata in metadatas if output),
+        row.time,
+        tuple(shlex.split(row.cmd)),
+        row.process_id,
+        tuple((key, value) for key, value in row.env),
+        pathlib.Path(row.wd),
+    )
+
+
+def get_process_rows(session: sqlalchemy.orm.Session, process_ids: typing.Iterable[int]) -> list[db.Process]:
+    """The rows of process_ids, without their inputs and outputs, in a few queries rather than a few per process."""
+    rows = list[db.Process]()
+    # Stay under SQLite's limit on the number of parameters
+    for batch in itertools.batched(process_ids, 10_000):
+        rows.extend(session.scalars(sqlalchemy.select(db.Process).where(db.Process.process_id.in_(batch))))
+    return rows
+
+
+def get_writer(session: sqlalchemy.orm.Session, inode_version: InodeVersion) -> int | None:
+    """The ID of the process which wrote inode_version, if we know of one."""
+    return session.scalar(
+        sqlalchemy.select(db.ProcessThatWrites.process_id)
+        .filter_by(**_inode_version_columns(inode_version))
+    )
+
+
+def get_writers(inode_versions: typing.Sequence[InodeVersion], probe_home: pathlib.Path = PROBE_HOME) -> list[int | None]:
+    """The ID of the process which wrote each of inode_versions, if we know of one.
+
+    Only the inode versions which the writer filter can't rule out are looked up in the database.
+    """
+    keys = [_inode_version_key(inode_version) for inode_version in inode_versions]
+    if _has_directory_layout(probe_home):
+        # Importing it adds its writers to the filter
+        with open_store(probe_home):
+            pass
+    try:
+        writer_filter = bloom_filter.BloomFilter.load(probe_home / WRITER_FILTER_PATH.name)
+    except (OSError, ValueError):
+        if not (probe_home / DATABASE_PATH.name).exists():
+            return [None] * len(keys)
+        # Saving a rebuilt filter here, without the write lock, could overwrite writers another process adds meanwhile;
+        # the next transaction which adds writers rebuilds it instead.
+        with open_store(probe_home) as session:
+            return [get_writer(session, inode_version) for inode_version in inode_versions]
+    might_have_writer = writer_filter.might_contain([_filter_item(key) for key in keys])
+    writers: list[int | None] = [None] * len(keys)
+    if might_have_writer.any():
+        with open_store(probe_home) as session:
+            for index in might_have_writer.nonzero()[0].tolist():
+                writers[index] = get_writer(session, inode_versions[index])
+    return writers
+
+
+def migrate_directory_layout(
+        engine: sqlalchemy.Engine,
+        probe_home: pathlib.Path = PROBE_HOME,
+        keep: bool = False,
+) -> tuple[int, int]:
+    """Import the provenance in the directory layout under probe_home into the database.
+
+    Returns how many processes and inode version writes were imported.
+    The imported files are deleted after the import commits, unless keep.
+    """
+    processes_dir = probe_home / PROCESSES_BY_ID.name
+    writes_dir = probe_home / PROCESS_ID_THAT_WROTE_INODE_VERSION.name
+    process_paths = sorted(processes_dir.iterdir()) if processes_dir.exists() else []
+    write_paths = sorted(writes_dir.iterdir()) if writes_dir.exists() else []
+
+    processes = dict[int, Process]()
+    for path in process_paths:
+        try:
+            process = Process.from_dict(json.loads(path.read_text()))
+        except (ValueError, KeyError, TypeError) as exc:
+            warnings.warn(f"Dropping unreadable process record {path}: {exc}")
+        else:
+            processes[process.pid] = process
+
+    with sqlalchemy.orm.Session(engine) as session, session.begin():
+        # The file names only have the InodeVersion.str_id(), which loses most of the host name;
+        # the full InodeVersion comes from the process that wrote it.
+        inode_version_writes = dict[InodeVersion, int | None]()
+        for path in write_paths:
+            str_id = path.name.removesuffix(".json")
+            try:
+                process_id = json.loads(path.read_text())
+            except ValueError as exc:
+                warnings.warn(f"Dropping unreadable write record {path}: {exc}")
+                continue
+            if process_id is None:
+                continue
+            # The process IDs are those of the host that wrote the files, so only processes imported with them can be looked up
+            process_or_none = processes.get(process_id)
+            matches = [
+                inode_version
+                for inode_version in (process_or_none.output_inodes if process_or_none else ())
+                if inode_version.str_id() == str_id
+            ]
+            if matches:
+                inode_version_writes[matches[0]] = process_id
+            else:
+                warnings.warn(f"Dropping {path}: process {process_id} has no record of writing {str_id}")
+        put_provenance(session, processes, inode_version_writes)
+        _save_writer_filter(session)
+
+    if not keep:
+        for path in [*process_paths, *write_paths]:
+            path.unlink(missing_ok=True)
+        for directory in [processes_dir, writes_dir]:
+            # Something may have been written there since we listed it
+            with contextlib.suppress(OSError):
+                directory.rmdir()
+    return len(processes), len(inode_version_writes)
+
+
+@dataclasses.dataclass(frozen=True)
+class IngestStats:
+    processes: int
+    inputs: int
+    writes: int
+    # Inode versions whose writer was already recorded, e.g., by ingesting the same PROBE log before
+    duplicate_writes: int
+    # Exec epochs which were already recorded, along with their inputs and writes
+    duplicate_processes: int
+
+    @property
+    def rows(self) -> int:
+        return self.processes + self.inputs + self.writes
+
+
+def ingest_probe_log(session: sqlalchemy.orm.Session, probe_log: ptypes.ProbeLog, hbg: ptypes.HbGraph) -> IngestStats:
+    """Record each exec epoch of probe_log as a process, with the regular files it read and wrote.
+
+    Rows are inserted a table at a time, so ingesting a PROBE log costs a handful of statements rather than a few per access.
+
+    libprobe records the version of an inode when it is opened, so the version an exec epoch wrote is the version the next reader opened,
+    or, if nothing in probe_log read it after, the version on disk now, if that is still the same inode.
+    """
+    node_name = get_local_node_name()
+
+    def persistent_inode_version(inode: ops.Inode) -> InodeVersion:
+        return InodeVersion(
+            Inode(node_name, inode.device_major, inode.device_minor, inode.number),
+            inode.mtime.tv_sec * 1_000_000_000 + inode.mtime.tv_nsec,
+            inode.size,
+        )
+
+    init_epochs = dict[ptypes.ExecPair, ops.InitExecEpoch]()
+    parents = dict[ptypes.ExecPair, ptypes.ExecPair]()
+    for quad, op in probe_log.ops():
+        match op.data:
+            case ops.InitExecEpoch():
+                init_epochs[quad.exec_pair()] = op.data
+                if quad.exec_no != ptypes.initial_exec_no:
+                    parents[quad.exec_pair()] = ptypes.ExecPair(quad.pid, quad.exec_no.prev())
+            case ops.Clone():
+                if op.ferrno == 0 and op.data.task_type == ops.TaskType.PID:
+                    parents[ptypes.ExecPair(ptypes.Pid(op.data.task_id), ptypes.initial_exec_no)] = quad.exec_pair()
+            case ops.Spawn():
+                if op.ferrno == 0:
+                    parents[ptypes.ExecPair(ptypes.Pid(op.data.child_pid), ptypes.initial_exec_no)] = quad.exec_pair()
+
+    inputs = collections.defaultdict[ptypes.ExecPair, dict[InodeVersion, pathlib.Path]](dict)
+    outputs = collections.defaultdict[ptypes.ExecPair, dict[InodeVersion, pathlib.Path]](dict)
+    # Who last finished writing each inode, and through what path
+    last_writers = dict[ptypes.Inode, tuple[ptypes.ExecPair, pathlib.Path]]()
+    for access in hb_graph_accesses.hb_graph_to_accesses(probe_log, hbg):
+        if not isinstance(access, ptypes.Access) or not stat.S_ISREG(access.inode.mode):
+            continue
+        exec_pair = access.op_node.exec_pair()
+        if access.phase == ptypes.Phase.BEGIN and access.mode.is_read:
+            op_data = probe_log.get_op(access.op_node).data
+            assert isinstance(op_data, ops.Open | ops.Exec)
+            inode_version = persistent_inode_version(op_data.inode)
+            if last_writer := last_writers.pop(access.inode, None):
+                outputs[last_writer[0]].setdefault(inode_version, last_writer[1])
+            inputs[exec_pair].setdefault(inode_version, access.path)
+        elif access.phase == ptypes.Phase.END and access.mode.is_write:
+            last_writers[access.inode] = (exec_pair, access.path)
+    for inode, (exec_pair, path) in last_writers.items():
+        try:
+            stat_result = path.stat()
+        except OSError:
+            continue
+        if (os.major(stat_result.st_dev), os.minor(stat_result.st_dev), stat_result.st_ino) == (inode.device.major_id, inode.device.minor_id, inode.number):
+            outputs[exec_pair].setdefault(InodeVersion.from_local_path(path, stat_result), path)
+
+    def start_time(exec_pair: ptypes.ExecPair) -> datetime.datetime:
+        time = init_epochs[exec_pair].resources.time
+        return datetime.datetime.fromtimestamp(time.tv_sec + time.tv_nsec / 1e9)
+
+    # Exec epochs ingested before, e.g., from an earlier ingest of the same PROBE log, keep their rows
+    ingested = dict[ptypes.ExecPair, int]()
+    for batch in itertools.batched({exec_pair.pid for exec_pair in init_epochs}, 10_000):
+        for process_id, pid, exec_no, time in session.execute(
+                sqlalchemy.select(db.Process.process_id, db.Process.pid, db.Process.exec_no, db.Process.time)
+                .where(db.Process.host == node_name, db.Process.pid.in_(batch))
+        ):
+            # Only ingested processes have a host
+            assert pid is not None and exec_no is not None
+            exec_pair = ptypes.ExecPair(ptypes.Pid(pid), ptypes.ExecNo(exec_no))
+            if exec_pair in init_epochs and start_time(exec_pair) == time:
+                ingested[exec_pair] = process_id
+
+    exec_pairs = sorted(init_epochs.keys() - ingested)
+    if not exec_pairs:
+        return IngestStats(0, 0, 0, 0, len(ingested))
+    _changed(session)
+    process_ids = dict(zip(exec_pairs, session.scalars(
+        sqlalchemy.insert(db.Process).returning(db.Process.process_id, sort_by_parameter_order=True),
+        [
+            {
+                "parent_process_id": None,
+                "cmd": shlex.join(arg.decode(errors="surrogateescape") for arg in init_epochs[exec_pair].argv),
+                "time": start_time(exec_pair),
+                "env": [
+                    list(env_item.decode(errors="surrogateescape").partition("=")[::2])
+                    for env_item in init_epochs[exec_pair].env
+                ],
+                # libprobe does not record the working directory
+                "wd": "",
+                "host": node_name,
+                "pid": exec_pair.pid,
+                "exec_no": exec_pair.exec_no,
+            }
+            for exec_pair in exec_pairs
+        ],
+    ).all()))
+
+    # A new exec epoch may have been forked from one ingested before
+    parent_process_ids = ingested | process_ids
+    parent_rows = [
+        {"process_id": process_ids[child], "parent_process_id": parent_process_ids[parent]}
+        for child, parent in parents.items()
+        if child in process_ids and parent in parent_process_ids
+    ]
+    if parent_rows:
+        session.execute(sqlalchemy.update(db.Process), parent_rows)
+
+    input_rows = [
+        {**_inode_version_columns(inode_version), "path": str(path), "process_id": process_ids[exec_pair]}
+        for exec_pair, exec_inputs in inputs.items()
+        if exec_pair in process_ids
+        for inode_version, path in exec_inputs.items()
+    ]
+    if input_rows:
+        session.execute(sqlalchemy.insert(db.ProcessInputs), input_rows)
+
+    write_rows = [
+        {**_inode_version_columns(inode_version), "path": str(path), "process_id": process_ids[exec_pair]}
+        for exec_pair, exec_outputs in outputs.items()
+        if exec_pair in process_ids
+        for inode_version, path in exec_outputs.items()
+    ]
+    n_writes = 0
+    if write_rows:
+        # Through the table rather than the mapped class, so this is a plain executemany which reports its rowcount
+        result = session.execute(
+            sqlalchemy.dialects.sqlite.insert(
+                typing.cast(sqlalchemy.Table, db.ProcessThatWrites.__table__)
+            ).on_conflict_do_nothing(index_elements=_INODE_VERSION_COLUMNS),
+            write_rows,
+        )
+        n_writes = typing.cast(sqlalchemy.CursorResult[typing.Any], result).rowcount
+        _add_to_writer_filter(session, [
+            typing.cast(_InodeVersionKey, tuple(row[column] for column in _INODE_VERSION_COLUMNS))
+            for row in write_rows
+        ])
+
+    return IngestStats(len(process_ids), len(input_rows), n_writes, len(write_rows) - n_writes, len(ingested))
+
+
+@dataclasses.dataclass(frozen=True)
+class Lineage:
+    # IDs of the processes in the persistent provenance database
+    processes: frozenset[int]
+    inode_versions: frozenset[InodeVersion]
+
+
+class LineageGraph:
+    """The dataflow DAG of the persistent provenance database, held in memory to traverse it without going back to the database for each hop.
+
+    Get one from lineage_graph(), which reloads it when the database has changed.
+    Traversals from an inode version are memoized, and a reload starts from a new LineageGraph, so they can't go stale.
+    """
+
+    def __init__(self, session: sqlalchemy.orm.Session) -> None:
+        self.generation = _generation(session)
+        self.writer = dict[_InodeVersionKey, int]()
+        self.outputs = collections.defaultdict[int, list[_InodeVersionKey]](list)
+        self.inputs = collections.defaultdict[int, list[_InodeVersionKey]](list)
+        self.readers = collections.defaultdict[_InodeVersionKey, list[int]](list)
+        self.paths = dict[_InodeVersionKey, str]()
+        columns = [getattr(db.ProcessThatWrites, column) for column in _INODE_VERSION_COLUMNS]
+        for process_id, path, *key_columns in session.execute(
+                sqlalchemy.select(db.ProcessThatWrites.process_id, db.ProcessThatWrites.path, *columns)
+        ):
+            key = typing.cast(_InodeVersionKey, tuple(key_columns))
+            self.writer[key] = process_id
+            self.outputs[process_id].append(key)
+            if path is not None:
+                self.paths[key] = path
+        columns = [getattr(db.ProcessInputs, column) for column in _INODE_VERSION_COLUMNS]
+        for process_id, path, *key_columns in session.execute(
+                sqlalchemy.select(db.ProcessInputs.process_id, db.ProcessInputs.path, *columns)
+        ):
+            key = typing.cast(_InodeVersionKey, tuple(key_columns))
+            self.inputs[process_id].append(key)
+            self.readers[key].append(process_id)
+            if path is not None:
+                self.paths.setdefault(key, path)
+        self._upstream = dict[_InodeVersionKey, tuple[frozenset[int], frozenset[_InodeVersionKey]]]()
+        self._downstream = dict[_InodeVersionKey, tuple[frozenset[int], frozenset[_InodeVersionKey]]]()
+
+    def _closure(
+            self,
+            root: _InodeVersionKey,
+            memo: dict[_InodeVersionKey, tuple[frozenset[int], frozenset[_InodeVersionKey]]],
+            next_processes: typing.Callable[[_InodeVersionKey], typing.Iterable[int]],
+            next_inode_versions: typing.Callable[[int], typing.Iterable[_InodeVersionKey]],
+    ) -> tuple[frozenset[int], frozenset[_InodeVersionKey]]:
+        if root not in memo:
+            processes = set[int]()
+            inode_versions = {root}
+            queue = [root]
+            while queue:
+                inode_version = queue.pop()
+                if inode_version != root and inode_version in memo:
+                    # Already traversed from an earlier root
+                    memo_processes, memo_inode_versions = memo[inode_version]
+                    processes |= memo_processes
+                    inode_versions |= memo_inode_versions
+                    continue
+                for process in next_processes(inode_version):
+                    if process not in processes:
+                        processes.add(process)
+                        for next_inode_version in next_inode_versions(process):
+                            if next_inode_version not in inode_versions:
+                                inode_versions.add(next_inode_version)
+                                queue.append(next_inode_version)
+            memo[root] = (frozenset(processes), frozenset(inode_versions))
+        return memo[root]
+
+    def upstream_keys(self, root: _InodeVersionKey) -> tuple[frozenset[int], frozenset[_InodeVersionKey]]:
+        return self._closure(
+            root,
+            self._upstream,
+            lambda inode_version: [self.writer[inode_version]] if inode_version in self.writer else [],
+            lambda process: self.inputs.get(process, []),
+        )
+
+    def downstream_keys(self, root: _InodeVersionKey) -> tuple[frozenset[int], frozenset[_InodeVersionKey]]:
+        return self._closure(
+            root,
+            self._downstream,
+            lambda inode_version: self.readers.get(inode_version, []),
+            lambda process: self.outputs.get(process, []),
+        )
+
+    def upstream_processes(self, roots: typing.Iterable[_InodeVersionKey]) -> set[int]:
+        """The processes any of roots were derived from, in one traversal from all of them.
+
+        Unlike upstream_keys, nothing is memoized per root, so this is linear in the size of the graph however many roots there are.
+        """
+        processes = set[int]()
+        inode_versions = set(roots)
+        queue = list(inode_versions)
+        while queue:
+            process = self.writer.get(queue.pop())
+            if process is not None and process not in processes:
+                processes.add(process)
+                for inode_version in self.inputs.get(process, []):
+                    if inode_version not in inode_versions:
+                        inode_versions.add(inode_version)
+                        queue.append(inode_version)
+        return processes
+
+    def upstream(self, roots: typing.Iterable[InodeVersion]) -> Lineage:
+        """The processes and inode versions that roots were derived from, and roots themselves."""
+        return self._lineage(self.upstream_keys(_inode_version_key(root)) for root in roots)
+
+    def downstream(self, roots: typing.Iterable[InodeVersion]) -> Lineage:
+        """The processes and inode versions derived from roots, and roots themselves."""
+        return self._lineage(self.downstream_keys(_inode_version_key(root)) for root in roots)
+
+    def _lineage(self, closures: typing.Iterable[tuple[frozenset[int], frozenset[_InodeVersionKey]]]) -> Lineage:
+        processes = set[int]()
+        inode_versions = set[_InodeVersionKey]()
+        for closure_processes, closure_inode_versions in closures:
+            processes |= closure_processes
+            inode_versions |= closure_inode_versions
+        return Lineage(frozenset(processes), frozenset(map(_inode_version_of_key, inode_versions)))
+
+    def path(self, inode_version: InodeVersion) -> str | None:
+        """A path inode_version was accessed through, if any was recorded."""
+        return self.paths.get(_inode_version_key(inode_version))
+
+
+def _generation(session: sqlalchemy.orm.Session) -> int:
+    return session.scalar(sqlalchemy.select(db.Generation.value)) or 0
+
+
+_lineage_graphs = dict[str, LineageGraph]()
+
+
+def lineage_graph(session: sqlalchemy.orm.Session) -> LineageGraph:
+    """The LineageGraph of the database session is on, loaded only if it changed since the last call."""
+    database = str(session.get_bind().engine.url)
+    graph = _lineage_graphs.get(database)
+    if graph is None or graph.generation != _generation(session):
+        graph = LineageGraph(session)
+        _lineage_graphs[database] = graph
+    return graph
+
 
 # TODO: implement this for remote host
 def get_prov_upstream(
@@ -184,25 +880,125 @@ def get_prov_upstream(
     """
     if host != "local":
         raise NotImplementedError("scp where source is remote is not implemented, because it would be hard to copy the remote prov")
-    inode_version_queue = list[InodeVersion]()
-    inode_version_queue.extend(root_inode_version)
-
-    # Stuff we need to transfer
-    inode_version_writes = dict[InodeVersion, int | None]()
-    process_closure = dict[int, Process]()
-
-    while inode_version_queue:
-        inode_version = inode_version_queue.pop()
-        if inode_version not in inode_version_writes:
-            process_id_path = PROCESS_ID_THAT_WROTE_INODE_VERSION / inode_version.str_id()
-            if process_id_path.exists():
-                process_id = json.loads(process_id_path.read_text())
-                inode_version_writes[inode_version] = process_id
-                if process_id not in process_closure:
-                    process_path = PROCESSES_BY_ID / str(process_id)
-                    assert process_path.exists()
-                    process = json.loads(process_path.read_text())
-                    process_closure[process_id] = process
-            else:
-                inode_version_writes[inode_version] = None
+
+    # Usually most of the files have no recorded writer, so the filter saves loading the whole graph
+    writers = get_writers(root_inode_version)
+    if all(writer is None for writer in writers):
+        return {}, dict.fromkeys(root_inode_version)
+
+    with open_store() as session:
+        graph = lineage_graph(session)
+        lineage = graph.upstream(root_inode_version)
+        # Stuff we need to transfer
+        inode_version_writes = {
+            inode_version: graph.writer.get(_inode_version_key(inode_version))
+            for inode_version in lineage.inode_versions
+        }
+        process_closure = dict[int, Process]()
+        for process_id in lineage.processes:
+            process = get_process(session, process_id)
+            assert process is not None
+            process_closure[process_id] = process
     return process_closure, inode_version_writes
+
+
+# Saves of the writer filter write a temporary file first, so only old ones are abandoned
+_STALE_TMP_AGE = 24 * 60 * 60
+
+
+@dataclasses.dataclass(frozen=True)
+class GcStats:
+    processes_dropped: int
+    rows_dropped: int
+    bytes_before: int
+    bytes_after: int
+
+
+def _is_current(key: _InodeVersionKey, path: str | None, node_name: str, stat_cache: dict[str, os.stat_result | None]) -> bool:
+    """Whether the inode version is known to still be on disk."""
+    host, device_major, device_minor, inode, mtime_sec, mtime_nsec, size = key
+    if host != node_name or path is None or not os.path.isabs(path):
+        # We can't tell, so it is kept only as long as the retention period keeps its writer
+        return False
+    if path not in stat_cache:
+        try:
+            stat_cache[path] = os.stat(path)
+        except OSError:
+            stat_cache[path] = None
+    stat_result = stat_cache[path]
+    return stat_result is not None and (
+        os.major(stat_result.st_dev), os.minor(stat_result.st_dev), stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+    ) == (device_major, device_minor, inode, mtime_sec * 1_000_000_000 + mtime_nsec, size)
+
+
+def gc(retention: datetime.timedelta, probe_home: pathlib.Path = PROBE_HOME, dry_run: bool = False) -> GcStats:
+    """Drop the processes which no retained file or process was derived from, and compact the database.
+
+    The retained processes are those that ran within retention, and those that wrote inode versions which may still exist.
+    Since provenance is only useful whole, whatever a retained process was derived from is retained too.
+    Whether an inode version still exists can only be checked for files on this host whose absolute path was recorded;
+    others (e.g., from scp, uploads, or the directory layout) are retained only by the retention period.
+    """
+    database_path = probe_home / DATABASE_PATH.name
+    engine = db.get_engine(database_path)
+
+    def database_size() -> int:
+        return sum(
+            path.stat().st_size
+            for path in [database_path, database_path.with_name(database_path.name + "-wal")]
+            if path.exists()
+        )
+
+    bytes_before = database_size()
+    node_name = get_local_node_name()
+    with open_store(probe_home) as session:
+        graph = LineageGraph(session)
+        cutoff = datetime.datetime.now() - retention
+        retained = set(session.scalars(sqlalchemy.select(db.Process.process_id).where(db.Process.time >= cutoff)))
+        stat_cache = dict[str, os.stat_result | None]()
+        roots = [
+            key
+            for key in itertools.chain(graph.writer, graph.readers)
+            if _is_current(key, graph.paths.get(key), node_name, stat_cache)
+        ]
+        roots.extend(key for process in list(retained) for key in graph.inputs.get(process, []))
+        retained |= graph.upstream_processes(roots)
+
+        session.execute(sqlalchemy.text("DROP TABLE IF EXISTS temp.gc_retained"))
+        session.execute(sqlalchemy.text("CREATE TEMP TABLE gc_retained (process_id INTEGER PRIMARY KEY)"))
+        if retained:
+            session.execute(
+                sqlalchemy.text("INSERT INTO gc_retained (process_id) VALUES (:process_id)"),
+                [{"process_id": process_id} for process_id in retained],
+            )
+        tables = [db.Process, db.ProcessInputs, db.ProcessThatWrites, db.ProcessInodeMetadata]
+        (processes_dropped,) = session.execute(sqlalchemy.text(
+            "SELECT COUNT(*) FROM process WHERE process_id NOT IN (SELECT process_id FROM gc_retained)"
+        )).one()
+        rows_dropped = 0
+        for table in tables:
+            (count,) = session.execute(sqlalchemy.text(
+                f"SELECT COUNT(*) FROM {table.__tablename__} WHERE process_id NOT IN (SELECT process_id FROM gc_retained)"
+            )).one()
+            rows_dropped += count
+            if count and not dry_run:
+                session.execute(sqlalchemy.text(
+                    f"DELETE FROM {table.__tablename__} WHERE process_id NOT IN (SELECT process_id FROM gc_retained)"
+                ))
+        session.execute(sqlalchemy.text("DROP TABLE temp.gc_retained"))
+        if rows_dropped and not dry_run:
+            _changed(session)
+            # A Bloom filter can't forget, so start over without the dropped writers
+            _rebuild_writer_filter(session)
+
+    if not dry_run:
+        # VACUUM can't run in a transaction
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+            connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+            connection.exec_driver_sql("PRAGMA optimize")
+        for tmp in probe_home.glob(f".{WRITER_FILTER_PATH.name}.*"):
+            if time.time() - tmp.stat().st_mtime > _STALE_TMP_AGE:
+                tmp.unlink(missing_ok=True)
+
+    return GcStats(processes_dropped, rows_dropped, bytes_before, database_size())
@@ -1,24 +1,54 @@
-from sqlalchemy import create_engine, DateTime
+import sqlite3
+from sqlalchemy import create_engine, event, DateTime, Index, JSON
 from sqlalchemy.orm import DeclarativeBase, mapped_column, Mapped
 from sqlalchemy.engine import Engine
 import xdg_base_dirs
 import pathlib
+import typing
 from datetime import datetime
 
+
+DATABASE_PATH = xdg_base_dirs.xdg_data_home() / "PROBE" / "provenance.db"
+
+
+# How long to wait for another writer to release the database
+_LOCK_TIMEOUT = 600.0
+
+
+# The defaults are very conservative (see the note in persistent_provenance.py).
+# WAL lets readers proceed while a writer commits, and with WAL, synchronous=NORMAL is still crash-safe;
+# it only risks losing the last transactions on power loss.
+_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    # Negative means KiB, so 64 MiB
+    "cache_size": -64 * 1024,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+
 class Base(DeclarativeBase):
     pass
 
-_engine: Engine | None = None
-def get_engine() -> Engine:
-    global _engine
-    if _engine is None:
-        home = pathlib.Path(xdg_base_dirs.xdg_data_home())
-        home.mkdir(parents=True, exist_ok=True)
-        database_path = home / "probe_log.db"
 
-        _engine = create_engine(f'sqlite:///{database_path}', echo=True)
-        Base.metadata.create_all(_engine)
-    return _engine
+_engines: dict[pathlib.Path, Engine] = {}
+def get_engine(database_path: pathlib.Path = DATABASE_PATH) -> Engine:
+    if database_path not in _engines:
+        database_path.parent.mkdir(parents=True, exist_ok=True)
+        engine = create_engine(f'sqlite:///{database_path}', connect_args={"timeout": _LOCK_TIMEOUT})
+        event.listen(engine, "connect", _tune_connection)
+        Base.metadata.create_all(engine)
+        _engines[database_path] = engine
+    return _engines[database_path]
+
+
+def _tune_connection(dbapi_connection: sqlite3.Connection, _connection_record: typing.Any) -> None:
+    cursor = dbapi_connection.cursor()
+    for pragma, value in _PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
 
 class ProcessThatWrites(Base):
     __tablename__ = 'process_that_writes'
@@ -28,20 +58,42 @@ class ProcessThatWrites(Base):
     process_id: Mapped[int]
     device_major: Mapped[int]
     device_minor: Mapped[int]
-    host: Mapped[int]
-    path: Mapped[str]
+    host: Mapped[str]
+    path: Mapped[str | None]
     mtime_sec: Mapped[int]
     mtime_nsec: Mapped[int]
     size: Mapped[int]
 
+    __table_args__ = (
+        # An inode version has one writer; this is the index upstream lookups probe
+        Index(
+            "process_that_writes_by_inode_version",
+            "host", "device_major", "device_minor", "inode", "mtime_sec", "mtime_nsec", "size",
+            unique=True,
+        ),
+        Index("process_that_writes_by_process", "process_id"),
+    )
+
 
 class Process(Base):
     __tablename__ = 'process'
 
     process_id: Mapped[int] = mapped_column(primary_key=True)
-    parent_process_id: Mapped[int]
+    parent_process_id: Mapped[int | None]
     cmd: Mapped[str]
     time: Mapped[datetime] = mapped_column(DateTime)
+    env: Mapped[list[tuple[str, str]]] = mapped_column(JSON)
+    wd: Mapped[str]
+    # The exec epoch this process was ingested from (see persistent_provenance.ingest_probe_log);
+    # None for processes recorded some other way.
+    host: Mapped[str | None]
+    pid: Mapped[int | None]
+    exec_no: Mapped[int | None]
+
+    __table_args__ = (
+        # So ingesting the same PROBE log again doesn't record its exec epochs again
+        Index("process_by_exec_epoch", "host", "pid", "exec_no", "time", unique=True),
+    )
 
 
 class ProcessInputs(Base):
@@ -52,8 +104,46 @@ class ProcessInputs(Base):
     process_id: Mapped[int]
     device_major: Mapped[int]
     device_minor: Mapped[int]
-    host: Mapped[int]
-    path: Mapped[str]
+    host: Mapped[str]
+    path: Mapped[str | None]
     mtime_sec: Mapped[int]
     mtime_nsec: Mapped[int]
     size: Mapped[int]
+
+    __table_args__ = (
+        Index("process_inputs_by_process", "process_id"),
+        # For downstream queries: who read this inode version?
+        Index(
+            "process_inputs_by_inode_version",
+            "host", "device_major", "device_minor", "inode", "mtime_sec", "mtime_nsec", "size",
+        ),
+    )
+
+
+class ProcessInodeMetadata(Base):
+    __tablename__ = 'process_inode_metadata'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    process_id: Mapped[int]
+    # Whether this is the metadata of an output (rather than an input) of the process
+    output: Mapped[bool]
+    host: Mapped[str]
+    device_major: Mapped[int]
+    device_minor: Mapped[int]
+    inode: Mapped[int]
+    mode: Mapped[int]
+    nlink: Mapped[int]
+    uid: Mapped[int]
+    gid: Mapped[int]
+
+    __table_args__ = (
+        Index("process_inode_metadata_by_process", "process_id"),
+    )
+
+
+class Generation(Base):
+    """Counts the changes to the other tables, so in-memory copies of them (see persistent_provenance.LineageGraph) know when to reload."""
+    __tablename__ = 'generation'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    value: Mapped[int]
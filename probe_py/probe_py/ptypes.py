@@ -162,6 +162,9 @@ class InodeVersion:
 class KernelThread:
     tid: Tid
     ops: typing.Sequence[ops.Op]
+    # Ops libprobe discarded to stay within `probe record --max-size`.
+    # Process ops are never discarded, so the HB graph is complete, but the file accesses are not.
+    n_dropped_ops: int = 0
 
 
 @dataclasses.dataclass(frozen=True)
@@ -254,6 +257,17 @@ class ProbeLog:
                     for op_no, op in enumerate(thread.ops):
                         yield OpQuad(pid, epoch, tid, op_no), op
 
+    def records_file_descriptors(self) -> bool:
+        """Whether the Open, Close, and Dup ops which establish open numbers are all in this log.
+
+        They are not with `probe record --summary` (which aggregates Opens into AccessSummary ops) or `probe record --ops` without file-io.
+        Analyses which follow file descriptors, such as hb_graph_accesses, cannot resolve the open numbers in Exec or PathArg.directory without them.
+        """
+        return (
+            not self.process_tree_context.summary
+            and bool(self.process_tree_context.recorded_op_categories & (1 << consts.OP_CATEGORY_FILE_IO))
+        )
+
     def get_root_pid(self) -> Pid:
         for quad, op in self.ops():
             match op.data:
@@ -274,6 +288,56 @@ class ProbeLog:
                         parent_pid_map[Pid(op.data.child_pid)] = quad.pid
         return parent_pid_map
 
+    def access_summaries(self) -> typing.Mapping[tuple[Pid, Inode], AccessSummary]:
+        """Per-(process, inode) accesses recorded by `probe record --summary`.
+
+        libprobe may flush several summaries for the same inode (at each exec and flush interval); these are merged.
+        """
+        summaries = dict[tuple[Pid, Inode], AccessSummary]()
+        for quad, op in self.ops():
+            if isinstance(op.data, ops.AccessSummary):
+                summary = AccessSummary.from_ops_access_summary(op.data)
+                key = (quad.pid, summary.inode_version.inode)
+                summaries[key] = summaries[key].merge(summary) if key in summaries else summary
+        return summaries
+
+    def exec_resource_usage(self) -> typing.Mapping[ExecPair, ResourceUsage]:
+        """What each exec epoch used, e.g., to weight processes by their cost.
+
+        An exec epoch runs from its InitExecEpoch to its ExitProcess, or to the InitExecEpoch of the next epoch if it exec-ed.
+        Epochs whose end was not recorded (e.g., the process was killed or called _exit) are left out.
+        """
+        starts = dict[ExecPair, ops.ResourceSample]()
+        stops = dict[ExecPair, ops.ResourceSample]()
+        for quad, op in self.ops():
+            match op.data:
+                case ops.InitExecEpoch():
+                    starts[quad.exec_pair()] = op.data.resources
+                    if quad.exec_no != initial_exec_no:
+                        stops.setdefault(ExecPair(quad.pid, quad.exec_no.prev()), op.data.resources)
+                case ops.ExitProcess():
+                    stops[quad.exec_pair()] = op.data.resources
+        return {
+            exec_pair: ResourceUsage.between(starts[exec_pair], stop)
+            for exec_pair, stop in stops.items()
+            if exec_pair in starts and stop != UNSAMPLED_RESOURCES
+        }
+
+    def thread_resource_usage(self) -> typing.Mapping[ThreadTriple, ResourceUsage]:
+        """What each thread used, from its InitThread to its ExitThread.
+
+        Threads which did not end in an ExitThread of their own (e.g., main threads, which end with their exec epoch) are left out.
+        """
+        usage = dict[ThreadTriple, ResourceUsage]()
+        for pid, process in self.processes.items():
+            for exec_no, exec in process.execs.items():
+                for tid, thread in exec.threads.items():
+                    init_threads = [op.data for op in thread.ops if isinstance(op.data, ops.InitThread)]
+                    exit_thread = thread.ops[-1].data
+                    if init_threads and isinstance(exit_thread, ops.ExitThread) and exit_thread.resources != UNSAMPLED_RESOURCES:
+                        usage[ThreadTriple(pid, exec_no, tid)] = ResourceUsage.between(init_threads[0].resources, exit_thread.resources)
+        return usage
+
     def n_ops(self) -> int:
         total = 0
         for pid, process in sorted(self.processes.items()):
@@ -282,6 +346,109 @@ class ProbeLog:
                     total += len(thread.ops)
         return total
 
+    def n_dropped_ops(self) -> int:
+        return sum(
+            thread.n_dropped_ops
+            for process in self.processes.values()
+            for exec in process.execs.values()
+            for thread in exec.threads.values()
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class AccessSummary:
+    inode_version: InodeVersion
+    first_access: numpy.datetime64
+    last_access: numpy.datetime64
+    n_reads: int
+    n_writes: int
+    n_truncates: int
+    n_stats: int
+    open_flags: int
+
+    @staticmethod
+    def from_ops_access_summary(summary: ops.AccessSummary) -> AccessSummary:
+        return AccessSummary(
+            InodeVersion.from_ops_inode(summary.inode),
+            numpy.datetime64(summary.first_access.tv_sec * int(1e9) + summary.first_access.tv_nsec, "ns"),
+            numpy.datetime64(summary.last_access.tv_sec * int(1e9) + summary.last_access.tv_nsec, "ns"),
+            summary.n_reads,
+            summary.n_writes,
+            summary.n_truncates,
+            summary.n_stats,
+            summary.open_flags,
+        )
+
+    def merge(self, other: AccessSummary) -> AccessSummary:
+        """Combine two summaries of the same inode; the inode version is taken from the later one."""
+        later = self if self.last_access >= other.last_access else other
+        return AccessSummary(
+            later.inode_version,
+            min(self.first_access, other.first_access),
+            later.last_access,
+            self.n_reads + other.n_reads,
+            self.n_writes + other.n_writes,
+            self.n_truncates + other.n_truncates,
+            self.n_stats + other.n_stats,
+            self.open_flags | other.open_flags,
+        )
+
+    @property
+    def access_modes(self) -> frozenset[AccessMode]:
+        modes = set[AccessMode]()
+        if self.n_reads:
+            modes.add(AccessMode.READ)
+        if self.n_truncates:
+            modes.add(AccessMode.TRUNCATE_WRITE)
+        if self.n_writes > self.n_truncates:
+            modes.add(AccessMode.WRITE)
+        return frozenset(modes)
+
+
+# Stands in for the samples of ops which libprobe did not record, but the parser made up (see parser.parse_probe_log_ctx)
+UNSAMPLED_RESOURCES: typing.Final = ops.ResourceSample(
+    time=ops.StatxTimestamp(tv_sec=0, tv_nsec=0),
+    user_cpu_us=0,
+    system_cpu_us=0,
+    max_rss_kib=0,
+    blocks_in=0,
+    blocks_out=0,
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class ResourceUsage:
+    """What an exec epoch or thread used, between two of libprobe's ResourceSamples."""
+    start: numpy.datetime64
+    stop: numpy.datetime64
+    user_cpu: numpy.timedelta64
+    system_cpu: numpy.timedelta64
+    # Peak resident set size of the process up to the stop, in KiB
+    max_rss_kib: int
+    # Blocks of 512 bytes
+    blocks_in: int
+    blocks_out: int
+
+    @property
+    def wall_time(self) -> numpy.timedelta64:
+        return self.stop - self.start
+
+    @property
+    def cpu_time(self) -> numpy.timedelta64:
+        return self.user_cpu + self.system_cpu
+
+    @staticmethod
+    def between(start: ops.ResourceSample, stop: ops.ResourceSample) -> ResourceUsage:
+        return ResourceUsage(
+            numpy.datetime64(start.time.tv_sec * int(1e9) + start.time.tv_nsec, "ns"),
+            numpy.datetime64(stop.time.tv_sec * int(1e9) + stop.time.tv_nsec, "ns"),
+            numpy.timedelta64(stop.user_cpu_us - start.user_cpu_us, "us"),
+            numpy.timedelta64(stop.system_cpu_us - start.system_cpu_us, "us"),
+            stop.max_rss_kib,
+            stop.blocks_in - start.blocks_in,
+            stop.blocks_out - start.blocks_out,
+        )
+
 
 class InvalidProbeLog(Exception):
     pass
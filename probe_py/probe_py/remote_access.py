@@ -5,10 +5,11 @@ from probe_py.persistent_provenance import (
     InodeVersion,
     InodeMetadata,
     get_prov_upstream,
+    open_store,
+    put_provenance,
     Process,
 )
 import itertools
-import xdg_base_dirs
 import random
 import datetime
 import json
@@ -18,10 +19,6 @@ import subprocess
 import pathlib
 import typing
 
-PROBE_HOME = xdg_base_dirs.xdg_data_home() / "PROBE"
-PROCESS_ID_THAT_WROTE_INODE_VERSION = PROBE_HOME / "process_id_that_wrote_inode_version"
-PROCESSES_BY_ID = PROBE_HOME / "processes_by_id"
-
 @dataclasses.dataclass(frozen=True)
 class Host:
     network_name: str | None
@@ -52,13 +49,15 @@ class HostPath:
 
 def copy_provenance(source: HostPath, destination: HostPath, cmd: tuple[str, ...]) -> None:
     provenance_info_source = lookup_provenance_source(source)
+    # The processes of a local source came from our own database, so they are already stored here
+    stored_process_ids = frozenset(provenance_info_source[2]) if source.host.local else frozenset()
     provenance_info_destination = lookup_provenance_destination(source, destination)
     provenance_info = augment_provenance(provenance_info_source, provenance_info_destination, cmd)
     # TODO: Support uploading all the provenance_info from multiple sources at once
     # Either copy_provenance should take multiple sources
     # Or it should return the provenance rather than uploading it
     # so the caller can upload them all together
-    upload_provenance(destination.host, provenance_info)
+    upload_provenance(destination.host, provenance_info, stored_process_ids)
 
 
 ProvenanceInfo: typing.TypeAlias = tuple[
@@ -104,7 +103,10 @@ def augment_provenance(
         destination_provenance_info: ProvenanceInfo,
         cmd: tuple[str, ...],
 ) -> ProvenanceInfo:
-    """Given provenance_info of files on a previous host, insert nodes to represent a remote transfer to destination."""
+    """Given provenance_info of files on a previous host, insert nodes to represent a remote transfer to destination.
+
+    The transfer's process ID is only unique within the returned process closure; uploading the provenance records it under a new ID.
+    """
     source_inode_versions, source_inode_metadatas, process_closure, inode_writes = source_provenance_info
     destination_inode_versions, destination_inode_metadatas, _process_closure, _inode_writes = destination_provenance_info
     scp_process_id = generate_random_pid()
@@ -124,20 +126,16 @@ def augment_provenance(
         pathlib.Path(),
     )
     process_closure[scp_process_id] = scp_process
-    process_path = PROCESSES_BY_ID / f"{str(scp_process_id)}.json"
-    os.makedirs(process_path.parent, exist_ok=True)
-    with process_path.open("w") as f:
-        json.dump(scp_process.to_dict(), f)
     for destination_inode_version in destination_inode_versions:
         inode_writes[destination_inode_version] = scp_process_id
 
     return destination_inode_versions, destination_inode_metadatas , process_closure, inode_writes
 
-def upload_provenance(dest: Host, provenance_info: ProvenanceInfo) -> None:
+def upload_provenance(dest: Host, provenance_info: ProvenanceInfo, stored_process_ids: typing.Container[int] = frozenset()) -> None:
     if dest.local:
-        upload_provenance_local(provenance_info)
+        upload_provenance_local(provenance_info, stored_process_ids)
     else:
-        upload_provenance_remote(dest, provenance_info)
+        upload_provenance_remote(dest, provenance_info, stored_process_ids)
 
 def create_directories_on_remote(remote_home: pathlib.Path, remote: Host, ssh_options: list[str]) -> None:
     remote_directories = [
@@ -288,32 +286,26 @@ def lookup_provenance_remote(host: Host, path: pathlib.Path, get_persistent_prov
     return inode_versions, inode_metadatas, {}, {}
 
 
-def upload_provenance_local(provenance_info: ProvenanceInfo) -> None:
+def upload_provenance_local(provenance_info: ProvenanceInfo, stored_process_ids: typing.Container[int] = frozenset()) -> None:
     destination_inode_versions, destination_inode_metadatas, augmented_process_closure, augmented_inode_writes = provenance_info
 
-    for inode_version, process_id in augmented_inode_writes.items():
-        inode_version_path = PROCESS_ID_THAT_WROTE_INODE_VERSION / f"{inode_version.str_id()}.json"
-        with inode_version_path.open("w") as f:
-            json.dump(process_id if process_id is not None else None, f)
-
-    for process_id, process in augmented_process_closure.items():
-        process_path = PROCESSES_BY_ID / f"{process_id}.json"
-        with process_path.open("w") as f:
-            json.dump(process.to_dict(), f)
+    with open_store() as session:
+        put_provenance(session, augmented_process_closure, augmented_inode_writes, stored_process_ids)
 
 
-def upload_provenance_remote(dest: Host, provenance_info: ProvenanceInfo) -> None:
+def upload_provenance_remote(dest: Host, provenance_info: ProvenanceInfo, stored_process_ids: typing.Container[int] = frozenset()) -> None:
     destination_inode_versions, destination_inode_metadatas, augmented_process_closure, augmented_inode_writes = provenance_info
 
-    for inode_version, process_id in augmented_inode_writes.items():
-        if inode_version not in destination_inode_versions:
-            continue
-        inode_version_path = PROCESS_ID_THAT_WROTE_INODE_VERSION / f"{inode_version.str_id()}.json"
-        os.makedirs(inode_version_path.parent, exist_ok=True)
-        with inode_version_path.open("w") as f:
-            json.dump(process_id if process_id is not None else None, f)
+    # We also keep who wrote the destination's files, which records the transfer here too
+    with open_store() as session:
+        put_provenance(session, augmented_process_closure, {
+            inode_version: process_id
+            for inode_version, process_id in augmented_inode_writes.items()
+            if inode_version in destination_inode_versions
+        }, stored_process_ids)
     address = dest.get_address()
     assert address is not None
+    # The remote may not have Python, so we write the directory layout, which its PROBE imports into its database.
     echo_commands = []
     for inode_version, process_id in augmented_inode_writes.items():
         inode_version_str_id = inode_version.str_id()
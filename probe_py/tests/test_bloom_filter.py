@@ -0,0 +1,17 @@
+import pathlib
+from probe_py.bloom_filter import BloomFilter
+
+
+def test_bloom_filter(tmp_path: pathlib.Path) -> None:
+    members = [f"member {i}".encode() for i in range(10_000)]
+    non_members = [f"non-member {i}".encode() for i in range(10_000)]
+    bloom_filter = BloomFilter(len(members))
+    bloom_filter.add(members)
+    assert bloom_filter.might_contain(members).all()
+    # About 1% at the default 10 bits per item
+    assert bloom_filter.might_contain(non_members).mean() < 0.02
+
+    bloom_filter.save(tmp_path / "filter")
+    loaded = BloomFilter.load(tmp_path / "filter")
+    assert loaded.count == len(members)
+    assert (loaded.might_contain(members + non_members) == bloom_filter.might_contain(members + non_members)).all()
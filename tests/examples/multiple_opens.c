@@ -0,0 +1,37 @@
+#include <stdio.h>
+#include <assert.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <stdlib.h>
+#include <string.h>
+
+int main (int argc, char **argv) {
+    if (argc != 4) {
+        fprintf(stderr, "Usage: %s <repetitions> <read|write|truncate> <file>\n", argv[0]);
+        exit(1);
+    }
+    size_t repetitions = atol(argv[1]);
+    const char* mode = argv[2];
+    const char* fname = argv[3];
+    assert(repetitions != 0);
+
+    int flags;
+    if (strcmp(mode, "read") == 0) {
+        flags = O_RDONLY;
+    } else if (strcmp(mode, "write") == 0) {
+        flags = O_WRONLY | O_CREAT;
+    } else if (strcmp(mode, "truncate") == 0) {
+        flags = O_WRONLY | O_CREAT | O_TRUNC;
+    } else {
+        fprintf(stderr, "Unknown mode %s\n", mode);
+        exit(1);
+    }
+
+    for (size_t i = 0; i < repetitions; ++i) {
+        int fd = open(fname, flags, 0644);
+        assert(fd >= 0);
+        close(fd);
+    }
+
+    return 0;
+}
@@ -10,6 +10,9 @@ import dataclasses
 import typing
 import errno
 import pathlib
+import statistics
+import sys
+import tempfile
 
 @dataclasses.dataclass
 class Result:
@@ -159,7 +162,153 @@ def benchmark_with_transcription(commands_to_run: list[list[str]], warmup_count:
 
             cleanup()
 
-if __name__ == "__main__":
+def benchmark_open_overhead(n_opens: int, warmup_count: int, benchmark_count: int) -> None:
+    """Measure the per-open overhead of `probe record` for each kind of open and each copy-files mode.
+
+    Run this against two builds of libprobe to compare the open path before and after a change.
+    """
+    example = pathlib.Path("tests/examples/multiple_opens.exe").resolve()
+    with open('open_benchmark_results.csv', mode='w', newline='') as csv_file, tempfile.TemporaryDirectory() as tmpdir:
+        target = pathlib.Path(tmpdir) / "target"
+        writer = csv.DictWriter(csv_file, fieldnames=[
+            'Open Mode', 'Copy Files', 'Opens', 'Native Duration', 'Record Duration', 'Overhead per open (us)',
+        ])
+        writer.writeheader()
+        for open_mode in ["read", "write", "truncate"]:
+            target.write_text("hello world\n")
+            command = [str(example), str(n_opens), open_mode, str(target)]
+            native = statistics.median(
+                result.duration
+                for result in benchmark_command(command, warmup_count, benchmark_count, False)
+            )
+            for copy_files in ["none", "lazily", "eagerly"]:
+                record_command = ["probe", "record", "--no-transcribe", "--copy-files", copy_files] + command
+                record = statistics.median(
+                    result.duration
+                    for result in benchmark_command(record_command, warmup_count, benchmark_count, False)
+                )
+                overhead_us = (record - native) / n_opens * 1e6
+                print(f"  {open_mode} --copy-files={copy_files}: {overhead_us:.2f}us per open")
+                writer.writerow({
+                    'Open Mode': open_mode,
+                    'Copy Files': copy_files,
+                    'Opens': n_opens,
+                    'Native Duration': native,
+                    'Record Duration': record,
+                    'Overhead per open (us)': f"{overhead_us:.3f}",
+                })
+        cleanup()
+
+ARENA_SYSCALLS = ["openat", "ftruncate", "mmap", "munmap", "msync", "close"]
+
+def count_syscalls(command: list[str], syscalls: list[str]) -> int | None:
+    """Count the calls to syscalls made by command and its descendants with `strace -c`, or None without strace."""
+    if shutil.which("strace") is None:
+        return None
+    with tempfile.NamedTemporaryFile(mode="r", suffix=".strace") as summary:
+        proc = subprocess.run(
+            ["strace", "-f", "-c", "-o", summary.name, "-e", "trace=" + ",".join(syscalls), *command],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if proc.returncode != 0:
+            print(proc.stderr.decode())
+        # % time, seconds, usecs/call, calls, errors, syscall
+        for line in summary:
+            fields = line.split()
+            if fields and fields[-1] == "total":
+                return int(fields[3])
+    return 0
+
+def benchmark_arena_sizes(n_opens: int, benchmark_count: int) -> None:
+    """Count the arena files of one op-heavy recording, and the syscalls that create and flush arenas, under several arena sizings.
+
+    The syscalls (see ARENA_SYSCALLS) are counted in a separate run under strace, so they slow down none of the timed runs.
+    They include those of the recorded command, which are the same under every sizing.
+    Setting the initial size equal to the max size reproduces fixed-size arenas.
+    """
+    example = pathlib.Path("tests/examples/multiple_opens.exe").resolve()
+    sizings = [
+        (64 * 1024, 64 * 1024),
+        (16 * 1024, 16 * 1024 * 1024),
+        (4 * 1024, 64 * 1024 * 1024),
+    ]
+    with open('arena_benchmark_results.csv', mode='w', newline='') as csv_file, tempfile.TemporaryDirectory() as tmpdir:
+        target = pathlib.Path(tmpdir) / "target"
+        target.write_text("hello world\n")
+        writer = csv.DictWriter(csv_file, fieldnames=[
+            'Initial Size', 'Max Size', 'Arena Files', 'Arena Bytes', 'Arena Syscalls', 'Record Duration',
+        ])
+        writer.writeheader()
+        for initial_size, max_size in sizings:
+            command = [
+                "probe", "record", "--no-transcribe", "--output", str(PROBE_RECORD_DIR),
+                "--arena-initial-size", str(initial_size), "--arena-max-size", str(max_size),
+                str(example), str(n_opens), "read", str(target),
+            ]
+            cleanup()
+            syscalls = count_syscalls(command, ARENA_SYSCALLS)
+            durations = []
+            for _ in range(benchmark_count):
+                cleanup()
+                result = resource_call(command)
+                if result.returncode != 0:
+                    print(result.stderr)
+                durations.append(result.duration)
+            arenas = list(PROBE_RECORD_DIR.glob("pids/*/*/*/*/*.dat"))
+            arena_bytes = sum(arena.stat().st_size for arena in arenas)
+            print(f"  initial={initial_size} max={max_size}: {len(arenas)} arena files, {arena_bytes} bytes, {syscalls} syscalls")
+            writer.writerow({
+                'Initial Size': initial_size,
+                'Max Size': max_size,
+                'Arena Files': len(arenas),
+                'Arena Bytes': arena_bytes,
+                'Arena Syscalls': "" if syscalls is None else syscalls,
+                'Record Duration': statistics.median(durations),
+            })
+        cleanup()
+
+def benchmark_flush_modes(n_execs: int, warmup_count: int, benchmark_count: int) -> None:
+    """Compare `probe record --flush=sync` and `--flush=async` on an exec-heavy shell loop.
+
+    Every exec flushes the arenas of the exec-ing process, so this workload is dominated by flush latency.
+    """
+    command = ["sh", "-c", f"for i in $(seq {n_execs}); do /bin/true; done"]
+    with open('flush_benchmark_results.csv', mode='w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=[
+            'Flush Mode', 'Execs', 'Record Duration', 'Latency per exec (us)',
+        ])
+        writer.writeheader()
+        native = statistics.median(
+            result.duration
+            for result in benchmark_command(command, warmup_count, benchmark_count, False)
+        )
+        for flush_mode in ["sync", "async"]:
+            record_command = ["probe", "record", "--no-transcribe", "--flush", flush_mode] + command
+            record = statistics.median(
+                result.duration
+                for result in benchmark_command(record_command, warmup_count, benchmark_count, False)
+            )
+            latency_us = (record - native) / n_execs * 1e6
+            print(f"  --flush={flush_mode}: {latency_us:.2f}us per exec")
+            writer.writerow({
+                'Flush Mode': flush_mode,
+                'Execs': n_execs,
+                'Record Duration': record,
+                'Latency per exec (us)': f"{latency_us:.3f}",
+            })
+        cleanup()
+
+if __name__ == "__main__" and sys.argv[1:] == ["opens"]:
+    os.chdir(pathlib.Path(__file__).resolve().parent.parent)
+    benchmark_open_overhead(n_opens=100_000, warmup_count=1, benchmark_count=5)
+elif __name__ == "__main__" and sys.argv[1:] == ["arenas"]:
+    os.chdir(pathlib.Path(__file__).resolve().parent.parent)
+    benchmark_arena_sizes(n_opens=100_000, benchmark_count=5)
+elif __name__ == "__main__" and sys.argv[1:] == ["flush"]:
+    os.chdir(pathlib.Path(__file__).resolve().parent.parent)
+    benchmark_flush_modes(n_execs=1_000, warmup_count=1, benchmark_count=5)
+elif __name__ == "__main__":
     commands = [
         ["ls", "-l"],
         ["echo", "Hello World"],
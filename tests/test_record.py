@@ -6,6 +6,7 @@ import shutil
 import shlex
 import subprocess
 import typing
+import numpy
 import pytest
 
 
@@ -359,3 +360,297 @@ def test_fail(
     cmd = ["probe", "record", "--copy-files", "none", str(example_path / "false.exe")]
     proc = subprocess.run(cmd, check=False, cwd=scratch_directory)
     assert proc.returncode != 0
+
+
+def test_summary(
+        scratch_directory: pathlib.Path,
+) -> None:
+    from probe_py import parser, ptypes, headers as ops
+    test_file = scratch_directory / "test_file.txt"
+    test_file.write_text("hello world")
+    cmd = ["probe", "record", "--summary", "--summary-interval=0", "cat", "test_file.txt", "test_file.txt", "test_file.txt"]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory)
+
+    probe_log = parser.parse_probe_log(scratch_directory / "probe_log")
+    assert not any(isinstance(op.data, (ops.Open, ops.Stat)) for _, op in probe_log.ops())
+    inode = ptypes.InodeVersion.from_local_path(test_file).inode
+    summaries = [
+        summary
+        for (_, summary_inode), summary in probe_log.access_summaries().items()
+        if summary_inode == inode
+    ]
+    assert len(summaries) == 1
+    assert summaries[0].n_reads == 3
+    assert summaries[0].access_modes == {ptypes.AccessMode.READ}
+
+
+def test_summary_dataflow_graph(
+        scratch_directory: pathlib.Path,
+) -> None:
+    (scratch_directory / "test_file.txt").write_text("hello world")
+    cmd = ["probe", "record", "--summary", "cat", "test_file.txt"]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory)
+
+    # A summary log has no Open ops, so the dataflow graph can't be built; it should say so rather than crash or be empty
+    cmd = ["probe", "py", "export", "dataflow-graph"]
+    print(shlex.join(cmd))
+    proc = subprocess.run(cmd, check=False, cwd=scratch_directory, capture_output=True, text=True)
+    assert proc.returncode == 1
+    assert "--summary" in proc.stderr
+    assert not (scratch_directory / "dataflow-graph.dot").exists()
+
+
+def test_max_size(
+        scratch_directory: pathlib.Path,
+) -> None:
+    from probe_py import parser, headers as ops
+    (scratch_directory / "test_file.txt").write_text("hello world")
+    n_opens = 20_000
+    cmd = [
+        "probe", "record", "--copy-files=none",
+        "--arena-initial-size=4096", "--arena-max-size=65536", "--max-size=262144",
+        "cat", *(["test_file.txt"] * n_opens),
+    ]
+    print(shlex.join(cmd[:8]), "...")
+    subprocess.run(cmd, check=True, cwd=scratch_directory, stdout=subprocess.DEVNULL)
+
+    probe_log = parser.parse_probe_log(scratch_directory / "probe_log")
+    assert probe_log.n_dropped_ops() > 0
+    n_opens_recorded = sum(isinstance(op.data, ops.Open) for _, op in probe_log.ops())
+    assert n_opens_recorded < n_opens
+    assert not any(isinstance(op.data, ops.DroppedOps) for _, op in probe_log.ops())
+    # Process ops are never dropped
+    assert any(
+        isinstance(op.data, ops.InitExecEpoch) and op.data.argv[0] == b"cat"
+        for _, op in probe_log.ops()
+    )
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip:1", "gzip:9", "zstd:3"])
+def test_compression(
+        scratch_directory: pathlib.Path,
+        compression: str,
+) -> None:
+    from probe_py import parser, headers as ops
+    (scratch_directory / "test_file.txt").write_text("hello world")
+    cmd = ["probe", "record", "--copy-files=none", f"--compression={compression}", "--jobs=2", "cat", "test_file.txt"]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory)
+
+    probe_log = parser.parse_probe_log(scratch_directory / "probe_log")
+    assert any(isinstance(op.data, ops.Open) for _, op in probe_log.ops())
+
+
+def test_blob_store(
+        scratch_directory: pathlib.Path,
+) -> None:
+    from probe_py import blob_store, parser, ptypes
+    test_file = scratch_directory / "test_file.txt"
+    test_file.write_text("hello world")
+    store_dir = scratch_directory / "store"
+    probe_logs = [scratch_directory / "probe_log_0", scratch_directory / "probe_log_1"]
+    for probe_log in probe_logs:
+        cmd = ["probe", "record", "--copy-files=eagerly", f"--output={probe_log}", "cat", "test_file.txt"]
+        print(shlex.join(cmd))
+        subprocess.run(cmd, check=True, cwd=scratch_directory)
+        cmd = ["probe", "py", "blobs", "check-in", f"--store={store_dir}", f"--probe-log={probe_log}"]
+        print(shlex.join(cmd))
+        subprocess.run(cmd, check=True, cwd=scratch_directory)
+
+    store = blob_store.BlobStore(store_dir)
+    test_file_version = ptypes.InodeVersion.from_local_path(test_file)
+    digests: set[str] = set()
+    for probe_log in probe_logs:
+        with parser.parse_probe_log_ctx(probe_log) as probe_log_obj:
+            # The inode versions in copied_files don't know the file's mode
+            copies = [
+                copy
+                for inode_version, copy in probe_log_obj.copied_files.items()
+                if (inode_version.inode.number, inode_version.mtime) == (test_file_version.inode.number, test_file_version.mtime)
+            ]
+            assert [copy.read_text() for copy in copies] == ["hello world"]
+        refs = blob_store.read_blob_refs(probe_log)
+        assert refs is not None
+        digests.update(refs.digests.values())
+    # Both recordings copied the same files, so they share every blob
+    assert all(store.ref_count(digest) == 2 for digest in digests)
+
+    for probe_log in probe_logs:
+        subprocess.run(["probe", "py", "blobs", "release", f"--store={store_dir}", f"--probe-log={probe_log}"], check=True)
+    assert store.gc()[0] == len(digests)
+    assert not any(store.blob_path(digest).exists() for digest in digests)
+
+
+def test_copy_files_rewritten(
+        scratch_directory: pathlib.Path,
+) -> None:
+    from probe_py import parser
+    test_file = scratch_directory / "test_file.txt"
+    test_file.write_text("first")
+    # Different processes read each version, so the inode table flags the inode before the second is read
+    cmd = ["probe", "record", "--copy-files=eagerly", *bash_multi(
+        ["cat", "test_file.txt"],
+        ["echo", "second-version", "redirect_to", "test_file.txt"],
+        ["cat", "test_file.txt"],
+    )]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory, stdout=subprocess.DEVNULL)
+
+    with parser.parse_probe_log_ctx(scratch_directory / "probe_log") as probe_log:
+        copies = {
+            copy.read_text()
+            for inode_version, copy in probe_log.copied_files.items()
+            if inode_version.inode.number == test_file.stat().st_ino
+        }
+        assert copies == {"first", "second-version\n"}
+
+
+def test_copy_files_async(
+        scratch_directory: pathlib.Path,
+) -> None:
+    from probe_py import parser, ptypes
+    test_file = scratch_directory / "test_file.txt"
+    test_file.write_text("hello world" * 1000)
+    cmd = ["probe", "record", "--copy-files=eagerly", "--copy-files-async-min-size=1", "cat", "test_file.txt"]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory, stdout=subprocess.DEVNULL)
+
+    test_file_version = ptypes.InodeVersion.from_local_path(test_file)
+    with parser.parse_probe_log_ctx(scratch_directory / "probe_log") as probe_log:
+        copies = [
+            copy
+            for inode_version, copy in probe_log.copied_files.items()
+            if (inode_version.inode.number, inode_version.mtime) == (test_file_version.inode.number, test_file_version.mtime)
+        ]
+        # The copier thread finished before cat exited
+        assert [copy.read_text() for copy in copies] == ["hello world" * 1000]
+
+
+def test_resource_usage(
+        scratch_directory: pathlib.Path,
+) -> None:
+    from probe_py import parser
+    cmd = ["probe", "record", "sh", "-c", "head --bytes=10000000 /dev/urandom | sha256sum"]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory, stdout=subprocess.DEVNULL)
+
+    probe_log = parser.parse_probe_log(scratch_directory / "probe_log")
+    usage = probe_log.exec_resource_usage()
+    assert usage
+    for exec_pair, exec_usage in usage.items():
+        assert exec_usage.start <= exec_usage.stop, exec_pair
+        assert exec_usage.cpu_time >= numpy.timedelta64(0), exec_pair
+        assert exec_usage.max_rss_kib > 0, exec_pair
+    # Hashing 10MB takes some CPU
+    assert sum((exec_usage.cpu_time for exec_usage in usage.values()), numpy.timedelta64(0, "us")) > numpy.timedelta64(0, "us")
+
+
+def test_perf_profile(
+        scratch_directory: pathlib.Path,
+) -> None:
+    import json
+    cmd = ["probe", "record", "sh", "-c", "head --bytes=10000000 /dev/urandom | sha256sum & head --bytes=10000000 /dev/urandom | md5sum & wait"]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory, stdout=subprocess.DEVNULL)
+
+    cmd = ["probe", "py", "export", "perf-profile", "perf-profile.json"]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory)
+    profile = json.loads((scratch_directory / "perf-profile.json").read_text())
+    assert 0 < profile["critical_path_cpu_time"] <= profile["work"]
+    assert profile["critical_path"]
+    assert profile["max_parallelism"] >= 2
+    assert all(1 <= bound <= cpus for cpus, bound in ((int(cpus), bound) for cpus, bound in profile["speedup_bounds"].items()))
+
+    cmd = ["probe", "py", "export", "perf-profile", "--format=folded", "perf-profile.folded"]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory)
+    stacks = (scratch_directory / "perf-profile.folded").read_text().splitlines()
+    frames = [line.rpartition(" ")[0].split(";") for line in stacks]
+    assert any(frame[0] == "sh" and frame[-1] == "sha256sum" for frame in frames)
+
+
+def test_store_dataflow_graph(
+        scratch_directory: pathlib.Path,
+) -> None:
+    import sqlite3
+    (scratch_directory / "input").write_text("hello\n")
+    cmd = ["probe", "record", *bash_multi(["cp", "input", "middle"], ["sort", "middle", "redirect_to", "output"])]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory)
+
+    env = {**os.environ, "XDG_DATA_HOME": str(scratch_directory / "data")}
+    cmd = ["probe", "py", "export", "store-dataflow-graph"]
+    for _ in range(2):
+        print(shlex.join(cmd))
+        subprocess.run(cmd, check=True, cwd=scratch_directory, env=env)
+
+    db = sqlite3.connect(scratch_directory / "data" / "PROBE" / "provenance.db")
+    writes = db.execute("""
+        SELECT path, cmd
+        FROM process_that_writes JOIN process ON process_that_writes.process_id = process.process_id
+    """).fetchall()
+    # Ingesting the same log again does not record the same inode versions again
+    middle_writers = [cmd for path, cmd in writes if pathlib.Path(path).name == "middle"]
+    assert len(middle_writers) == 1 and middle_writers[0].startswith("cp ")
+    reads = db.execute("""
+        SELECT path, cmd
+        FROM process_inputs JOIN process ON process_inputs.process_id = process.process_id
+    """).fetchall()
+    assert any(pathlib.Path(path).name == "middle" and cmd.startswith("sort ") for path, cmd in reads)
+    # Nor the same exec epochs and their inputs
+    assert len([cmd for (cmd,) in db.execute("SELECT cmd FROM process") if cmd.startswith("sort ")]) == 1
+    assert len([cmd for path, cmd in reads if pathlib.Path(path).name == "middle"]) == 1
+
+
+def test_lineage(
+        scratch_directory: pathlib.Path,
+) -> None:
+    (scratch_directory / "input").write_text("hello\n")
+    env = {**os.environ, "XDG_DATA_HOME": str(scratch_directory / "data")}
+    for cmds in [[["cp", "input", "middle"]], [["sort", "middle", "redirect_to", "output"]]]:
+        # Separate recordings, so only the persistent provenance connects them
+        cmd = ["probe", "record", "--overwrite", *bash_multi(*cmds)]
+        print(shlex.join(cmd))
+        subprocess.run(cmd, check=True, cwd=scratch_directory)
+        cmd = ["probe", "py", "export", "store-dataflow-graph"]
+        print(shlex.join(cmd))
+        subprocess.run(cmd, check=True, cwd=scratch_directory, env=env)
+
+    cmd = ["probe", "py", "lineage", "output"]
+    print(shlex.join(cmd))
+    upstream = subprocess.run(cmd, check=True, cwd=scratch_directory, env=env, capture_output=True, text=True).stdout
+    assert "cp input middle" in upstream
+    assert "sort middle" in upstream
+
+    cmd = ["probe", "py", "lineage", "--downstream", "input"]
+    print(shlex.join(cmd))
+    downstream = subprocess.run(cmd, check=True, cwd=scratch_directory, env=env, capture_output=True, text=True).stdout
+    assert "sort middle" in downstream
+
+
+def test_gc(
+        scratch_directory: pathlib.Path,
+) -> None:
+    import sqlite3
+    (scratch_directory / "input").write_text("hello\n")
+    env = {**os.environ, "XDG_DATA_HOME": str(scratch_directory / "data")}
+    cmd = ["probe", "record", *bash_multi(["cp", "input", "middle"], ["sort", "middle", "redirect_to", "output"])]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory)
+    cmd = ["probe", "py", "export", "store-dataflow-graph"]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory, env=env)
+
+    # Nothing that exists anymore was derived from sort, but middle is still there
+    (scratch_directory / "output").unlink()
+    cmd = ["probe", "py", "gc", "--keep-days", "0"]
+    print(shlex.join(cmd))
+    subprocess.run(cmd, check=True, cwd=scratch_directory, env=env)
+
+    db = sqlite3.connect(scratch_directory / "data" / "PROBE" / "provenance.db")
+    cmds = [cmd for (cmd,) in db.execute("SELECT cmd FROM process")]
+    assert any(cmd.startswith("cp ") for cmd in cmds)
+    assert not any(cmd.startswith("sort ") for cmd in cmds)